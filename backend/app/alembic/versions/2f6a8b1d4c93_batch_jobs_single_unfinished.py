@@ -0,0 +1,41 @@
+"""Batch jobs single unfinished
+
+Revision ID: 2f6a8b1d4c93
+Revises: 7c1d9e3f5a28
+Create Date: 2024-10-21 14:05:33.918274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f6a8b1d4c93'
+down_revision: Union[str, None] = '7c1d9e3f5a28'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the oldest unfinished job, the one the runner would have picked first
+    op.execute(
+        """
+        UPDATE batch_jobs
+        SET status = 'failed', error = 'Superseded by an older unfinished job', finished_at = now()
+        WHERE status IN ('pending', 'running')
+        AND id > (SELECT min(id) FROM batch_jobs WHERE status IN ('pending', 'running'))
+        """
+    )
+    op.create_index(
+        'uq_batch_jobs_unfinished',
+        'batch_jobs',
+        [sa.text("(status IN ('pending', 'running'))")],
+        unique=True,
+        postgresql_where=sa.text("status IN ('pending', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_batch_jobs_unfinished', table_name='batch_jobs')
@@ -0,0 +1,34 @@
+"""Depression risk log unique user and date
+
+Revision ID: 3c5e8a1f7b20
+Revises: 9979a30895a4
+Create Date: 2024-10-14 10:12:37.481920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c5e8a1f7b20'
+down_revision: Union[str, None] = '9979a30895a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the latest log per user and day before enforcing uniqueness
+    op.execute(
+        """
+        DELETE FROM depression_risk_logs a
+        USING depression_risk_logs b
+        WHERE a.user_id = b.user_id AND a.date = b.date AND a.id < b.id
+        """
+    )
+    op.create_unique_constraint('uq_depression_risk_logs_user_id_date', 'depression_risk_logs', ['user_id', 'date'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_depression_risk_logs_user_id_date', 'depression_risk_logs', type_='unique')
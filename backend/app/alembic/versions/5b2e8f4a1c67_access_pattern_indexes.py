@@ -0,0 +1,55 @@
+"""Access pattern indexes
+
+Revision ID: 5b2e8f4a1c67
+Revises: e4a9c7d2b615
+Create Date: 2024-10-18 10:22:47.318054
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e8f4a1c67'
+down_revision: Union[str, None] = 'e4a9c7d2b615'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_mood_entries_patient_data_id_date_desc', 'mood_entries', ['patient_data_id', sa.text('date DESC'), sa.text('id DESC')], unique=False, postgresql_include=['mood', 'eat', 'sleep'])
+    op.create_index('ix_journal_entries_patient_data_id_date_desc', 'journal_entries', ['patient_data_id', sa.text('date DESC'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_guided_journal_entries_patient_data_id_date_desc', 'guided_journal_entries', ['patient_data_id', sa.text('date DESC'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_chat_messages_sender_id_recipient_id_timestamp', 'chat_messages', ['sender_id', 'recipient_id', 'timestamp', 'id'], unique=False)
+
+    # Covered by the indexes above, or by the primary key for ix_chat_messages_id
+    op.drop_index('ix_mood_entries_patient_data_id', table_name='mood_entries')
+    op.drop_index('ix_mood_entries_date_desc', table_name='mood_entries')
+    op.drop_index('ix_mood_entries_date', table_name='mood_entries')
+    op.drop_index('ix_journal_entries_patient_data_id', table_name='journal_entries')
+    op.drop_index('ix_journal_entries_date_desc', table_name='journal_entries')
+    op.drop_index('ix_journal_entries_date', table_name='journal_entries')
+    op.drop_index('ix_guided_journal_entries_patient_data_id', table_name='guided_journal_entries')
+    op.drop_index('ix_guided_journal_entries_date_desc', table_name='guided_journal_entries')
+    op.drop_index('ix_guided_journal_entries_date', table_name='guided_journal_entries')
+    op.drop_index('ix_chat_messages_id', table_name='chat_messages')
+
+
+def downgrade() -> None:
+    op.create_index('ix_chat_messages_id', 'chat_messages', ['id'], unique=False)
+    op.create_index('ix_guided_journal_entries_date', 'guided_journal_entries', ['date'], unique=False)
+    op.create_index('ix_guided_journal_entries_date_desc', 'guided_journal_entries', [sa.text('date DESC')], unique=False)
+    op.create_index('ix_guided_journal_entries_patient_data_id', 'guided_journal_entries', ['patient_data_id'], unique=False)
+    op.create_index('ix_journal_entries_date', 'journal_entries', ['date'], unique=False)
+    op.create_index('ix_journal_entries_date_desc', 'journal_entries', [sa.text('date DESC')], unique=False)
+    op.create_index('ix_journal_entries_patient_data_id', 'journal_entries', ['patient_data_id'], unique=False)
+    op.create_index('ix_mood_entries_date', 'mood_entries', ['date'], unique=False)
+    op.create_index('ix_mood_entries_date_desc', 'mood_entries', [sa.text('date DESC')], unique=False)
+    op.create_index('ix_mood_entries_patient_data_id', 'mood_entries', ['patient_data_id'], unique=False)
+
+    op.drop_index('ix_chat_messages_sender_id_recipient_id_timestamp', table_name='chat_messages')
+    op.drop_index('ix_guided_journal_entries_patient_data_id_date_desc', table_name='guided_journal_entries')
+    op.drop_index('ix_journal_entries_patient_data_id_date_desc', table_name='journal_entries')
+    op.drop_index('ix_mood_entries_patient_data_id_date_desc', table_name='mood_entries')
@@ -0,0 +1,56 @@
+"""Chat threads
+
+Revision ID: 7c1d9e3f5a28
+Revises: 5b2e8f4a1c67
+Create Date: 2024-10-19 09:41:12.604318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c1d9e3f5a28'
+down_revision: Union[str, None] = '5b2e8f4a1c67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('chat_threads',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('other_user_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_sender_id', sa.Integer(), nullable=True),
+    sa.Column('last_message', sa.String(), nullable=True),
+    sa.Column('last_timestamp', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False),
+    sa.ForeignKeyConstraint(['other_user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'other_user_id')
+    )
+    # One thread per side of every existing conversation, with its last message. Nothing
+    # tracked reads before, so existing messages count as read.
+    op.execute(
+        """
+        INSERT INTO chat_threads
+            (user_id, other_user_id, last_message_id, last_sender_id, last_message, last_timestamp, unread_count)
+        SELECT DISTINCT ON (user_id, other_user_id)
+            user_id, other_user_id, id, sender_id, content, timestamp, 0
+        FROM (
+            SELECT sender_id AS user_id, recipient_id AS other_user_id, id, sender_id, content, timestamp
+            FROM chat_messages
+            UNION ALL
+            SELECT recipient_id, sender_id, id, sender_id, content, timestamp
+            FROM chat_messages
+        ) AS sides
+        WHERE user_id IS NOT NULL AND other_user_id IS NOT NULL
+        ORDER BY user_id, other_user_id, timestamp DESC, id DESC
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_threads')
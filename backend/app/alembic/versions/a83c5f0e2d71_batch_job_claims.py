@@ -0,0 +1,28 @@
+"""Batch job claims
+
+Revision ID: a83c5f0e2d71
+Revises: 2f6a8b1d4c93
+Create Date: 2024-10-21 15:48:09.270631
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83c5f0e2d71'
+down_revision: Union[str, None] = '2f6a8b1d4c93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('batch_jobs', sa.Column('claimed_by', sa.String(), nullable=True))
+    op.add_column('batch_jobs', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('batch_jobs', 'heartbeat_at')
+    op.drop_column('batch_jobs', 'claimed_by')
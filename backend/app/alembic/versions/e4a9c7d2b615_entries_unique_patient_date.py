@@ -0,0 +1,38 @@
+"""Entries unique patient and date
+
+Revision ID: e4a9c7d2b615
+Revises: d71f3b0c5e92
+Create Date: 2024-10-17 14:05:31.902417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9c7d2b615'
+down_revision: Union[str, None] = 'd71f3b0c5e92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ['mood_entries', 'journal_entries', 'guided_journal_entries']
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        # Keep only the latest entry per patient and day before enforcing uniqueness
+        op.execute(
+            f"""
+            DELETE FROM {table} a
+            USING {table} b
+            WHERE a.patient_data_id = b.patient_data_id AND a.date = b.date AND a.id < b.id
+            """
+        )
+        op.create_unique_constraint(f'uq_{table}_patient_data_id_date', table, ['patient_data_id', 'date'])
+
+
+def downgrade() -> None:
+    for table in reversed(TABLES):
+        op.drop_constraint(f'uq_{table}_patient_data_id_date', table, type_='unique')
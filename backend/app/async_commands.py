@@ -0,0 +1,246 @@
+from datetime import datetime
+from typing import FrozenSet, List, Optional, Tuple
+from sqlalchemy import func, insert, or_, select, text, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app import commands, models, schemas
+from app.patient_cache import patient_cache
+
+# Async versions of the commands used by the async routes. Lazy loading does not work
+# on an AsyncSession, so every relationship a caller reads has to be loaded up front.
+
+async def get_user_by_id(db: AsyncSession, user_id: int) -> Optional[models.User]:
+    """
+    Get user by ID, with their patient and therapist data loaded in the same query
+    :param db (AsyncSession): Database session
+    :param user_id (int): User ID
+    :return (Optional[models.User]): User if found, None if not found
+    """
+    result = await db.execute(
+        select(models.User)
+        .filter(models.User.id == user_id)
+        .options(
+            joinedload(models.User.patient_data),
+            joinedload(models.User.therapist_data),
+        )
+    )
+    return result.scalars().first()
+
+
+async def get_patient_ids_by_therapist(db: AsyncSession, therapist: schemas.User) -> List[int]:
+    """
+    Get the user IDs of a therapist's patients
+    :param db (AsyncSession): Database session
+    :param therapist (schemas.User): Therapist
+    :return (List[int]): Patient user IDs
+    """
+    result = await db.execute(
+        select(models.PatientData.user_id)
+        .join(models.TherapistData, models.PatientData.therapist_id == models.TherapistData.id)
+        .filter(models.TherapistData.user_id == therapist.id)
+    )
+    return list(result.scalars().all())
+
+
+async def get_cached_patient_ids_by_therapist(db: AsyncSession, therapist: schemas.User) -> FrozenSet[int]:
+    """
+    Get the user IDs of a therapist's patients from the patient cache, loading them on a miss
+    :param db (AsyncSession): Database session
+    :param therapist (schemas.User): Therapist
+    :return (FrozenSet[int]): Patient user IDs
+    """
+    patient_ids = patient_cache.get(therapist.id)
+    if patient_ids is None:
+        marker = patient_cache.marker()
+        patient_ids = patient_cache.put(therapist.id, await get_patient_ids_by_therapist(db, therapist), marker)
+    return patient_ids
+
+
+async def get_latest_depression_risk_log_by_user(
+    db: AsyncSession, user_id: int
+) -> Optional[models.DepressionRiskLog]:
+    """
+    Get the latest depression risk log by user id
+    :param db (AsyncSession): Database session
+    :param user_id (int): User ID
+    :return (Optional[models.DepressionRiskLog]): Latest depression risk log
+    """
+    result = await db.execute(
+        select(models.DepressionRiskLog)
+        .filter(models.DepressionRiskLog.user_id == user_id)
+        .order_by(models.DepressionRiskLog.date.desc())
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_depression_risk_logs_by_user(
+    db: AsyncSession, user_id: int, skip: int = 0, limit: int = 100
+) -> List[models.DepressionRiskLog]:
+    """
+    Get depression risk logs by user id
+    :param db (AsyncSession): Database session
+    :param user_id (int): User ID
+    :param skip (int): Number of entries to skip
+    :param limit (int): Number of entries to return
+    :return (List[models.DepressionRiskLog]): Depression risk logs
+    """
+    result = await db.execute(
+        select(models.DepressionRiskLog)
+        .filter(models.DepressionRiskLog.user_id == user_id)
+        .order_by(models.DepressionRiskLog.date.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def insert_chat_message(
+    db: AsyncSession, chat_message: schemas.ChatMessageCreate
+) -> models.ChatMessage:
+    """
+    Insert a chat message
+    :param db (AsyncSession): Database session
+    :param chat_message (schemas.ChatMessageCreate): Chat message create schema
+    :return (models.ChatMessage): New chat message
+    """
+    db_chat_message = models.ChatMessage(
+        sender_id=chat_message.sender_id,
+        content=chat_message.content,
+        recipient_id=chat_message.recipient_id,
+        timestamp=datetime.now()
+    )
+    db.add(db_chat_message)
+    await db.flush()
+    await db.execute(commands.chat_threads_upsert(db, [{
+        "id": db_chat_message.id,
+        "sender_id": db_chat_message.sender_id,
+        "recipient_id": db_chat_message.recipient_id,
+        "content": db_chat_message.content,
+        "timestamp": db_chat_message.timestamp,
+    }]))
+    await db.commit()
+    await db.refresh(db_chat_message)
+    return db_chat_message
+
+
+async def reserve_chat_message_ids(db: AsyncSession, count: int) -> List[int]:
+    """
+    Reserve IDs for chat messages that are inserted later
+    :param db (AsyncSession): Database session
+    :param count (int): Number of IDs
+    :return (List[int]): IDs, in increasing order
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        # No sequences in SQLite (tests), continue after the highest ID. Only safe for a
+        # single writer that also skips the IDs it has handed out but not inserted yet.
+        last_id = (await db.execute(select(func.max(models.ChatMessage.id)))).scalar() or 0
+        return list(range(last_id + 1, last_id + 1 + count))
+    result = await db.execute(
+        text("SELECT nextval(pg_get_serial_sequence('chat_messages', 'id')) FROM generate_series(1, :count)"),
+        {"count": count},
+    )
+    return sorted(result.scalars().all())
+
+
+async def insert_chat_messages(db: AsyncSession, messages: List[dict]):
+    """
+    Insert chat messages with their IDs and timestamps already assigned, in one multi-row INSERT,
+    and update their chat threads in the same transaction
+    :param db (AsyncSession): Database session
+    :param messages (List[dict]): Column values of the messages
+    """
+    await db.execute(insert(models.ChatMessage), messages)
+    await db.execute(commands.chat_threads_upsert(db, messages))
+    await db.commit()
+
+
+async def get_chat_threads(db: AsyncSession, user: schemas.User) -> List[models.ChatThread]:
+    """
+    Get a user's chat threads, with the last message and unread count of each, most recent first
+    :param db (AsyncSession): Database session
+    :param user (schemas.User): Current user
+    :return (List[models.ChatThread]): Chat threads
+    """
+    result = await db.execute(
+        select(models.ChatThread)
+        .filter(models.ChatThread.user_id == user.id)
+        .order_by(models.ChatThread.last_timestamp.desc())
+    )
+    return list(result.scalars().all())
+
+
+async def mark_chat_thread_read(db: AsyncSession, user: schemas.User, other_user_id: int) -> bool:
+    """
+    Reset the unread count of a chat thread
+    :param db (AsyncSession): Database session
+    :param user (schemas.User): Current user
+    :param other_user_id (int): ID of the other user in the conversation
+    :return (bool): True if the thread exists, False if not
+    """
+    result = await db.execute(
+        update(models.ChatThread)
+        .filter(models.ChatThread.user_id == user.id, models.ChatThread.other_user_id == other_user_id)
+        .values(unread_count=0)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def get_chat_messages(
+    db: AsyncSession, user: schemas.User, other_user_id: int, skip: int = 0, limit: int = 100
+) -> List[models.ChatMessage]:
+    """
+    Get chat messages between two users
+    :param db (AsyncSession): Database session
+    :param user (schemas.User): Current user
+    :param other_user_id (int): ID of the other user in the conversation
+    :param skip (int): Number of entries to skip
+    :param limit (int): Number of entries to return
+    :return (List[models.ChatMessage]): Chat messages
+    """
+    result = await db.execute(
+        select(models.ChatMessage)
+        .filter(
+            or_(
+                (models.ChatMessage.sender_id == user.id) & (models.ChatMessage.recipient_id == other_user_id),
+                (models.ChatMessage.sender_id == other_user_id) & (models.ChatMessage.recipient_id == user.id)
+            )
+        )
+        .order_by(models.ChatMessage.timestamp)
+        .offset(skip)
+        .limit(limit)
+    )
+    return list(result.scalars().all())
+
+
+async def get_chat_messages_page(
+    db: AsyncSession,
+    user: schemas.User,
+    other_user_id: int,
+    limit: int = 100,
+    before: Optional[Tuple[datetime, int]] = None,
+) -> List[models.ChatMessage]:
+    """
+    Get a page of chat messages between two users, newest first, by keyset on (timestamp, id)
+    :param db (AsyncSession): Database session
+    :param user (schemas.User): Current user
+    :param other_user_id (int): ID of the other user in the conversation
+    :param limit (int): Number of messages to return, one more is fetched to tell if there is a next page
+    :param before (Optional[Tuple[datetime, int]]): Timestamp and ID of the last message of the previous page
+    :return (List[models.ChatMessage]): Up to limit + 1 chat messages
+    """
+    query = select(models.ChatMessage).filter(
+        or_(
+            (models.ChatMessage.sender_id == user.id) & (models.ChatMessage.recipient_id == other_user_id),
+            (models.ChatMessage.sender_id == other_user_id) & (models.ChatMessage.recipient_id == user.id)
+        )
+    )
+    if before is not None:
+        query = query.filter(tuple_(models.ChatMessage.timestamp, models.ChatMessage.id) < tuple_(*before))
+    result = await db.execute(
+        query
+        .order_by(models.ChatMessage.timestamp.desc(), models.ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
+    return list(result.scalars().all())
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app import models
+
+
+class AuthCache:
+    """
+    Bounded TTL cache of authenticated users, keyed by user ID.
+
+    Entries are detached ORM users with patient_data and therapist_data loaded, shared
+    by every request that hits them, so they must be treated as read-only. Write
+    commands that change a user or their patient/therapist data invalidate the user.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # user ID -> (expires at, user), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: int) -> Optional[models.User]:
+        """
+        Get a cached user
+        :param user_id (int): User ID
+        :return (Optional[models.User]): Detached user if cached and not expired, None if not
+        """
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[user_id]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def marker(self) -> int:
+        """
+        Take a marker before loading a user, to pass to put
+        :return (int): Number of invalidations so far
+        """
+        with self.lock:
+            return self.invalidations
+
+    def put(self, user: models.User, marker: int):
+        """
+        Cache a detached user, unless something was invalidated since the marker was taken,
+        in which case the user may have been loaded before the write that invalidated it
+        :param user (models.User): Detached user with patient_data and therapist_data loaded
+        :param marker (int): Marker taken before the user was loaded
+        """
+        with self.lock:
+            if marker != self.invalidations:
+                return
+            self.entries[user.id] = (time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user.id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *user_ids: int):
+        """
+        Drop users from the cache after they changed
+        :param user_ids (int): User IDs
+        """
+        with self.lock:
+            self.invalidations += 1
+            for user_id in user_ids:
+                self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+auth_cache = AuthCache(
+    max_size=int(os.getenv("AUTH_CACHE_MAX_SIZE") or 10000),
+    ttl=float(os.getenv("AUTH_CACHE_TTL") or 60),
+)
@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import json
+import os
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import asyncpg
+
+from app.database import DATABASE_LOCATION
+
+# Delivers a message to the sockets of a user connected to this process
+Deliver = Callable[[int, dict], Awaitable[None]]
+
+# Channel the workers NOTIFY and LISTEN on
+CHANNEL = "chat_messages"
+# NOTIFY payloads must stay under 8000 bytes, longer messages are sent in parts of this many
+# base64 characters, which are never escaped and leave room for the envelope
+MAX_PART_SIZE = 7000
+
+
+class ChatBroker:
+    """
+    Fans chat messages out to the process that holds the recipient's socket.
+
+    `publish` hands a message to every process, each of which calls its `deliver`
+    for its own sockets of the user.
+    """
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, user_id: int, message: dict):
+        raise NotImplementedError
+
+
+class LocalBroker(ChatBroker):
+    """
+    Single process broker, every socket is in this process
+    """
+
+    async def publish(self, user_id: int, message: dict):
+        await self.deliver(user_id, message)
+
+
+class PostgresBroker(ChatBroker):
+    """
+    Broker over PostgreSQL LISTEN/NOTIFY, for several workers or hosts sharing a database.
+
+    Messages are delivered to this process's sockets right away and sent to the other
+    processes with NOTIFY. Every process LISTENs on a dedicated connection, skips its own
+    notifications and delivers the rest in the order they arrive.
+    """
+
+    def __init__(self, deliver: Deliver, dsn: str, reconnect_delay: float = 1.0):
+        super().__init__(deliver)
+        self.dsn = dsn
+        self.reconnect_delay = reconnect_delay
+        self.origin = uuid.uuid4().hex
+        self.publisher: Optional[asyncpg.Pool] = None
+        self.inbox: Optional[asyncio.Queue] = None
+        self.parts: Dict[str, List[Optional[str]]] = {}  # Message ID -> parts received so far
+        self.tasks: List[asyncio.Task] = []
+        self.listening = None  # Set once the listener connection is up
+
+    async def start(self):
+        self.inbox = asyncio.Queue()
+        self.listening = asyncio.Event()
+        self.publisher = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        self.tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._dispatch())]
+        await self.listening.wait()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.publisher is not None:
+            await self.publisher.close()
+            self.publisher = None
+
+    async def publish(self, user_id: int, message: dict):
+        await self.deliver(user_id, message)
+        try:
+            async with self.publisher.acquire() as connection:
+                for payload in self.encode(user_id, message):
+                    await connection.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+        except Exception as e:
+            # Already delivered here, the sender's socket must not fail because other workers could not be reached
+            print(f"Chat broker could not notify other workers of a message to user {user_id}: {e}")
+
+    def encode(self, user_id: int, message: dict) -> List[str]:
+        """
+        Split a message into NOTIFY payloads
+        :param user_id (int): Recipient user ID
+        :param message (dict): Message
+        :return (List[str]): Payloads
+        """
+        data = base64.b64encode(json.dumps({"user_id": user_id, "message": message}).encode()).decode()
+        chunks = [data[start:start + MAX_PART_SIZE] for start in range(0, len(data), MAX_PART_SIZE)]
+        id = uuid.uuid4().hex
+        return [
+            json.dumps({"origin": self.origin, "id": id, "part": part, "parts": len(chunks), "data": chunk})
+            for part, chunk in enumerate(chunks)
+        ]
+
+    def receive(self, payload: str):
+        """
+        Take a notification, queueing the message once all of its parts arrived
+        :param payload (str): NOTIFY payload
+        """
+        envelope = json.loads(payload)
+        if envelope["origin"] == self.origin:
+            return
+        parts = self.parts.setdefault(envelope["id"], [None] * envelope["parts"])
+        parts[envelope["part"]] = envelope["data"]
+        if None in parts:
+            return
+        del self.parts[envelope["id"]]
+        data = json.loads(base64.b64decode("".join(parts)))
+        self.inbox.put_nowait((data["user_id"], data["message"]))
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self.receive(payload)
+
+    async def _listen(self):
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print(f"Chat broker could not connect, retrying: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            closed = asyncio.Event()
+            connection.add_termination_listener(lambda _: closed.set())
+            try:
+                await connection.add_listener(CHANNEL, self._on_notification)
+                self.listening.set()
+                await closed.wait()
+                # Parts of messages cut off by the disconnect will never complete
+                self.parts.clear()
+                print("Chat broker lost its connection, reconnecting")
+            finally:
+                if not connection.is_closed():
+                    await connection.close()
+
+    async def _dispatch(self):
+        while True:
+            user_id, message = await self.inbox.get()
+            try:
+                await self.deliver(user_id, message)
+            except Exception as e:
+                print(f"Chat broker could not deliver a message to user {user_id}: {e}")
+
+
+def create_broker(deliver: Deliver) -> ChatBroker:
+    """
+    Create the broker configured by CHAT_BROKER, "local" (default) or "postgres"
+    :param deliver (Deliver): Delivers a message to this process's sockets of a user
+    :return (ChatBroker): Broker, to be started on startup
+    """
+    kind = (os.getenv("CHAT_BROKER") or "local").lower()
+    if kind == "local":
+        return LocalBroker(deliver)
+    if kind == "postgres":
+        return PostgresBroker(deliver, os.getenv("CHAT_BROKER_DSN") or f"postgresql://{DATABASE_LOCATION}")
+    raise ValueError(f"Unknown CHAT_BROKER {kind!r}, expected 'local' or 'postgres'")
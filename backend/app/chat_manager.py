@@ -0,0 +1,145 @@
+import asyncio
+import os
+from typing import Dict, Set
+
+from fastapi import WebSocket
+
+from app import chat_broker
+
+# Messages waiting to be written to one socket before it counts as a slow consumer
+CHAT_SEND_QUEUE_SIZE = int(os.getenv("CHAT_SEND_QUEUE_SIZE") or 100)
+# What happens to a slow consumer's messages: "disconnect" closes the socket so the client
+# reconnects and reloads the history, "drop" skips messages for it, "wait" holds the sender
+# up to CHAT_SEND_TIMEOUT seconds and then disconnects the socket
+CHAT_SLOW_CONSUMER_POLICY = (os.getenv("CHAT_SLOW_CONSUMER_POLICY") or "disconnect").lower()
+CHAT_SEND_TIMEOUT = float(os.getenv("CHAT_SEND_TIMEOUT") or 5)
+
+POLICIES = ("disconnect", "drop", "wait")
+# Close code telling the client to reconnect later
+TRY_AGAIN_LATER = 1013
+
+
+class Connection:
+    """
+    One socket of a user, written to by its own task from a bounded queue, so a slow
+    client never holds up whoever sends to it
+    """
+
+    def __init__(self, websocket: WebSocket, user_id: int, queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.closed = False
+        self.writer = asyncio.create_task(self._write())
+
+    async def _write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_json(message)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone, the endpoint's receive loop cleans up
+            self.closed = True
+
+    def abort(self):
+        """
+        Stop writing to the socket and close it, without waiting for either
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.writer.cancel()
+        self.closer = asyncio.create_task(self._close())
+
+    async def _close(self):
+        try:
+            await self.websocket.close(code=TRY_AGAIN_LATER)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """
+    Sockets of the users connected to this process, any number per user. Messages for
+    sockets held by other workers go through the chat broker.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = CHAT_SEND_QUEUE_SIZE,
+        policy: str = CHAT_SLOW_CONSUMER_POLICY,
+        send_timeout: float = CHAT_SEND_TIMEOUT,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy!r}, expected one of {POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.send_timeout = send_timeout
+        self.active_connections: Dict[int, Set[Connection]] = {}
+        self.slow_consumers = 0
+        # Reaches sockets held by other workers, selected with CHAT_BROKER
+        self.broker = chat_broker.create_broker(self.deliver)
+
+    async def connect(self, websocket: WebSocket, user_id: int) -> Connection:
+        """
+        Accept a socket and start its writer
+        :param websocket (WebSocket): WebSocket connection
+        :param user_id (int): User ID
+        :return (Connection): Connection, to pass to disconnect
+        """
+        await websocket.accept()
+        connection = Connection(websocket, user_id, self.queue_size)
+        self.active_connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, connection: Connection):
+        """
+        Forget a socket and stop its writer
+        :param connection (Connection): Connection returned by connect
+        """
+        connections = self.active_connections.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+        connection.closed = True
+        connection.writer.cancel()
+
+    async def deliver(self, user_id: int, message: dict):
+        """
+        Queue a message on every socket of a user connected to this process
+        :param user_id (int): User ID
+        :param message (dict): Message
+        """
+        for connection in list(self.active_connections.get(user_id, ())):
+            if connection.closed:
+                continue
+            try:
+                connection.queue.put_nowait(message)
+                continue
+            except asyncio.QueueFull:
+                pass
+
+            if self.policy == "drop":
+                connection.dropped += 1
+                continue
+            if self.policy == "wait":
+                try:
+                    await asyncio.wait_for(connection.queue.put(message), self.send_timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            self.slow_consumers += 1
+            connection.abort()
+            self.disconnect(connection)
+
+    async def send_personal_message(self, message: dict, user_id: int):
+        """
+        Send a message to a user, on every socket they have open in any process
+        :param message (dict): Message
+        :param user_id (int): User ID
+        """
+        await self.broker.publish(user_id, message)
@@ -0,0 +1,174 @@
+import asyncio
+import os
+from datetime import datetime
+from typing import Callable, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import async_commands, schemas
+
+# Messages buffered before a flush is started early
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE") or 500)
+# Longest a message waits in the buffer before it is written
+CHAT_WRITE_INTERVAL_MS = float(os.getenv("CHAT_WRITE_INTERVAL_MS") or 5)
+# IDs reserved from the chat_messages sequence at a time
+CHAT_ID_BLOCK_SIZE = int(os.getenv("CHAT_ID_BLOCK_SIZE") or 100)
+
+
+class ChatWriter:
+    """
+    Write-behind buffer for chat messages.
+
+    `write` assigns a message its ID, from blocks reserved ahead of time, and its timestamp,
+    and returns it for delivery without waiting for the database. A background task writes
+    the buffer in multi-row INSERTs every CHAT_WRITE_INTERVAL_MS, or as soon as it holds
+    CHAT_WRITE_BATCH_SIZE messages, and `stop` writes whatever is left. Messages show up in
+    the history routes once flushed, a few milliseconds after they were delivered. Once
+    `stop` is called, `write` writes each message before returning it.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession],
+        batch_size: int = CHAT_WRITE_BATCH_SIZE,
+        interval_ms: float = CHAT_WRITE_INTERVAL_MS,
+        id_block_size: int = CHAT_ID_BLOCK_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.id_block_size = id_block_size
+        self.ids: List[int] = []  # Reserved IDs not handed out yet
+        self.last_id = 0
+        self.pending: List[dict] = []  # Messages not written yet, in order
+        self.task: Optional[asyncio.Task] = None
+        self.full: Optional[asyncio.Event] = None
+        self.id_lock: Optional[asyncio.Lock] = None
+        self.flush_lock: Optional[asyncio.Lock] = None
+        self.stopping = False
+        self.batches = 0
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        self.full = asyncio.Event()
+        self.id_lock = asyncio.Lock()
+        self.flush_lock = asyncio.Lock()
+        self.stopping = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the background task and write the messages still buffered
+        """
+        if self.task is None:
+            return
+        # Not cancelled, a flush cut off after its commit would write its batch again
+        self.stopping = True
+        self.full.set()
+        await self.task
+        self.task = None
+        while self.pending:
+            if not await self.flush():
+                print(f"Chat writer could not write {len(self.pending)} messages on shutdown")
+                break
+
+    async def write(self, chat_message: schemas.ChatMessageCreate) -> schemas.ChatMessage:
+        """
+        Buffer a chat message for writing
+        :param chat_message (schemas.ChatMessageCreate): Chat message create schema
+        :return (schemas.ChatMessage): Chat message with its ID and timestamp
+        """
+        if self.task is None and not self.stopping:
+            self.start()
+        message = {
+            "id": await self._next_id(),
+            "sender_id": chat_message.sender_id,
+            "recipient_id": chat_message.recipient_id,
+            "content": chat_message.content,
+            "timestamp": datetime.now(),
+        }
+        self.pending.append(message)
+        if self.stopping:
+            # The background task is stopping or gone, write it now rather than leave it buffered
+            await self.flush()
+        elif len(self.pending) >= self.batch_size:
+            self.full.set()
+        return schemas.ChatMessage(**message)
+
+    async def _next_id(self) -> int:
+        async with self.id_lock:
+            if not self.ids:
+                async with self.session_factory() as db:
+                    ids = await async_commands.reserve_chat_message_ids(db, self.id_block_size)
+                    await db.commit()
+                # Without a sequence the reservation starts after the highest ID in the table,
+                # which does not include the messages still buffered
+                if ids[0] <= self.last_id:
+                    ids = list(range(self.last_id + 1, self.last_id + 1 + len(ids)))
+                self.ids = ids
+            self.last_id = self.ids.pop(0)
+            return self.last_id
+
+    async def _run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.full.clear()
+            if self.pending and not self.stopping:
+                await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Write the buffered messages, in batches of up to CHAT_WRITE_BATCH_SIZE
+        :return (bool): False if the database could not be reached, the messages stay buffered
+        """
+        async with self.flush_lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                try:
+                    await self._insert(batch)
+                except IntegrityError:
+                    # A message the database rejects, e.g. to a deleted user, must not hold
+                    # back the rest, write the batch one message at a time to find it
+                    if not await self._insert_each(len(batch)):
+                        return False
+                    continue
+                except Exception as e:
+                    print(f"Chat writer could not write {len(batch)} messages, retrying: {e}")
+                    return False
+                del self.pending[:len(batch)]
+                self.batches += 1
+                self.written += len(batch)
+            return True
+
+    async def _insert(self, messages: List[dict]):
+        async with self.session_factory() as db:
+            await async_commands.insert_chat_messages(db, messages)
+
+    async def _insert_each(self, count: int) -> bool:
+        for _ in range(count):
+            message = self.pending[0]
+            try:
+                await self._insert([message])
+                self.written += 1
+            except IntegrityError as e:
+                print(f"Chat writer dropped message {message['id']}: {e}")
+                self.dropped += 1
+            except Exception as e:
+                print(f"Chat writer could not write message {message['id']}, retrying: {e}")
+                return False
+            del self.pending[0]
+        self.batches += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "batches": self.batches,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
@@ -1,8 +1,13 @@
-from typing import List, Optional
-from sqlalchemy import or_
-from sqlalchemy.orm import Session, joinedload
+from typing import FrozenSet, Iterator, List, Optional, Tuple
+from sqlalchemy import Date, Integer, String, bindparam, case, column, exists, func, or_, select, tuple_, update, values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased, contains_eager, joinedload
+from sqlalchemy.orm.attributes import set_committed_value
 from app import models, schemas
-from datetime import date, datetime, timedelta
+from app.auth_cache import auth_cache
+from app.patient_cache import patient_cache
+from datetime import date, datetime, timedelta, timezone
 
 def get_latest_depression_risk_log_by_user(
     db: Session, user: schemas.User
@@ -71,6 +76,87 @@ def upsert_depression_risk_log(db: Session, depression_risk_log: schemas.Depress
     db.refresh(db_depression_risk_log)
     return db_depression_risk_log
 
+# Rows per bulk statement, keeps PostgreSQL under its bind parameter limit
+BULK_CHUNK_SIZE = 1000
+
+def _insert(db: Session, model):
+    """
+    Dialect-specific INSERT that supports ON CONFLICT (PostgreSQL, or SQLite in tests)
+    :param db (Session): Database session
+    :param model: Model to insert into
+    :return: Insert statement
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+def bulk_upsert_depression_risk_logs(
+    db: Session, records: List[schemas.DepressionRiskUpdate], commit: bool = True
+):
+    """
+    Update or insert many depression risk logs with a single INSERT ... ON CONFLICT
+    :param db (Session): Database session
+    :param records (List[schemas.DepressionRiskUpdate]): Depression risk records
+    :param commit (bool): Whether to commit, pass False to keep writing in the same transaction
+    """
+    for start in range(0, len(records), BULK_CHUNK_SIZE):
+        stmt = _insert(db, models.DepressionRiskLog).values([
+            {"user_id": record.user_id, "value": record.value, "date": record.date}
+            for record in records[start:start + BULK_CHUNK_SIZE]
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["user_id", "date"],
+            set_={"value": stmt.excluded.value},
+        )
+        db.execute(stmt)
+
+    if commit:
+        db.commit()
+
+def bulk_update_patient_severity(
+    db: Session,
+    records: List[schemas.DepressionRiskUpdate],
+    scored_at: Optional[datetime] = None,
+    commit: bool = True,
+) -> List[int]:
+    """
+    Update the severity of many patients with a single UPDATE ... FROM (VALUES ...)
+    :param db (Session): Database session
+    :param records (List[schemas.DepressionRiskUpdate]): Depression risk records
+    :param scored_at (Optional[datetime]): When the scoring run started, recorded as each patient's last_scored_at
+    :param commit (bool): Whether to commit, pass False to keep writing in the same transaction
+    :return (List[int]): User IDs of the updated patients, to invalidate in the auth cache
+        once the transaction is committed when commit is False
+    """
+    patient_data = models.PatientData.__table__
+    watermark = {} if scored_at is None else {"last_scored_at": scored_at}
+    for start in range(0, len(records), BULK_CHUNK_SIZE):
+        chunk = records[start:start + BULK_CHUNK_SIZE]
+        if db.get_bind().dialect.name == "sqlite":
+            # SQLite cannot name the columns of a VALUES list, fall back to executemany
+            db.execute(
+                update(patient_data)
+                .where(patient_data.c.user_id == bindparam("b_user_id"))
+                .values(severity=bindparam("b_severity"), **watermark),
+                [{"b_user_id": record.user_id, "b_severity": record.severity} for record in chunk],
+            )
+            continue
+
+        severities = values(
+            column("user_id", Integer), column("severity", String), name="severities"
+        ).data([(record.user_id, record.severity) for record in chunk])
+        db.execute(
+            update(patient_data)
+            .where(patient_data.c.user_id == severities.c.user_id)
+            .values(severity=severities.c.severity, **watermark)
+        )
+
+    user_ids = [record.user_id for record in records]
+    if commit:
+        db.commit()
+        auth_cache.invalidate(*user_ids)
+    return user_ids
+
 def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
     """
     Get user by email
@@ -81,6 +167,24 @@ def get_user_by_email(db: Session, email: str) -> Optional[models.User]:
     return db.query(models.User).filter(models.User.email == email).first()
 
 
+def get_user_with_profile_by_id(db: Session, user_id: int) -> Optional[models.User]:
+    """
+    Get user by ID, with their patient and therapist data loaded in the same query
+    :param db (Session): Database session
+    :param user_id (int): User ID
+    :return (Optional[models.User]): User if found, None if not found
+    """
+    return (
+        db.query(models.User)
+        .filter(models.User.id == user_id)
+        .options(
+            joinedload(models.User.patient_data),
+            joinedload(models.User.therapist_data),
+        )
+        .first()
+    )
+
+
 def get_user_by_id(db: Session, user_id: int) -> Optional[models.User]:
     """
     Get user by ID
@@ -167,6 +271,7 @@ def update_user(db: Session, user: schemas.User) -> models.User:
     db_user = db.query(models.User).filter(models.User.email == user.email).first()
     db_user.name = user.name
     db.commit()
+    auth_cache.invalidate(db_user.id)
     db.refresh(db_user)
     return db_user
 
@@ -200,6 +305,70 @@ def get_mood_entries_by_user(
     )
 
 
+def _get_entries_page_by_user(
+    db: Session, model, user: schemas.User, limit: int, after: Optional[Tuple[date, int]]
+) -> list:
+    """
+    Get a page of a user's entries, newest first, by keyset on (date, id)
+    :param db (Session): Database session
+    :param model: MoodEntry, JournalEntry or GuidedJournalEntry
+    :param user (schemas.User): User
+    :param limit (int): Number of entries to return, one more is fetched to tell if there is a next page
+    :param after (Optional[Tuple[date, int]]): Date and ID of the last entry of the previous page
+    :return (list): Up to limit + 1 entries
+    """
+    query = (
+        db.query(model)
+        .join(models.PatientData, model.patient_data_id == models.PatientData.id)
+        .filter(models.PatientData.user_id == user.id)
+    )
+    if after is not None:
+        query = query.filter(tuple_(model.date, model.id) < tuple_(*after))
+    return query.order_by(model.date.desc(), model.id.desc()).limit(limit + 1).all()
+
+
+def get_mood_entries_page_by_user(
+    db: Session, user: schemas.User, limit: int = 100, after: Optional[Tuple[date, int]] = None
+) -> List[models.MoodEntry]:
+    """
+    Get a page of mood entries by user, newest first
+    :param db (Session): Database session
+    :param user (schemas.User): User
+    :param limit (int): Number of entries to return, one more is fetched to tell if there is a next page
+    :param after (Optional[Tuple[date, int]]): Date and ID of the last entry of the previous page
+    :return (List[models.MoodEntry]): Up to limit + 1 mood entries
+    """
+    return _get_entries_page_by_user(db, models.MoodEntry, user, limit, after)
+
+
+def get_journal_entries_page_by_user(
+    db: Session, user: schemas.User, limit: int = 100, after: Optional[Tuple[date, int]] = None
+) -> List[models.JournalEntry]:
+    """
+    Get a page of journal entries by user, newest first
+    :param db (Session): Database session
+    :param user (schemas.User): User
+    :param limit (int): Number of entries to return, one more is fetched to tell if there is a next page
+    :param after (Optional[Tuple[date, int]]): Date and ID of the last entry of the previous page
+    :return (List[models.JournalEntry]): Up to limit + 1 journal entries
+    """
+    return _get_entries_page_by_user(db, models.JournalEntry, user, limit, after)
+
+
+def get_guided_journal_entries_page_by_user(
+    db: Session, user: schemas.User, limit: int = 100, after: Optional[Tuple[date, int]] = None
+) -> List[models.GuidedJournalEntry]:
+    """
+    Get a page of guided journal entries by user, newest first
+    :param db (Session): Database session
+    :param user (schemas.User): User
+    :param limit (int): Number of entries to return, one more is fetched to tell if there is a next page
+    :param after (Optional[Tuple[date, int]]): Date and ID of the last entry of the previous page
+    :return (List[models.GuidedJournalEntry]): Up to limit + 1 guided journal entries
+    """
+    return _get_entries_page_by_user(db, models.GuidedJournalEntry, user, limit, after)
+
+
 def get_mood_entries_by_date_range(
     db: Session, user: schemas.User, start_date: date, end_date: date
 ) -> List[models.MoodEntry]:
@@ -231,72 +400,90 @@ def get_mood_entries_by_date_range(
     )
 
 
+def _upsert_entry(db: Session, model, user: schemas.User, fields: dict):
+    """
+    Insert a patient's entry for a day, or update the one already there, with a single
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING. Does not commit, the entry comes back
+    detached so the caller's commit does not expire it and cost another SELECT.
+    :param db (Session): Database session
+    :param model: MoodEntry, JournalEntry or GuidedJournalEntry
+    :param user (schemas.User): User the entry belongs to
+    :param fields (dict): Column values of the entry, including its date
+    :return: Upserted entry
+    """
+    patient_data_id = (
+        select(models.PatientData.id)
+        .where(models.PatientData.user_id == user.id)
+        .scalar_subquery()
+    )
+    stmt = _insert(db, model).values(**fields, patient_data_id=patient_data_id)
+    set_ = {name: stmt.excluded[name] for name in fields if name != "date"}
+    if "updated_at" in model.__table__.c:
+        # onupdate does not apply to ON CONFLICT DO UPDATE
+        set_["updated_at"] = func.now()
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["patient_data_id", "date"], set_=set_
+    ).returning(model)
+
+    db_entry = db.execute(
+        select(model).from_statement(stmt).execution_options(populate_existing=True)
+    ).scalars().one()
+    if db_entry.patient_data_id is None:
+        # The user has no patient data, undo the orphan entry
+        db.rollback()
+        raise Exception("Patient data not found")
+    db.expunge(db_entry)
+    return db_entry
+
+
 def upsert_mood_entry(
     db: Session, mood_entry: schemas.MoodEntryCreate, user: schemas.User
 ) -> models.MoodEntry:
     """
-    Update or insert a mood entry (depending on whether it has been written for a certain day)
+    Update or insert a mood entry (depending on whether it has been written for a certain day),
+    and update the user's streak and last login in the same transaction
     :param db (Session): Database session
     :param mood_entry (schemas.MoodEntryCreate): Mood entry create schema
     :param user (schemas.User): User
     :return (models.MoodEntry): New mood entry
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        raise Exception("Patient data not found")
-
-    db_mood_entry = (
-        db.query(models.MoodEntry)
-        .filter(models.MoodEntry.patient_data_id == db_patient_data.id)
-        .filter(models.MoodEntry.date == mood_entry.date)
-        .first()
-    )
-
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    db_mood_entry = _upsert_entry(db, models.MoodEntry, user, {
+        "mood": mood_entry.mood,
+        "eat": mood_entry.eat,
+        "sleep": mood_entry.sleep,
+        "date": mood_entry.date,
+    })
 
     # Convert mood_entry.date to datetime at the start of the day
     mood_entry_datetime = datetime.combine(mood_entry.date, datetime.min.time())
-
-    # Check if the last login was yesterday
-    if db_user.last_login is not None:
-        last_login_date = db_user.last_login.date()
-        if last_login_date == mood_entry.date - timedelta(days=1):
-            db_user.streak += 1
-        elif last_login_date != mood_entry.date:  # Reset streak if not consecutive days
-            db_user.streak = 1
-    else:
-        # If it's the first login, start the streak
-        db_user.streak = 1
-
-    # Update last_login if the new entry is more recent
-    if db_user.last_login is None or mood_entry_datetime > db_user.last_login:
-        db_user.last_login = mood_entry_datetime
-
-    db.commit()
-    db.refresh(db_user)
-
-    if db_mood_entry:
-        # Update existing entry
-        db_mood_entry.mood = mood_entry.mood
-        db_mood_entry.eat = mood_entry.eat
-        db_mood_entry.sleep = mood_entry.sleep
-    else:
-        # Create new entry
-        db_mood_entry = models.MoodEntry(
-            mood=mood_entry.mood,
-            eat=mood_entry.eat,
-            sleep=mood_entry.sleep,
-            date=mood_entry.date,
-            patient_data_id=db_patient_data.id,
+    last_login = models.User.last_login
+    last_login_date = func.date(last_login, type_=Date)
+
+    # Computed from the row being updated, so concurrent posts cannot lose an increment
+    db.execute(
+        update(models.User)
+        .where(models.User.id == user.id)
+        .values(
+            streak=case(
+                # If it's the first login, start the streak
+                (last_login.is_(None), 1),
+                # Continue the streak if the last login was yesterday
+                (last_login_date == mood_entry.date - timedelta(days=1), models.User.streak + 1),
+                # Reset streak if not consecutive days
+                (last_login_date != mood_entry.date, 1),
+                else_=models.User.streak,
+            ),
+            # Update last_login if the new entry is more recent
+            last_login=case(
+                (or_(last_login.is_(None), last_login < mood_entry_datetime), mood_entry_datetime),
+                else_=last_login,
+            ),
         )
-        db.add(db_mood_entry)
+        .execution_options(synchronize_session=False)
+    )
 
     db.commit()
-    db.refresh(db_mood_entry)
+    auth_cache.invalidate(user.id)
     return db_mood_entry
 
 
@@ -339,40 +526,52 @@ def upsert_journal_entry(
     :param user (schemas.User): User
     :return (models.JournalEntry): New journal entry
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        raise Exception("Patient data not found")
+    db_journal_entry = _upsert_entry(db, models.JournalEntry, user, {
+        "title": journal_entry.title,
+        "body": journal_entry.body,
+        "image": journal_entry.image,
+        "date": journal_entry.date,
+    })
+    db.commit()
+    return db_journal_entry
 
-    db_journal_entry = (
-        db.query(models.JournalEntry)
-        .filter(models.JournalEntry.patient_data_id == db_patient_data.id)
-        .filter(models.JournalEntry.date == journal_entry.date)
-        .first()
+
+def _entry_count(model, user_id):
+    """
+    Scalar subquery counting a user's entries, joined through their patient data
+    :param model: MoodEntry, JournalEntry or GuidedJournalEntry
+    :param user_id: User ID, or a User ID column to correlate with an outer query
+    :return: Scalar subquery
+    """
+    return (
+        select(func.count(model.id))
+        .join(models.PatientData, model.patient_data_id == models.PatientData.id)
+        .where(models.PatientData.user_id == user_id)
+        .scalar_subquery()
     )
 
-    if db_journal_entry:
-        # Update existing entry
-        db_journal_entry.title = journal_entry.title
-        db_journal_entry.body = journal_entry.body
-        db_journal_entry.image = journal_entry.image
-    else:
-        # Create new entry
-        db_journal_entry = models.JournalEntry(
-            title=journal_entry.title,
-            body=journal_entry.body,
-            image=journal_entry.image,
-            date=journal_entry.date,
-            patient_data_id=db_patient_data.id,
-        )
-        db.add(db_journal_entry)
 
-    db.commit()
-    db.refresh(db_journal_entry)
-    return db_journal_entry
+def get_user_stats(db: Session, user_id: int) -> Optional[dict]:
+    """
+    Get a user's entry counts, streak and last login in a single query
+    :param db (Session): Database session
+    :param user_id (int): User ID
+    :return (Optional[dict]): User stats, None if the user does not exist
+    """
+    row = (
+        db.query(
+            _entry_count(models.JournalEntry, models.User.id).label("journal_count"),
+            _entry_count(models.GuidedJournalEntry, models.User.id).label("guided_journal_count"),
+            _entry_count(models.MoodEntry, models.User.id).label("mood_count"),
+            models.User.streak,
+            models.User.last_login,
+        )
+        .filter(models.User.id == user_id)
+        .first()
+    )
+    if row is None:
+        return None
+    return row._asdict()
 
 
 def count_mood_entries_by_user(db: Session, user: schemas.User) -> int:
@@ -382,19 +581,7 @@ def count_mood_entries_by_user(db: Session, user: schemas.User) -> int:
     :param user (schemas.User): User
     :return (int): Number of mood entries
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        return 0
-
-    return (
-        db.query(models.MoodEntry)
-        .filter(models.MoodEntry.patient_data_id == db_patient_data.id)
-        .count()
-    )
+    return db.query(_entry_count(models.MoodEntry, user.id)).scalar()
 
 
 def count_journal_entries_by_user(db: Session, user: schemas.User) -> int:
@@ -404,19 +591,7 @@ def count_journal_entries_by_user(db: Session, user: schemas.User) -> int:
     :param user (schemas.User): User
     :return (int): Number of journal entries
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        return 0
-
-    return (
-        db.query(models.JournalEntry)
-        .filter(models.JournalEntry.patient_data_id == db_patient_data.id)
-        .count()
-    )
+    return db.query(_entry_count(models.JournalEntry, user.id)).scalar()
 
 
 def count_guided_journal_entries_by_user(db: Session, user: schemas.User) -> int:
@@ -426,19 +601,7 @@ def count_guided_journal_entries_by_user(db: Session, user: schemas.User) -> int
     :param user (schemas.User): User
     :return (int): Number of guided journal entries
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        return 0
-
-    return (
-        db.query(models.GuidedJournalEntry)
-        .filter(models.GuidedJournalEntry.patient_data_id == db_patient_data.id)
-        .count()
-    )
+    return db.query(_entry_count(models.GuidedJournalEntry, user.id)).scalar()
 
 
 def get_mood_entry_by_id(
@@ -538,37 +701,11 @@ def upsert_guided_journal_entry(
     :param user (schemas.User): User
     :return (models.GuidedJournalEntry): New guided journal entry
     """
-    db_patient_data = (
-        db.query(models.PatientData)
-        .filter(models.PatientData.user_id == user.id)
-        .first()
-    )
-    if db_patient_data is None:
-        raise Exception("Patient data not found")
-
-    db_guided_journal_entry = (
-        db.query(models.GuidedJournalEntry)
-        .filter(models.GuidedJournalEntry.patient_data_id == db_patient_data.id)
-        .filter(models.GuidedJournalEntry.date == guided_journal_entry.date)
-        .first()
-    )
-
-    journal_body_dict = guided_journal_entry.body.dict()
-
-    if db_guided_journal_entry:
-        # Update existing entry
-        db_guided_journal_entry.body = journal_body_dict
-    else:
-        # Create new entry
-        db_guided_journal_entry = models.GuidedJournalEntry(
-            body=journal_body_dict,
-            date=guided_journal_entry.date,
-            patient_data_id=db_patient_data.id,
-        )
-        db.add(db_guided_journal_entry)
-
+    db_guided_journal_entry = _upsert_entry(db, models.GuidedJournalEntry, user, {
+        "body": guided_journal_entry.body.dict(),
+        "date": guided_journal_entry.date,
+    })
     db.commit()
-    db.refresh(db_guided_journal_entry)
     return db_guided_journal_entry
 
 
@@ -649,6 +786,7 @@ def update_user(
     if user_update.image is not None:
         db_user.image = user_update.image
     db.commit()
+    auth_cache.invalidate(db_user.id)
     db.refresh(db_user)
     return db_user
 
@@ -764,6 +902,8 @@ def assign_therapist_to_patient(
     db_patient.patient_data.therapist_id = db_therapist_data.id
     db_patient.patient_data.therapist_user_id = therapist_id
     db.commit()
+    auth_cache.invalidate(db_patient.id)
+    patient_cache.add(therapist_id, db_patient.id)
     db.refresh(db_patient)
     return db_patient
 
@@ -784,9 +924,12 @@ def remove_therapist_from_patient(db: Session, patient: schemas.User) -> models.
     if db_patient.patient_data.therapist_id is None:
         raise Exception("Patient does not have a therapist")
 
+    therapist_id = db_patient.patient_data.therapist_user_id
     db_patient.patient_data.therapist_id = None
     db_patient.patient_data.therapist_user_id = None
     db.commit()
+    auth_cache.invalidate(db_patient.id)
+    patient_cache.remove(therapist_id, db_patient.id)
     db.refresh(db_patient)
     return db_patient
 
@@ -814,6 +957,35 @@ def get_therapist_by_patient(
     )
 
 
+def get_patient_ids_by_therapist(db: Session, therapist: schemas.User) -> List[int]:
+    """
+    Get the user IDs of a therapist's patients
+    :param db (Session): Database session
+    :param therapist (schemas.User): Therapist
+    :return (List[int]): Patient user IDs
+    """
+    return [
+        user_id
+        for user_id, in db.query(models.PatientData.user_id)
+        .join(models.TherapistData, models.PatientData.therapist_id == models.TherapistData.id)
+        .filter(models.TherapistData.user_id == therapist.id)
+    ]
+
+
+def get_cached_patient_ids_by_therapist(db: Session, therapist: schemas.User) -> FrozenSet[int]:
+    """
+    Get the user IDs of a therapist's patients from the patient cache, loading them on a miss
+    :param db (Session): Database session
+    :param therapist (schemas.User): Therapist
+    :return (FrozenSet[int]): Patient user IDs
+    """
+    patient_ids = patient_cache.get(therapist.id)
+    if patient_ids is None:
+        marker = patient_cache.marker()
+        patient_ids = patient_cache.put(therapist.id, get_patient_ids_by_therapist(db, therapist), marker)
+    return patient_ids
+
+
 def get_patients_by_therapist(
     db: Session, therapist: schemas.User
 ) -> List[models.User]:
@@ -877,6 +1049,7 @@ def update_patient_data(
     if patient_data.therapist_note is not None:
         db_patient_data.therapist_note = patient_data.therapist_note
     db.commit()
+    auth_cache.invalidate(db_patient_data.user_id)
     db.refresh(db_patient_data)
     return {
         "user_id": db_patient_data.user_id,
@@ -970,6 +1143,7 @@ def update_therapist_data(
     if therapist_data.treatment_approach is not None:
         db_therapist_data.treatment_approach = therapist_data.treatment_approach
     db.commit()
+    auth_cache.invalidate(db_therapist_data.user_id)
     db.refresh(db_therapist_data)
     return {
         "user_id": db_therapist_data.user_id,
@@ -996,10 +1170,58 @@ def insert_chat_message(
         timestamp=datetime.now()
     )
     db.add(db_chat_message)
+    db.flush()
+    db.execute(chat_threads_upsert(db, [{
+        "id": db_chat_message.id,
+        "sender_id": db_chat_message.sender_id,
+        "recipient_id": db_chat_message.recipient_id,
+        "content": db_chat_message.content,
+        "timestamp": db_chat_message.timestamp,
+    }]))
     db.commit()
     db.refresh(db_chat_message)
     return db_chat_message
 
+def chat_threads_upsert(db: Session, messages: List[dict]):
+    """
+    Build the statement that brings the chat threads of both sides of new messages up to date,
+    to run in the transaction that inserts the messages. Works with an AsyncSession too.
+    :param db (Session): Database session
+    :param messages (List[dict]): Column values of the new messages, with their IDs
+    :return: Insert statement, one row per thread however many messages it got
+    """
+    threads = {}  # (user ID, other user ID) -> thread row
+    for message in sorted(messages, key=lambda message: (message["timestamp"], message["id"])):
+        for user_id, other_user_id, unread in (
+            (message["sender_id"], message["recipient_id"], 0),
+            (message["recipient_id"], message["sender_id"], 1),
+        ):
+            thread = threads.setdefault(
+                (user_id, other_user_id),
+                {"user_id": user_id, "other_user_id": other_user_id, "unread_count": 0},
+            )
+            thread.update(
+                last_message_id=message["id"],
+                last_sender_id=message["sender_id"],
+                last_message=message["content"],
+                last_timestamp=message["timestamp"],
+            )
+            thread["unread_count"] += unread
+
+    stmt = _insert(db, models.ChatThread).values(list(threads.values()))
+    # Messages written by another worker may be newer than these
+    newer = stmt.excluded.last_timestamp >= models.ChatThread.last_timestamp
+    return stmt.on_conflict_do_update(
+        index_elements=["user_id", "other_user_id"],
+        set_={
+            **{
+                name: case((newer, stmt.excluded[name]), else_=getattr(models.ChatThread, name))
+                for name in ("last_message_id", "last_sender_id", "last_message", "last_timestamp")
+            },
+            "unread_count": models.ChatThread.unread_count + stmt.excluded.unread_count,
+        },
+    )
+
 def get_chat_messages(
     db: Session, user: schemas.User, other_user_id: int, skip: int = 0, limit: int = 100
 ) -> List[models.ChatMessage]:
@@ -1026,22 +1248,283 @@ def get_chat_messages(
         .all()
     )
 
-def get_all_patients_with_entries(
-    db: Session, skip: int = 0, limit: int = 100
-) -> List[models.User]:
+def create_batch_job(db: Session, job: schemas.BatchJobCreate) -> models.BatchJob:
     """
-    Get all patients including their journal / guided journal entries
+    Create a pending batch job, unless one is already pending or running
     :param db (Session): Database session
-    :param skip (int): Number of entries to skip
-    :param limit (int): Number of entries to return
-    :return (List[models.User]): Patients
+    :param job (schemas.BatchJobCreate): Batch job create schema
+    :return (models.BatchJob): New batch job, or the unfinished one
     """
+    unfinished = get_unfinished_batch_jobs(db)
+    if unfinished:
+        return unfinished[0]
+
+    db_job = models.BatchJob(status=schemas.BatchJobStatus.pending.value, force=job.force)
+    db.add(db_job)
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another request created one since, uq_batch_jobs_unfinished allows only one
+        db.rollback()
+        return get_unfinished_batch_jobs(db)[0]
+    db.refresh(db_job)
+    return db_job
+
 
+def get_batch_job(db: Session, job_id: int) -> Optional[models.BatchJob]:
+    """
+    Get batch job by ID
+    :param db (Session): Database session
+    :param job_id (int): Batch job ID
+    :return (Optional[models.BatchJob]): Batch job if found, None if not found
+    """
+    return db.query(models.BatchJob).filter(models.BatchJob.id == job_id).first()
+
+
+def get_unfinished_batch_jobs(db: Session) -> List[models.BatchJob]:
+    """
+    Get the batch jobs that are pending or were interrupted while running, oldest first
+    :param db (Session): Database session
+    :return (List[models.BatchJob]): Batch jobs
+    """
     return (
+        db.query(models.BatchJob)
+        .filter(
+            models.BatchJob.status.in_(
+                [schemas.BatchJobStatus.pending.value, schemas.BatchJobStatus.running.value]
+            )
+        )
+        .order_by(models.BatchJob.id)
+        .all()
+    )
+
+
+def claim_batch_job(db: Session, job_id: int, worker_id: str, lease_seconds: float) -> bool:
+    """
+    Atomically claim a pending job, or a running job whose worker stopped renewing its claim,
+    so that only one worker runs it
+    :param db (Session): Database session
+    :param job_id (int): Batch job ID
+    :param worker_id (str): ID of the claiming worker
+    :param lease_seconds (float): Seconds without renewal after which a running job's claim lapses
+    :return (bool): True if this worker now holds the job, False if not
+    """
+    now = datetime.now(timezone.utc)
+    result = db.execute(
+        update(models.BatchJob)
+        .where(
+            models.BatchJob.id == job_id,
+            or_(
+                models.BatchJob.status == schemas.BatchJobStatus.pending.value,
+                (models.BatchJob.status == schemas.BatchJobStatus.running.value)
+                & or_(
+                    models.BatchJob.heartbeat_at.is_(None),
+                    models.BatchJob.heartbeat_at < now - timedelta(seconds=lease_seconds),
+                ),
+            ),
+        )
+        .values(status=schemas.BatchJobStatus.running.value, claimed_by=worker_id, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def renew_batch_job_claim(db: Session, job_id: int, worker_id: str) -> bool:
+    """
+    Renew a worker's claim on a running job, without committing. Commit it with the job's
+    progress, the row stays locked until then so no other worker can claim the job meanwhile.
+    :param db (Session): Database session
+    :param job_id (int): Batch job ID
+    :param worker_id (str): ID of the worker holding the job
+    :return (bool): True if the worker still holds the job, False if another worker claimed it
+    """
+    result = db.execute(
+        update(models.BatchJob)
+        .where(
+            models.BatchJob.id == job_id,
+            models.BatchJob.status == schemas.BatchJobStatus.running.value,
+            models.BatchJob.claimed_by == worker_id,
+        )
+        .values(heartbeat_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def query_patients_to_score(db: Session, changed_only: bool = False):
+    """
+    Query the patients the risk scoring run should score: those with journal entries
+    :param db (Session): Database session
+    :param changed_only (bool): Only patients never scored, or with a journal or guided
+        journal entry written or edited since they were last scored
+    :return (Query): Patients joined to their patient data
+    """
+    query = (
         db.query(models.User)
         .join(models.PatientData)
-        .join(models.JournalEntry)
-        .offset(skip)
-        .limit(limit)
-        .all()
-    )
\ No newline at end of file
+        .filter(
+            exists().where(models.JournalEntry.patient_data_id == models.PatientData.id)
+        )
+    )
+    if changed_only:
+        query = query.filter(
+            or_(
+                models.PatientData.last_scored_at.is_(None),
+                exists().where(
+                    models.JournalEntry.patient_data_id == models.PatientData.id,
+                    models.JournalEntry.updated_at > models.PatientData.last_scored_at,
+                ),
+                exists().where(
+                    models.GuidedJournalEntry.patient_data_id == models.PatientData.id,
+                    models.GuidedJournalEntry.updated_at > models.PatientData.last_scored_at,
+                ),
+            )
+        )
+    return query
+
+
+def count_patients_to_score(db: Session, changed_only: bool = False, after_id: int = 0) -> int:
+    """
+    Count the patients the risk scoring run should score
+    :param db (Session): Database session
+    :param changed_only (bool): Only count patients whose journals changed since they were last scored
+    :param after_id (int): Only count patients with a greater user ID
+    :return (int): Number of patients
+    """
+    return query_patients_to_score(db, changed_only).filter(models.User.id > after_id).count()
+
+
+def iter_patients_with_recent_entries(
+    db: Session,
+    window_size: int = 64,
+    page_size: int = 100,
+    after_id: int = 0,
+    changed_only: bool = False,
+) -> Iterator[models.User]:
+    """
+    Iterate over all patients with journal entries in ID order, one keyset page at a time.
+    Each patient's patient_data.journal_entries holds only their last window_size entries
+    (oldest first), loaded for the whole page in one query. Yielded patients are expunged
+    from the session once their page is done so memory stays flat.
+    :param db (Session): Database session
+    :param window_size (int): Number of most recent journal entries to load per patient
+    :param page_size (int): Number of patients per page
+    :param after_id (int): Only yield patients with a greater user ID
+    :param changed_only (bool): Only yield patients never scored, or with a journal or guided
+        journal entry written or edited since they were last scored
+    :return (Iterator[models.User]): Patients
+    """
+    query = query_patients_to_score(db, changed_only)
+
+    last_id = after_id
+    while True:
+        page = (
+            query.filter(models.User.id > last_id)
+            .options(contains_eager(models.User.patient_data))
+            .order_by(models.User.id)
+            .limit(page_size)
+            .all()
+        )
+        if not page:
+            return
+
+        ranked = (
+            select(
+                models.JournalEntry,
+                func.row_number()
+                .over(
+                    partition_by=models.JournalEntry.patient_data_id,
+                    order_by=(models.JournalEntry.date.desc(), models.JournalEntry.id.desc()),
+                )
+                .label("rank"),
+            )
+            .where(
+                models.JournalEntry.patient_data_id.in_(
+                    [patient.patient_data.id for patient in page]
+                )
+            )
+            .subquery()
+        )
+        recent_entry = aliased(models.JournalEntry, ranked)
+        entries = (
+            db.query(recent_entry)
+            .filter(ranked.c.rank <= window_size)
+            .order_by(ranked.c.patient_data_id, ranked.c.date, ranked.c.id)
+            .all()
+        )
+
+        entries_by_patient_data = {}
+        for entry in entries:
+            entries_by_patient_data.setdefault(entry.patient_data_id, []).append(entry)
+        for patient in page:
+            set_committed_value(
+                patient.patient_data,
+                "journal_entries",
+                entries_by_patient_data.get(patient.patient_data.id, []),
+            )
+
+        for patient in page:
+            yield patient
+
+        last_id = page[-1].id
+        for entry in entries:
+            db.expunge(entry)
+        for patient in page:
+            db.expunge(patient.patient_data)
+            db.expunge(patient)
+
+
+# Rows fetched per round trip by the export, the rest stay on the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+def iter_export_rows(
+    db: Session,
+    user_ids: List[int],
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[Tuple[str, int, object]]:
+    """
+    Stream the journal entries, guided journal entries, mood entries and depression risk logs
+    of some users, each kind per patient and newest first. Rows are fetched `batch_size` at a
+    time from a server-side cursor, so memory stays flat however much history there is.
+    :param db (Session): Database session
+    :param user_ids (List[int]): User IDs of the patients
+    :param start_date (Optional[date]): Earliest date to include
+    :param end_date (Optional[date]): Latest date to include
+    :param batch_size (int): Rows per fetch
+    :return (Iterator[Tuple[str, int, object]]): Kind of the row, user ID of its patient, and the row
+    """
+    if not user_ids:
+        return
+
+    def between(query, column):
+        if start_date is not None:
+            query = query.filter(column >= start_date)
+        if end_date is not None:
+            query = query.filter(column <= end_date)
+        return query
+
+    for kind, model in [
+        ("journal", models.JournalEntry),
+        ("guided_journal", models.GuidedJournalEntry),
+        ("mood", models.MoodEntry),
+    ]:
+        query = (
+            db.query(model, models.PatientData.user_id)
+            .join(models.PatientData, model.patient_data_id == models.PatientData.id)
+            .filter(models.PatientData.user_id.in_(user_ids))
+        )
+        query = between(query, model.date).order_by(
+            model.patient_data_id, model.date.desc(), model.id.desc()
+        )
+        for row, user_id in query.yield_per(batch_size):
+            yield kind, user_id, row
+
+    query = db.query(models.DepressionRiskLog).filter(models.DepressionRiskLog.user_id.in_(user_ids))
+    query = between(query, models.DepressionRiskLog.date).order_by(
+        models.DepressionRiskLog.user_id, models.DepressionRiskLog.date.desc()
+    )
+    for row in query.yield_per(batch_size):
+        yield "depression_risk", row.user_id, row
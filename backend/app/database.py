@@ -1,17 +1,49 @@
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
 
+from app.pool_stats import InstrumentedAsyncQueuePool, InstrumentedQueuePool
+
 # Load environment variables
 load_dotenv()
 
+
+def get_pool_options() -> dict:
+    """
+    Get the connection pool settings of the engines from the environment
+    :return (dict): Keyword arguments for create_engine
+    """
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE") or 5),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW") or 10),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT") or 30),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE") or 1800),
+        "pool_pre_ping": (os.getenv("DB_POOL_PRE_PING") or "true").lower() in ("1", "true", "yes"),
+    }
+
+
 # Create database engine and session
+DATABASE_LOCATION = f"{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}:5432/{os.environ.get('DB_NAME')}"
 engine = create_engine(
-    f"postgresql://{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}:5432/{os.environ.get('DB_NAME')}"
+    f"postgresql://{DATABASE_LOCATION}",
+    poolclass=InstrumentedQueuePool,
+    **get_pool_options(),
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine and session (asyncpg) for the async routes, so queries do not block the event loop.
+# Each engine has its own pool of the configured size.
+async_engine = create_async_engine(
+    f"postgresql+asyncpg://{DATABASE_LOCATION}",
+    poolclass=InstrumentedAsyncQueuePool,
+    **get_pool_options(),
+)
+AsyncSessionLocal = async_sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine
+)
+
 # Create base class for models
 Base = declarative_base()
\ No newline at end of file
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Callable, Iterator, List, Optional
+
+import aiohttp
+from sqlalchemy.orm import Session
+
+from app import commands, models, schemas, scoring
+from app.auth_cache import auth_cache
+
+
+class BatchJobClaimLost(Exception):
+    pass
+
+
+class BatchJobRunner:
+    """
+    In-process worker that runs depression risk scoring jobs one at a time.
+
+    The job row is the only state: after every group of patients the results and
+    the job's progress (including the last completed patient) are committed in one
+    transaction, so a job interrupted by a restart resumes right after that patient.
+
+    Every worker process has a runner. A runner claims a job before running it and
+    renews the claim with every commit, so each job runs in one worker at a time. A
+    job whose worker stopped renewing for `lease_seconds` can be claimed by another.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        endpoint: str,
+        window_size: int = 64,
+        bulk_size: int = 64,
+        concurrency: int = 4,
+        timeout: float = 120,
+        retries: int = 2,
+        lease_seconds: float = 900,
+    ):
+        self.session_factory = session_factory
+        self.endpoint = endpoint
+        self.window_size = window_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.options = {
+            "bulk_size": bulk_size,
+            "concurrency": concurrency,
+            "timeout": timeout,
+            "retries": retries,
+        }
+        # Enough patients to keep every concurrent model call busy, and no more in memory
+        self.group_size = bulk_size * concurrency
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def start(self, http: aiohttp.ClientSession):
+        """
+        Start the worker and queue every job left pending or running by a previous process
+        :param http (aiohttp.ClientSession): HTTP session used to call the model
+        """
+        self.http = http
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        db = self.session_factory()
+        try:
+            for job in commands.get_unfinished_batch_jobs(db):
+                print(f"Resuming batch job {job.id} after patient {job.last_patient_id}")
+                self.queue.put_nowait(job.id)
+        finally:
+            db.close()
+        self.worker = asyncio.create_task(self._work())
+
+    async def stop(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+
+    def enqueue(self, job_id: int):
+        """
+        Queue a job to run once the jobs before it are done, safe to call from any thread
+        :param job_id (int): Batch job ID
+        """
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, job_id)
+
+    async def _work(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self.run(job_id)
+            except Exception as e:
+                print(f"Batch job {job_id} crashed: {e}")
+
+    async def run(self, job_id: int):
+        """
+        Run a job to completion, resuming after its last completed patient
+        :param job_id (int): Batch job ID
+        """
+        # Patients are read through their own session so committing results does not
+        # expire the page the iterator is working through
+        db = self.session_factory()
+        # The job is read on the event loop between commits, which run in a thread, so it
+        # must not be expired by them. Only this runner writes it while holding the claim.
+        db.expire_on_commit = False
+        reader = self.session_factory()
+        try:
+            claimed = await asyncio.to_thread(
+                commands.claim_batch_job, db, job_id, self.worker_id, self.lease_seconds
+            )
+            if not claimed:
+                job = await asyncio.to_thread(commands.get_batch_job, db, job_id)
+                if job is not None and job.status == schemas.BatchJobStatus.running.value and self.queue is not None:
+                    # Another worker runs it, take it over if that worker stops renewing its claim
+                    self.loop.call_later(self.lease_seconds, self.queue.put_nowait, job_id)
+                return
+
+            job = await asyncio.to_thread(commands.get_batch_job, db, job_id)
+            if job.started_at is None:
+                job.started_at = datetime.now(timezone.utc)
+                job.total = await asyncio.to_thread(
+                    commands.count_patients_to_score, db, not job.force
+                )
+                await asyncio.to_thread(self._commit, db, job_id)
+
+            patients = commands.iter_patients_with_recent_entries(
+                reader,
+                window_size=self.window_size,
+                after_id=job.last_patient_id,
+                changed_only=not job.force,
+            )
+            while True:
+                started = time.perf_counter()
+                timelines = await asyncio.to_thread(self._next_group, patients)
+                if not timelines:
+                    break
+
+                report = await scoring.score_timelines(self.http, self.endpoint, timelines, **self.options)
+                user_ids = await asyncio.to_thread(self._write_group, db, job, timelines, report)
+                job.elapsed_seconds += time.perf_counter() - started
+                await asyncio.to_thread(self._commit, db, job_id, user_ids)
+
+            job.status = schemas.BatchJobStatus.completed.value
+            job.finished_at = datetime.now(timezone.utc)
+            await asyncio.to_thread(self._commit, db, job_id)
+            print(f"Batch job {job.id} completed: {job.scored} scored, {job.errors} errors")
+        except BatchJobClaimLost:
+            await asyncio.to_thread(db.rollback)
+            print(f"Batch job {job_id} was claimed by another worker, stopping")
+        except Exception as e:
+            await asyncio.to_thread(self._fail, db, job_id, str(e))
+            print(f"Batch job {job_id} failed: {e}")
+        finally:
+            await asyncio.to_thread(reader.close)
+            await asyncio.to_thread(db.close)
+
+    def _commit(self, db: Session, job_id: int, user_ids: Optional[List[int]] = None):
+        """
+        Renew the claim on a job and commit its progress
+        :param db (Session): Database session
+        :param job_id (int): Batch job ID
+        :param user_ids (Optional[List[int]]): User IDs of the patients updated, invalidated
+            in the auth cache once committed so no request caches the old severity again
+        :raises (BatchJobClaimLost): If another worker claimed the job
+        """
+        if not commands.renew_batch_job_claim(db, job_id, self.worker_id):
+            raise BatchJobClaimLost(job_id)
+        db.commit()
+        if user_ids:
+            auth_cache.invalidate(*user_ids)
+
+    def _fail(self, db: Session, job_id: int, error: str):
+        """
+        Roll back and mark a job failed, unless another worker claimed it
+        :param db (Session): Database session
+        :param job_id (int): Batch job ID
+        :param error (str): Error message
+        """
+        db.rollback()
+        job = commands.get_batch_job(db, job_id)
+        if job is not None and commands.renew_batch_job_claim(db, job_id, self.worker_id):
+            job.status = schemas.BatchJobStatus.failed.value
+            job.error = error
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+
+    def _next_group(self, patients: Iterator[models.User]) -> List[dict]:
+        return [scoring.build_timeline(patient) for patient in islice(patients, self.group_size)]
+
+    def _write_group(
+        self,
+        db: Session,
+        job: models.BatchJob,
+        timelines: List[dict],
+        report: scoring.ScoringReport,
+    ) -> List[int]:
+        """
+        Write a group's results and the job's progress without committing
+        :param db (Session): Database session
+        :param job (models.BatchJob): Batch job
+        :param timelines (List[dict]): Patient timelines of the group, in patient ID order
+        :param report (scoring.ScoringReport): Scoring report of the group
+        :return (List[int]): User IDs of the patients whose severity was updated
+        """
+        today = datetime.now().date()
+        records = [
+            schemas.DepressionRiskUpdate(
+                user_id=patient_id,
+                value=prob,
+                date=today,
+                severity=scoring.get_severity(prob),
+            )
+            for patient_id, prob in report.probabilities.items()
+        ]
+        commands.bulk_upsert_depression_risk_logs(db, records, commit=False)
+        user_ids = commands.bulk_update_patient_severity(db, records, scored_at=job.started_at, commit=False)
+
+        summary = report.to_dict()
+        job.processed += len(timelines)
+        job.scored += summary["scored"]
+        job.errors += summary["failed"]
+        job.model_calls += summary["model_calls"]
+        job.last_patient_id = timelines[-1]["patient_id"]
+        if report.failures:
+            job.error = report.failures[-1]["error"]
+        return user_ids
@@ -1,33 +1,65 @@
 import base64
 import io
+import json
 import os
 import uuid
 from fastapi.staticfiles import StaticFiles
-from fastapi import FastAPI, Depends, File, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect, status
+from fastapi import FastAPI, Depends, File, HTTPException, Query, Request, UploadFile, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from PIL import Image
 from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta, timezone
-from typing import Annotated, Dict, Generator, List, Optional
+from datetime import date, datetime, timedelta, timezone
+from typing import Annotated, AsyncGenerator, Generator, Iterator, List, Optional
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 import aiohttp
 
-from app.database import SessionLocal
-from app import commands, schemas
+from app.database import AsyncSessionLocal, SessionLocal, async_engine, engine
+from app import async_commands, commands, models, pagination, passwords, query_stats, schemas
+from app.auth_cache import auth_cache
+from app.patient_cache import patient_cache
+from app.chat_manager import ConnectionManager
+from app.chat_writer import ChatWriter
+from app.pool_stats import get_pool_status
+from app.jobs import BatchJobRunner
 
 # Create FastAPI app
 async def init_session():
     return aiohttp.ClientSession()
 
+def init_job_runner() -> BatchJobRunner:
+    model_endpoint = os.getenv("MODEL_ENDPOINT") or "http://localhost:8001/check"
+    return BatchJobRunner(
+        SessionLocal,
+        os.getenv("MODEL_BULK_ENDPOINT") or model_endpoint + "/bulk",
+        window_size=int(os.getenv("MODEL_WINDOW_SIZE") or 64),
+        bulk_size=int(os.getenv("MODEL_BULK_SIZE") or 64),
+        concurrency=int(os.getenv("MODEL_CONCURRENCY") or 4),
+        timeout=float(os.getenv("MODEL_TIMEOUT") or 120),
+        retries=int(os.getenv("MODEL_RETRIES") or 2),
+        lease_seconds=float(os.getenv("BATCH_JOB_LEASE_SECONDS") or 900),
+    )
+
 async def startup_event():
     app.state.session = await init_session()
+    app.state.jobs = init_job_runner()
+    app.state.jobs.start(app.state.session)
+    passwords.start()
+    await manager.broker.start()
+    chat_writer.start()
 
 async def shutdown_event():
+    await chat_writer.stop()
+    await manager.broker.stop()
+    await app.state.jobs.stop()
     await app.state.session.close()
+    await async_engine.dispose()
+    passwords.shutdown()
 
 app = FastAPI(on_startup=[startup_event], on_shutdown=[shutdown_event])
 app.add_middleware(
@@ -38,8 +70,21 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-DB-Queries"],
 )
 
+
+@app.middleware("http")
+async def add_query_stats(request: Request, call_next):
+    """
+    Count the SQL statements of each request and report them in the response headers
+    """
+    with query_stats.track() as stats:
+        response = await call_next(request)
+    response.headers["Server-Timing"] = stats.server_timing()
+    response.headers["X-DB-Queries"] = str(stats.count)
+    return response
+
 # Load environment variables
 load_dotenv()
 
@@ -47,7 +92,6 @@ load_dotenv()
 SECRET_KEY = os.getenv("TOKEN_SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 30  # 30 days
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # Google token
@@ -73,22 +117,48 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[schemas.User]:
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Get an async database session, for async routes that must not block the event loop
+    :return (AsyncGenerator[AsyncSession, None]): Database session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def decode_cursor(cursor: Optional[str], value_type: type) -> Optional[pagination.Key]:
+    """
+    Decode the cursor query parameter of a paginated route
+    :param cursor (Optional[str]): Cursor, None for the first page
+    :param value_type (type): date or datetime, the type of the first half of the key
+    :return (Optional[pagination.Key]): Key to continue after, None for the first page
+    :raises (HTTPException): If the cursor is invalid
+    """
+    if cursor is None:
+        return None
+    try:
+        return pagination.decode_cursor(cursor, value_type)
+    except pagination.InvalidCursor:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+
+
+async def authenticate_user_async(db: Session, email: str, password: str) -> Optional[schemas.User]:
     """
-    Authenticate a user
+    Authenticate a user without holding a request thread while bcrypt runs
+    :param db (Session): Database session
     :param email (str): Email
     :param password (str): Password
-    :param db (Session): Database session
     :return (Optional[schemas.User]): User if succesfully authenticated, None if not authenticated
     """
-    user = commands.get_user_by_email(db, email)
-    return (
-        user
-        if user is not None
-        and user.is_active
-        and pwd_context.verify(password, user.hashed_password)
-        else None
-    )
+    user = await run_in_threadpool(commands.get_user_by_email, db, email)
+    if user is None or not user.is_active:
+        return None
+    if not await passwords.verify_password_async(password, user.hashed_password):
+        return None
+    return user
 
 
 async def verify_google_token(token: str) -> dict:
@@ -104,23 +174,38 @@ async def verify_google_token(token: str) -> dict:
     return await response.json()
 
 
-def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)
-) -> schemas.User:
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+def create_access_token(user: models.User) -> str:
     """
-    Get the current user
-    :param token (str): JWT
-    :param db (Session): Database session
-    :return (schemas.User): Current user
-    :raises (HTTPException): If credentials are invalid
+    Create a JWT for a user
+    :param user (models.User): User
+    :return (str): JWT carrying the user's email as subject and their ID
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+    return jwt.encode(
+        {
+            "sub": user.email,
+            "id": user.id,
+            "exp": datetime.now(timezone.utc)
+            + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        },
+        SECRET_KEY,
+        algorithm=ALGORITHM,
     )
 
-    # Decode token and extract the email
+
+def decode_token(token: str) -> schemas.TokenData:
+    """
+    Decode a JWT
+    :param token (str): JWT
+    :return (schemas.TokenData): Token data
+    :raises (HTTPException): If the token is invalid or has no user ID
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_email: Optional[str] = payload.get("sub")
@@ -128,18 +213,88 @@ def get_current_user(
             int(payload.get("id")) if payload.get("id") is not None else None
         )
         token_data = schemas.TokenData(email=user_email, id=user_id)
-    except JWTError or ValidationError:
+    except (JWTError, ValidationError, ValueError):
+        raise credentials_exception
+    if token_data.id is None:
+        raise credentials_exception
+    return token_data
+
+
+def get_cached_user(token_data: schemas.TokenData) -> Optional[models.User]:
+    """
+    Get the user of a token from the auth cache
+    :param token_data (schemas.TokenData): Token data
+    :return (Optional[models.User]): Cached user if cached under the token's ID and email, None if not
+    """
+    user = auth_cache.get(token_data.id)
+    if user is None or user.email != token_data.email:
+        return None
+    return user
+
+
+def cache_user(db: Session, user: models.User, marker: int):
+    """
+    Detach a user loaded with their patient and therapist data from the session and cache it
+    :param db (Session): Database session (sync or async) the user was loaded in
+    :param user (models.User): User
+    :param marker (int): Auth cache marker taken before the user was loaded
+    """
+    for instance in (user, user.patient_data, user.therapist_data):
+        if instance is not None:
+            db.expunge(instance)
+    auth_cache.put(user, marker)
+
+
+def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_db)
+) -> schemas.User:
+    """
+    Get the current user, from the auth cache when possible
+    :param token (str): JWT
+    :param db (Session): Database session
+    :return (schemas.User): Current user
+    :raises (HTTPException): If credentials are invalid
+    """
+    token_data = decode_token(token)
+    user = get_cached_user(token_data)
+    if user is not None:
+        return user
+
+    # Get user by ID, with their patient and therapist data
+    marker = auth_cache.marker()
+    user = commands.get_user_with_profile_by_id(db, token_data.id)
+    if user is None or not user.is_active:
         raise credentials_exception
+    cache_user(db, user, marker)
+    return user
 
-    # Get user by email
-    user = commands.get_user_by_email(db, token_data.email)
+
+async def get_current_user_async(
+    token: Annotated[str, Depends(oauth2_scheme)], db: AsyncSession = Depends(get_async_db)
+) -> schemas.User:
+    """
+    Get the current user through the async session, from the auth cache when possible
+    :param token (str): JWT
+    :param db (AsyncSession): Database session
+    :return (schemas.User): Current user
+    :raises (HTTPException): If credentials are invalid
+    """
+    token_data = decode_token(token)
+    user = get_cached_user(token_data)
+    if user is not None:
+        return user
+
+    # Get user by ID, with their patient and therapist data
+    marker = auth_cache.marker()
+    user = await async_commands.get_user_by_id(db, token_data.id)
     if user is None or not user.is_active:
         raise credentials_exception
+    cache_user(db, user, marker)
     return user
 
 
 @app.post("/signin", response_model=schemas.Token)
-def post_signin(
+async def post_signin(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
     db: Session = Depends(get_db),
 ):
@@ -152,7 +307,7 @@ def post_signin(
     """
 
     # Authenticate user
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user_async(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -161,16 +316,7 @@ def post_signin(
         )
 
     # Generate JWT
-    access_token = jwt.encode(
-        {
-            "sub": user.email,
-            "id": user.id,
-            "exp": datetime.now(timezone.utc)
-            + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
-        },
-        SECRET_KEY,
-        algorithm=ALGORITHM,
-    )
+    access_token = create_access_token(user)
 
     return schemas.Token(
         access_token=access_token,
@@ -195,9 +341,10 @@ async def google_signin(
     user_name = google_data.get("name")
 
     # create user if doesn't exist
-    user = commands.get_user_by_email(db, user_email)
+    user = await run_in_threadpool(commands.get_user_by_email, db, user_email)
     if not user:
-        user = commands.create_google_user(
+        user = await run_in_threadpool(
+            commands.create_google_user,
             db, 
             user=schemas.UserCreateGoogle(
                 email=user_email,
@@ -208,21 +355,12 @@ async def google_signin(
         )  
 
     # Generate JWT
-    access_token = jwt.encode(
-        {
-            "sub": user.email, 
-            "id": user.id, 
-            "exp": datetime.now(timezone.utc) 
-            + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        },
-        SECRET_KEY,
-        algorithm=ALGORITHM,
-    )
+    access_token = create_access_token(user)
     return schemas.Token(access_token=access_token, token_type="bearer", expires_in=ACCESS_TOKEN_EXPIRE_MINUTES)
 
 
 @app.get("/users/check-email")
-def get_email_exists(
+async def get_email_exists(
     email: str = Query(..., title="Email", description="The email address to check"),
     db: Session = Depends(get_db),
 ):
@@ -233,14 +371,14 @@ def get_email_exists(
     :param db: Database session
     :return: A message indicating whether the email exists or not, False or True
     """
-    existing_user = commands.get_user_by_email(db, email)
+    existing_user = await run_in_threadpool(commands.get_user_by_email, db, email)
     if existing_user is not None:
         return {"detail": "True"}
     return {"detail": "False"}
 
 
 @app.post("/signup")
-def post_signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def post_signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """
     Register a new user
     :param user (schemas.UserCreate): Initial user data
@@ -248,7 +386,7 @@ def post_signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     :return (schemas.User): Created user
     :raises (HTTPException): If user with such email already exists
     """
-    _user = commands.get_user_by_email(db, user.email)
+    _user = await run_in_threadpool(commands.get_user_by_email, db, user.email)
     if _user is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
@@ -257,8 +395,8 @@ def post_signup(user: schemas.UserCreate, db: Session = Depends(get_db)):
     user.image = "/images/user.jpg"
 
     # Hash password
-    user.password = pwd_context.hash(user.password)
-    commands.create_user(db, user)
+    user.password = await passwords.hash_password_async(user.password)
+    await run_in_threadpool(commands.create_user, db, user)
 
     return {"detail": "User created successfully"}
 
@@ -449,6 +587,29 @@ def get_mood_entries(
     return commands.get_mood_entries_by_user(db, current_user, skip, limit)
 
 
+@app.get("/mood/page", response_model=schemas.CursorPage[schemas.MoodEntry])
+def get_mood_entries_page(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(
+        default=100, ge=1, le=1000, description="Number of entries to return"
+    ),
+    db: Session = Depends(get_db),
+):
+    """
+    Get a page of mood entries, newest first
+    :param current_user (schemas.User): Current user
+    :param cursor (Optional[str]): Cursor of the page, None for the first page
+    :param limit (int): Number of entries to return
+    :param db (Session): Database session
+    :return (schemas.CursorPage[schemas.MoodEntry]): Mood entries and the cursor of the next page
+    """
+    after = decode_cursor(cursor, date)
+    rows = commands.get_mood_entries_page_by_user(db, current_user, limit, after)
+    items, next_cursor = pagination.paginate(rows, limit, lambda entry: (entry.date, entry.id))
+    return {"items": items, "next_cursor": next_cursor}
+
+
 @app.get("/mood/date-range", response_model=List[schemas.MoodEntry])
 def get_mood_entries_by_date_range(
     current_user: Annotated[schemas.User, Depends(get_current_user)],
@@ -574,6 +735,29 @@ def get_journal_entries(
 
     return commands.get_journal_entries_by_user(db, current_user, skip, limit)
 
+
+@app.get("/journals/page", response_model=schemas.CursorPage[schemas.JournalEntry])
+def get_journal_entries_page(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(
+        default=100, ge=1, le=1000, description="Number of entries to return"
+    ),
+    db: Session = Depends(get_db),
+):
+    """
+    Get a page of journal entries, newest first
+    :param current_user (schemas.User): Current user
+    :param cursor (Optional[str]): Cursor of the page, None for the first page
+    :param limit (int): Number of entries to return
+    :param db (Session): Database session
+    :return (schemas.CursorPage[schemas.JournalEntry]): Journal entries and the cursor of the next page
+    """
+    after = decode_cursor(cursor, date)
+    rows = commands.get_journal_entries_page_by_user(db, current_user, limit, after)
+    items, next_cursor = pagination.paginate(rows, limit, lambda entry: (entry.date, entry.id))
+    return {"items": items, "next_cursor": next_cursor}
+
 @app.get("/users/stats")
 def get_stats(
     current_user: Annotated[schemas.User, Depends(get_current_user)],
@@ -586,15 +770,14 @@ def get_stats(
     :return (dict): User stats
     """
 
-    journal_count = commands.count_journal_entries_by_user(db, current_user)
-    guided_journal_count = commands.count_guided_journal_entries_by_user(db, current_user)
-    stats = commands.get_user_by_id(db, current_user.id)
-    return {
-        "journal_count": journal_count,
-        "guided_journal_count": guided_journal_count,
-        "streak": stats.streak,
-        "last_login": stats.last_login if stats.last_login else "",
-    }
+    stats = commands.get_user_stats(db, current_user.id)
+    if stats is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found",
+        )
+    stats["last_login"] = stats["last_login"] if stats["last_login"] else ""
+    return stats
 
 @app.post("/social-accounts", response_model=List[schemas.SocialAccount])
 def post_social_accounts(
@@ -706,6 +889,29 @@ def get_guided_journal_entries(
     return commands.get_guided_journal_entries_by_user(db, current_user, skip, limit)
 
 
+@app.get("/guided-journals/page", response_model=schemas.CursorPage[schemas.GuidedJournalEntry])
+def get_guided_journal_entries_page(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(
+        default=100, ge=1, le=1000, description="Number of entries to return"
+    ),
+    db: Session = Depends(get_db),
+):
+    """
+    Get a page of guided journal entries, newest first
+    :param current_user (schemas.User): Current user
+    :param cursor (Optional[str]): Cursor of the page, None for the first page
+    :param limit (int): Number of entries to return
+    :param db (Session): Database session
+    :return (schemas.CursorPage[schemas.GuidedJournalEntry]): Guided journal entries and the cursor of the next page
+    """
+    after = decode_cursor(cursor, date)
+    rows = commands.get_guided_journal_entries_page_by_user(db, current_user, limit, after)
+    items, next_cursor = pagination.paginate(rows, limit, lambda entry: (entry.date, entry.id))
+    return {"items": items, "next_cursor": next_cursor}
+
+
 @app.post("/assign-therapist/{therapist_id}")
 def assign_therapist(
     therapist_id: int,
@@ -793,6 +999,86 @@ def get_patients(
     return commands.get_patients_by_therapist(db, current_user)
 
 
+# Schema each kind of exported row is serialized with
+EXPORT_SCHEMAS = {
+    "journal": schemas.JournalEntry,
+    "guided_journal": schemas.GuidedJournalEntry,
+    "mood": schemas.MoodEntry,
+    "depression_risk": schemas.DepressionRiskLog,
+}
+# Lines per chunk of the export stream, each chunk is one trip through the threadpool
+EXPORT_CHUNK_SIZE = 500
+
+
+def export_lines(
+    bind, user_ids: List[int], start_date: Optional[date], end_date: Optional[date]
+) -> Iterator[str]:
+    """
+    Serialize exported rows as NDJSON, one {"type", "user_id", "data"} object per line
+    :param bind: Engine to read from
+    :param user_ids (List[int]): User IDs of the patients
+    :param start_date (Optional[date]): Earliest date to include
+    :param end_date (Optional[date]): Latest date to include
+    :return (Iterator[str]): Chunks of lines
+    """
+    # The request's session is closed once the route returns, before the body is streamed
+    db = Session(bind=bind, autoflush=False)
+    try:
+        lines = []
+        for kind, user_id, row in commands.iter_export_rows(db, user_ids, start_date, end_date):
+            data = EXPORT_SCHEMAS[kind].model_validate(row).model_dump(mode="json")
+            lines.append(json.dumps({"type": kind, "user_id": user_id, "data": data}) + "\n")
+            if len(lines) >= EXPORT_CHUNK_SIZE:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+    finally:
+        db.close()
+
+
+@app.get("/export")
+def export(
+    current_user: Annotated[schemas.User, Depends(get_current_user)],
+    start_date: Optional[date] = Query(default=None, description="Earliest date to include"),
+    end_date: Optional[date] = Query(default=None, description="Latest date to include"),
+    patient_id: Optional[int] = Query(default=None, description="Only export this patient, for therapists"),
+    db: Session = Depends(get_db),
+):
+    """
+    Export journal entries, guided journal entries, mood entries and depression risk logs as NDJSON,
+    the user's own for a patient, or their patients' for a therapist
+    :param current_user (schemas.User): Current user
+    :param start_date (Optional[date]): Earliest date to include
+    :param end_date (Optional[date]): Latest date to include
+    :param patient_id (Optional[int]): User ID of a single patient to export, for therapists
+    :param db (Session): Database session
+    :return (StreamingResponse): NDJSON stream
+    :raises (HTTPException): If the date range is invalid or the patient is not the therapist's
+    """
+    if start_date is not None and end_date is not None and start_date > end_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Start date must be before end date",
+        )
+
+    if current_user.role == "therapist":
+        user_ids = commands.get_cached_patient_ids_by_therapist(db, current_user)
+        if patient_id is not None:
+            if patient_id not in user_ids:
+                raise HTTPException(status_code=403, detail="Unauthorized")
+            user_ids = [patient_id]
+        else:
+            user_ids = sorted(user_ids)
+    else:
+        user_ids = [current_user.id]
+
+    return StreamingResponse(
+        export_lines(db.get_bind(), user_ids, start_date, end_date),
+        media_type="application/x-ndjson",
+    )
+
+
 @app.get("/patient-data/{patient_id}", response_model=schemas.UserWithPatientData)
 def get_patient_data(
     patient_id: int,
@@ -861,36 +1147,19 @@ def update_therapist_data(
     return commands.update_therapist_data(db, therapist_data)
     
 
-# WebSocket connection manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-
-    async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(message)
-            return True
-        return False
-
 manager = ConnectionManager()
+# Assigns chat messages their IDs and writes them behind delivery, in batches
+chat_writer = ChatWriter(AsyncSessionLocal)
 
 async def get_current_user_ws(
     websocket: WebSocket,
     token: Optional[str] = Query(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> schemas.User:
     """
     :param websocket (WebSocket): WebSocket connection
     :param token (Optional[str]): JWT
-    :param db (Session): Database session
+    :param db (AsyncSession): Database session
     :return (schemas.User): Current user
     """
     if token is None:
@@ -898,61 +1167,71 @@ async def get_current_user_ws(
         return None
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_email: str = payload.get("sub")
-        if user_email is None:
-            await websocket.close(code=1008)
-            return None
-    except JWTError:
+        token_data = decode_token(token)
+    except HTTPException:
         await websocket.close(code=1008)
         return None
 
-    user = commands.get_user_by_email(db, user_email)
+    user = get_cached_user(token_data)
+    if user is not None:
+        return user
+
+    marker = auth_cache.marker()
+    user = await async_commands.get_user_by_id(db, token_data.id)
     if user is None:
         await websocket.close(code=1008)
         return None
 
+    cache_user(db, user, marker)
     return user
 
 @app.websocket("/ws/chat")
 async def websocket_endpoint(
     websocket: WebSocket,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: schemas.User = Depends(get_current_user_ws)
 ):
     """
     :param websocket (WebSocket): WebSocket connection
-    :param db (Session): Database session
+    :param db (AsyncSession): Database session
     :param current_user (schemas.User): Current user
     """
     if not current_user:
         return
 
-    await manager.connect(websocket, current_user.id)
+    connection = await manager.connect(websocket, current_user.id)
 
     try:
         if current_user.role == "patient":
+            # Give the connection back to the pool while waiting for messages
+            await db.commit()
             while True:
                 data = await websocket.receive_json()
                 print(data, current_user.patient_data.therapist_user_id)
                 if current_user.patient_data.therapist_user_id != data["recipient_id"]:
                     continue
-                await process_message(db, current_user, data["content"], data["recipient_id"])
+                await process_message(current_user, data["content"], data["recipient_id"])
         elif current_user.role == "therapist":
-            patients = [patient.id for patient in commands.get_patients_by_therapist(db, current_user)]
+            # Give the connection back to the pool while waiting for messages
+            await db.commit()
             while True:
                 data = await websocket.receive_json()
-                print(data, patients)
+                # Checked on every message, so patients assigned or removed since the socket
+                # connected are picked up
+                patients = await async_commands.get_cached_patient_ids_by_therapist(db, current_user)
+                # Release the connection if the patients had to be loaded
+                await db.commit()
                 if data["recipient_id"] not in patients:
                     continue
-                await process_message(db, current_user, data["content"], data["recipient_id"])
+                await process_message(current_user, data["content"], data["recipient_id"])
     except WebSocketDisconnect:
-        manager.disconnect(current_user.id)
+        pass
+    finally:
+        manager.disconnect(connection)
 
-async def process_message(db: Session, sender: schemas.User, message_data: str, recipient_id: int):
+async def process_message(sender: schemas.User, message_data: str, recipient_id: int):
     """
-    send a message to a recipient
-    :param db (Session): Database session
+    send a message to a recipient, delivering it before it is written to the database
     :param sender (schemas.User): Sender
     :param message_data (str): Message content
     :param recipient_id (int): Recipient ID
@@ -963,8 +1242,7 @@ async def process_message(db: Session, sender: schemas.User, message_data: str,
         sender_id=sender.id
     )
     
-    chat_message = commands.insert_chat_message(db, message_create)
-    chat_message_schema = schemas.ChatMessage.model_validate(chat_message)
+    chat_message_schema = await chat_writer.write(message_create)
     converted = chat_message_schema.model_dump()
     converted["timestamp"] = chat_message_schema.timestamp.isoformat()
 
@@ -976,8 +1254,8 @@ async def get_chat_messages(
     other_user_id: int,
     skip: int = 0,
     limit: int = 100,
-    current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get chat messages
@@ -985,83 +1263,173 @@ async def get_chat_messages(
     :param skip (int): Number of entries to skip
     :param limit (int): Number of entries to return
     :param current_user (schemas.User): Current user
-    :param db (Session): Database session
+    :param db (AsyncSession): Database session
     :return (List[schemas.ChatMessage]): Chat messages
     """
-    return commands.get_chat_messages(db, current_user, other_user_id, skip, limit)
+    return await async_commands.get_chat_messages(db, current_user, other_user_id, skip, limit)
+
 
-@app.get("/batch")
-async def update_depression_risk(
-    token: str = Query(..., description="Authentication token"),
+@app.get("/chat/threads", response_model=List[schemas.ChatThread])
+async def get_chat_threads(
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get the current user's conversations, with the last message and unread count of each,
+    most recent first
+    :param current_user (schemas.User): Current user
+    :param db (AsyncSession): Database session
+    :return (List[schemas.ChatThread]): Chat threads
+    """
+    return await async_commands.get_chat_threads(db, current_user)
+
+
+@app.post("/chat/threads/{other_user_id}/read")
+async def mark_chat_thread_read(
+    other_user_id: int,
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Mark the messages of a conversation as read
+    :param other_user_id (int): Other user ID
+    :param current_user (schemas.User): Current user
+    :param db (AsyncSession): Database session
+    :return (dict): Success message
+    :raises (HTTPException): If there is no conversation with the other user
+    """
+    if not await async_commands.mark_chat_thread_read(db, current_user, other_user_id):
+        raise HTTPException(status_code=404, detail="Chat thread not found")
+    return {"detail": "Chat thread marked as read"}
+
+
+@app.get("/chat/messages/{other_user_id}/page", response_model=schemas.CursorPage[schemas.ChatMessage])
+async def get_chat_messages_page(
+    other_user_id: int,
+    cursor: Optional[str] = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(default=100, ge=1, le=1000, description="Number of messages to return"),
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get a page of chat messages, newest first
+    :param other_user_id (int): Other user ID
+    :param cursor (Optional[str]): Cursor of the page, None for the first page
+    :param limit (int): Number of messages to return
+    :param current_user (schemas.User): Current user
+    :param db (AsyncSession): Database session
+    :return (schemas.CursorPage[schemas.ChatMessage]): Chat messages and the cursor of the next page
+    """
+    before = decode_cursor(cursor, datetime)
+    rows = await async_commands.get_chat_messages_page(db, current_user, other_user_id, limit, before)
+    items, next_cursor = pagination.paginate(rows, limit, lambda message: (message.timestamp, message.id))
+    return {"items": items, "next_cursor": next_cursor}
+
+def check_batch_token(token: str = Query(..., description="Authentication token")):
+    """
+    Check the token of the batch endpoints
+    :param token (str): Authentication token
+    """
+    if token != os.getenv("BATCH_TOKEN"):
+        raise HTTPException(status_code=403, detail="Unauthorized")
+
+@app.post("/batch/jobs", response_model=schemas.BatchJob, dependencies=[Depends(check_batch_token)])
+def create_batch_job(
+    job: schemas.BatchJobCreate = schemas.BatchJobCreate(),
     db: Session = Depends(get_db)
 ):
     """
-    Update depression risk for all patients
+    Queue a depression risk scoring run, or return the one already queued or running
+    :param job (schemas.BatchJobCreate): Batch job create schema
     :param db (Session): Database session
+    :return (schemas.BatchJob): Batch job
     """
+    db_job = commands.create_batch_job(db, job)
+    if db_job.status == schemas.BatchJobStatus.pending.value:
+        # Queueing a job twice is harmless, the worker skips jobs that are already done
+        app.state.jobs.enqueue(db_job.id)
+    return db_job
 
-    if token != os.getenv("BATCH_TOKEN"):
+@app.get("/batch/jobs/{job_id}", response_model=schemas.BatchJob, dependencies=[Depends(check_batch_token)])
+def get_batch_job(job_id: int, db: Session = Depends(get_db)):
+    """
+    Get the progress of a depression risk scoring run
+    :param job_id (int): Batch job ID
+    :param db (Session): Database session
+    :return (schemas.BatchJob): Batch job
+    """
+    db_job = commands.get_batch_job(db, job_id)
+    if db_job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return db_job
+
+@app.get("/batch", dependencies=[Depends(check_batch_token)])
+def update_depression_risk(
+    force: bool = Query(False, description="Re-score every patient, not only those whose journals changed"),
+    db: Session = Depends(get_db)
+):
+    """
+    Queue a depression risk scoring run, kept for the scheduler that calls GET /batch
+    :param force (bool): Re-score every patient
+    :param db (Session): Database session
+    """
+    db_job = create_batch_job(schemas.BatchJobCreate(force=force), db)
+    return {"detail": "Depression risk update queued", "job": schemas.BatchJob.model_validate(db_job)}
+
+def check_admin_token(token: str = Query(..., description="Authentication token")):
+    """
+    Check the token of the admin endpoints, which defaults to the batch token
+    :param token (str): Authentication token
+    """
+    if token != (os.getenv("ADMIN_TOKEN") or os.getenv("BATCH_TOKEN")):
         raise HTTPException(status_code=403, detail="Unauthorized")
 
-    patients = commands.get_all_patients_with_entries(db)
-    details = {}
-    for patient in patients:
-        model_endpoint = os.getenv("MODEL_ENDPOINT")
-        inputs = []
-        for journal in patient.patient_data.journal_entries:
-            inputs.append(
-                {
-                    "text": journal.title + "\n" + journal.body, 
-                    "timestamp": journal.date.isoformat(), 
-                    "image": journal.image if journal.image else None,
-                }
-            )
-        
-        response: aiohttp.ClientResponse = await app.state.session.post(model_endpoint, json={"data": inputs})
-
-        if response.status == 200:
-            output = await response.json()
-            print(output)
-            prob = output["probas"][0]
-            depression_risk_log = schemas.DepressionRiskLogCreate(
-                value=prob,
-                date=datetime.now().date(),
-                user_id=patient.id
-            )
-            risk = "None"
-            if prob >= 0.8:
-                risk = "Severe",
-            elif prob >= 0.6:
-                risk = "Moderately Severe",
-            elif prob >= 0.4: 
-                risk = "Moderate",
-            elif prob >= 0.2:
-                risk = "Mild"
-            else:
-                risk = "None"
-            print(risk)
-            commands.upsert_depression_risk_log(db, depression_risk_log)
-            commands.update_patient_data(db, schemas.PatientDataUpdate(
-                user_id=patient.id,
-                severity=risk
-            ))
-            details[patient.id] = {
-                "risk": prob,
-                "severity": risk
-            }
-
-    return {"detail": "Depression risk updated", "details": details}
+@app.get("/admin/auth-cache", dependencies=[Depends(check_admin_token)])
+def get_auth_cache():
+    """
+    Get the hit/miss counters of the authenticated user cache
+    :return (dict): Auth cache stats
+    """
+    return auth_cache.stats()
+
+@app.get("/admin/patient-cache", dependencies=[Depends(check_admin_token)])
+def get_patient_cache():
+    """
+    Get the hit/miss counters of the therapist patient cache
+    :return (dict): Patient cache stats
+    """
+    return patient_cache.stats()
+
+@app.get("/admin/chat-writer", dependencies=[Depends(check_admin_token)])
+def get_chat_writer():
+    """
+    Get the counters of the chat write-behind buffer
+    :return (dict): Chat writer stats
+    """
+    return chat_writer.stats()
+
+@app.get("/admin/pool", dependencies=[Depends(check_admin_token)])
+def get_pool():
+    """
+    Get the state of the database connection pools: checked out connections, overflow,
+    checkout wait time histogram and connection age
+    :return (dict): Pool status of the sync and async engines
+    """
+    return {
+        "sync": get_pool_status(engine.pool),
+        "async": get_pool_status(async_engine.sync_engine.pool),
+    }
 
 @app.get("/user/depression-risks/{user_id}", response_model=List[schemas.DepressionRiskLog])
 async def get_depression_risks(
     user_id: int,
-    current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get depression risks for a user
     :param current_user (schemas.User): Current user
-    :param db (Session): Database session
+    :param db (AsyncSession): Database session
     :return (List[schemas.DepressionRiskLog]): Depression risks
     """
 
@@ -1069,34 +1437,33 @@ async def get_depression_risks(
     
     if current_user.role != "therapist":
         raise HTTPException(status_code=403, detail="Unauthorized")
-    patients = [patient.id for patient in commands.get_patients_by_therapist(db, current_user)]
-    print(patients)
+    patients = await async_commands.get_cached_patient_ids_by_therapist(db, current_user)
     if user_id not in patients:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    return commands.get_depression_risk_logs_by_user(db, user_id)
+    return await async_commands.get_depression_risk_logs_by_user(db, user_id)
 
 @app.get("/user/depression-risk/{user_id}", response_model=schemas.DepressionRiskLog)
 async def get_depression_risk(
     user_id: int,
-    current_user: schemas.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: schemas.User = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get latest depression risk for a user
     :param current_user (schemas.User): Current user
-    :param db (Session): Database session
+    :param db (AsyncSession): Database session
     :return (DepressionRiskLog): Depression risk
     """
 
     # make sure it is a therapist and the user is their patient
     if current_user.role != "therapist":
         raise HTTPException(status_code=403, detail="Unauthorized")
-    patients = [patient.id for patient in commands.get_patients_by_therapist(db, current_user)]
+    patients = await async_commands.get_cached_patient_ids_by_therapist(db, current_user)
     if user_id not in patients:
         raise HTTPException(status_code=403, detail="Unauthorized")
     
-    res = commands.get_latest_depression_risk_log_by_user(db, user_id)
+    res = await async_commands.get_latest_depression_risk_log_by_user(db, user_id)
     if res is None:
         raise HTTPException(status_code=404, detail="No depression risk found")
     return res
@@ -10,7 +10,8 @@ from sqlalchemy import (
     Date,
     JSON,
     func,
-    Float
+    Float,
+    UniqueConstraint
 )
 from sqlalchemy.orm import relationship
 from app.database import Base
@@ -26,18 +27,83 @@ class DepressionRiskLog(Base):
     value = Column(Float)
     date = Column(Date)
 
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_depression_risk_logs_user_id_date"),
+    )  # One risk log per user per day, needed for bulk upserts
+
+class BatchJob(Base):
+    """
+    Batch Job Model, one depression risk scoring run
+    """
+    __tablename__ = "batch_jobs"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, default="pending", index=True)
+    force = Column(Boolean, default=False)
+    total = Column(Integer, nullable=True)
+    processed = Column(Integer, default=0)
+    scored = Column(Integer, default=0)
+    errors = Column(Integer, default=0)
+    model_calls = Column(Integer, default=0)
+    last_patient_id = Column(Integer, default=0)  # Resume point, every patient up to it is done
+    elapsed_seconds = Column(Float, default=0)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    claimed_by = Column(String, nullable=True)  # Worker running the job
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)  # Last renewal of the worker's claim
+
+    __table_args__ = (
+        Index(
+            "uq_batch_jobs_unfinished",
+            status.in_(["pending", "running"]),
+            unique=True,
+            postgresql_where=status.in_(["pending", "running"]),
+            sqlite_where=status.in_(["pending", "running"]),
+        ),
+    )  # At most one pending or running job
+
+    @property
+    def remaining(self):
+        if self.total is None:
+            return None
+        return max(self.total - self.processed, 0)
+
+    @property
+    def patients_per_second(self):
+        return round(self.scored / self.elapsed_seconds, 3) if self.elapsed_seconds else 0.0
+
 class ChatMessage(Base):
     """
     Chat Message Model
     """
     __tablename__ = "chat_messages"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     content = Column(String)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     recipient_id = Column(Integer, ForeignKey("users.id"))
     sender_id = Column(Integer, ForeignKey("users.id"))
 
+    __table_args__ = (
+        Index("ix_chat_messages_sender_id_recipient_id_timestamp", sender_id, recipient_id, timestamp, id),
+    )  # One side of a conversation, in order
+
+class ChatThread(Base):
+    """
+    Chat Thread Model, one user's summary of a conversation, kept up to date as messages are inserted
+    """
+    __tablename__ = "chat_threads"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    other_user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    last_message_id = Column(Integer)
+    last_sender_id = Column(Integer)
+    last_message = Column(String)
+    last_timestamp = Column(DateTime(timezone=True))
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")  # Messages from the other user since last read
+
 class User(Base):
     """
     User Model
@@ -77,6 +143,7 @@ class PatientData(Base):
     has_onboarded = Column(Boolean, default=False)
     severity = Column(String, default="Unknown")
     therapist_note = Column(String, nullable=True)
+    last_scored_at = Column(DateTime(timezone=True), nullable=True)
 
     mood_entries = relationship("MoodEntry", back_populates="patient_data")
     journal_entries = relationship("JournalEntry", back_populates="patient_data")
@@ -130,17 +197,24 @@ class MoodEntry(Base):
     __tablename__ = "mood_entries"
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, index=True)
+    date = Column(Date)
     mood = Column(SmallInteger)
     eat = Column(SmallInteger)
     sleep = Column(SmallInteger)
-    patient_data_id = Column(Integer, ForeignKey("patient_data.id"), index=True)
+    patient_data_id = Column(Integer, ForeignKey("patient_data.id"))
 
     patient_data = relationship("PatientData", back_populates="mood_entries")
 
     __table_args__ = (
-        Index("ix_mood_entries_date_desc", date.desc()),
-    )  # Index for date in descending order
+        Index(
+            "ix_mood_entries_patient_data_id_date_desc",
+            patient_data_id,
+            date.desc(),
+            id.desc(),
+            postgresql_include=["mood", "eat", "sleep"],
+        ),  # Covers mood lists and date ranges without reading the table
+        UniqueConstraint("patient_data_id", "date", name="uq_mood_entries_patient_data_id_date"),
+    )  # A patient's entries newest first, and one entry per patient per day for upserts
 
 
 class JournalEntry(Base):
@@ -151,17 +225,19 @@ class JournalEntry(Base):
     __tablename__ = "journal_entries"
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, index=True)
+    date = Column(Date)
     title = Column(String)
     body = Column(String)
     image = Column(String, nullable=True)
-    patient_data_id = Column(Integer, ForeignKey("patient_data.id"), index=True)
+    patient_data_id = Column(Integer, ForeignKey("patient_data.id"))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     patient_data = relationship("PatientData", back_populates="journal_entries")
 
     __table_args__ = (
-        Index("ix_journal_entries_date_desc", date.desc()),
-    )  # Index for date in descending order
+        Index("ix_journal_entries_patient_data_id_date_desc", patient_data_id, date.desc(), id.desc()),
+        UniqueConstraint("patient_data_id", "date", name="uq_journal_entries_patient_data_id_date"),
+    )  # A patient's entries newest first, and one entry per patient per day for upserts
 
 
 class GuidedJournalEntry(Base):
@@ -172,12 +248,14 @@ class GuidedJournalEntry(Base):
     __tablename__ = "guided_journal_entries"
 
     id = Column(Integer, primary_key=True)
-    date = Column(Date, index=True)
+    date = Column(Date)
     body = Column(JSON)
-    patient_data_id = Column(Integer, ForeignKey("patient_data.id"), index=True)
+    patient_data_id = Column(Integer, ForeignKey("patient_data.id"))
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     patient_data = relationship("PatientData", back_populates="guided_journal_entries")
 
     __table_args__ = (
-        Index("ix_guided_journal_entries_date_desc", date.desc()),
-    )  # Index for date in descending order
+        Index("ix_guided_journal_entries_patient_data_id_date_desc", patient_data_id, date.desc(), id.desc()),
+        UniqueConstraint("patient_data_id", "date", name="uq_guided_journal_entries_patient_data_id_date"),
+    )  # A patient's entries newest first, and one entry per patient per day for upserts
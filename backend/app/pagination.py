@@ -0,0 +1,58 @@
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from typing import Callable, Optional, Tuple, Union
+
+# Keyset pagination: a page continues after the (date or timestamp, id) of the previous
+# page's last row instead of skipping rows, so deep pages cost the same as the first one.
+# The key travels to the client as an opaque cursor.
+
+Key = Tuple[Union[date, datetime], int]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(key: Key) -> str:
+    """
+    Encode the key of the last row of a page as a cursor
+    :param key (Key): Date or timestamp, and ID of the row
+    :return (str): URL-safe cursor
+    """
+    value, id = key
+    payload = json.dumps([value.isoformat(), id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, value_type: type) -> Key:
+    """
+    Decode a cursor made by encode_cursor
+    :param cursor (str): Cursor
+    :param value_type (type): date or datetime, the type of the first half of the key
+    :return (Key): Date or timestamp, and ID of the row
+    :raises (InvalidCursor): If the cursor was not made by encode_cursor
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, id = json.loads(payload)
+        if not isinstance(id, int):
+            raise ValueError("Cursor ID must be an integer")
+        return value_type.fromisoformat(value), id
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def paginate(rows: list, limit: int, key: Callable[[object], Key]) -> Tuple[list, Optional[str]]:
+    """
+    Split rows fetched with a limit of `limit + 1` into a page and the cursor of the next page
+    :param rows (list): Up to limit + 1 rows
+    :param limit (int): Page size
+    :param key (Callable): Key of a row
+    :return (Tuple[list, Optional[str]]): Rows of the page, cursor of the next page or None on the last page
+    """
+    if len(rows) <= limit:
+        return rows, None
+    items = rows[:limit]
+    return items, encode_cursor(key(items[-1]))
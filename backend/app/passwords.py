@@ -0,0 +1,91 @@
+import asyncio
+import multiprocessing
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+# bcrypt cost factor of new hashes, existing hashes keep verifying with their own cost
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS") or 12)
+# Processes bcrypt runs on, so hashing never holds the GIL or a request thread
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or max(1, (os.cpu_count() or 2) // 2))
+# Hash/verify calls allowed in flight at once, the rest wait their turn without taking a worker
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY") or PASSWORD_HASH_WORKERS * 2)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+executor: Optional[ProcessPoolExecutor] = None
+# One concurrency limit per event loop, a semaphore cannot be shared between loops
+semaphores = weakref.WeakKeyDictionary()
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+
+def _ping() -> bool:
+    return True
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    Get the password hashing process pool, starting it on first use
+    :return (ProcessPoolExecutor): Process pool
+    """
+    global executor
+    if executor is None:
+        # Spawned rather than forked, forking a process with running threads is not safe
+        executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return executor
+
+
+def start():
+    """
+    Start the process pool and its workers so the first sign-in does not pay for it
+    """
+    pool = get_executor()
+    for future in [pool.submit(_ping) for _ in range(PASSWORD_HASH_WORKERS)]:
+        future.result()
+
+
+def shutdown():
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+async def _run(function, *args):
+    loop = asyncio.get_running_loop()
+    if loop not in semaphores:
+        semaphores[loop] = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+    async with semaphores[loop]:
+        return await loop.run_in_executor(get_executor(), function, *args)
+
+
+async def hash_password_async(password: str) -> str:
+    """
+    Hash a password on the process pool without blocking the event loop
+    :param password (str): Plain password
+    :return (str): bcrypt hash
+    """
+    return await _run(_hash, password)
+
+
+async def verify_password_async(password: str, hashed_password: str) -> bool:
+    """
+    Verify a password on the process pool without blocking the event loop
+    :param password (str): Plain password
+    :param hashed_password (str): bcrypt hash
+    :return (bool): Whether the password matches
+    """
+    return await _run(_verify, password, hashed_password)
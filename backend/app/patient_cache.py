@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, Iterable, Optional
+
+
+class PatientCache:
+    """
+    Bounded cache of the user IDs of each therapist's patients, keyed by therapist user ID,
+    for O(1) checks that a user is one of a therapist's patients.
+
+    Sets are loaded on a miss and kept up to date by assign_therapist_to_patient and
+    remove_therapist_from_patient. Those only reach this process's cache, so sets also
+    expire after a TTL to pick up assignments made by other workers. Sets are frozen and
+    replaced on every change, so a set handed out never changes under its reader.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # therapist user ID -> (expires at, patient user IDs), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.changes = 0
+
+    def get(self, therapist_id: int) -> Optional[FrozenSet[int]]:
+        """
+        Get a therapist's cached patients
+        :param therapist_id (int): Therapist user ID
+        :return (Optional[FrozenSet[int]]): Patient user IDs if cached, None if not
+        """
+        with self.lock:
+            entry = self.entries.get(therapist_id)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[therapist_id]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(therapist_id)
+            self.hits += 1
+            return entry[1]
+
+    def marker(self) -> int:
+        """
+        Take a marker before loading a therapist's patients, to pass to put
+        :return (int): Number of changes so far
+        """
+        with self.lock:
+            return self.changes
+
+    def put(self, therapist_id: int, patient_ids: Iterable[int], marker: int) -> FrozenSet[int]:
+        """
+        Cache a therapist's patients, unless an assignment changed since the marker was
+        taken, in which case they may have been loaded before the change
+        :param therapist_id (int): Therapist user ID
+        :param patient_ids (Iterable[int]): Patient user IDs
+        :param marker (int): Marker taken before the patients were loaded
+        :return (FrozenSet[int]): Patient user IDs
+        """
+        patient_ids = frozenset(patient_ids)
+        with self.lock:
+            if marker != self.changes:
+                return patient_ids
+            self.entries[therapist_id] = (time.monotonic() + self.ttl, patient_ids)
+            self.entries.move_to_end(therapist_id)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            return patient_ids
+
+    def add(self, therapist_id: int, patient_id: int):
+        """
+        Record that a patient was assigned to a therapist
+        :param therapist_id (int): Therapist user ID
+        :param patient_id (int): Patient user ID
+        """
+        with self.lock:
+            self.changes += 1
+            entry = self.entries.get(therapist_id)
+            if entry is not None:
+                self.entries[therapist_id] = (entry[0], entry[1] | {patient_id})
+
+    def remove(self, therapist_id: int, patient_id: int):
+        """
+        Record that a patient was removed from a therapist
+        :param therapist_id (int): Therapist user ID
+        :param patient_id (int): Patient user ID
+        """
+        with self.lock:
+            self.changes += 1
+            entry = self.entries.get(therapist_id)
+            if entry is not None:
+                self.entries[therapist_id] = (entry[0], entry[1] - {patient_id})
+
+    def clear(self):
+        with self.lock:
+            self.changes += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "changes": self.changes,
+            }
+
+
+patient_cache = PatientCache(
+    max_size=int(os.getenv("PATIENT_CACHE_MAX_SIZE") or 10000),
+    ttl=float(os.getenv("PATIENT_CACHE_TTL") or 60),
+)
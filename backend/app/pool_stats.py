@@ -0,0 +1,119 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+# Upper bounds (in milliseconds) of the checkout wait time histogram buckets
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class PoolStats:
+    """
+    Checkout counters, wait time histogram and live connections of one connection pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_total_ms = 0.0
+        self.wait_max_ms = 0.0
+        self.records = weakref.WeakSet()
+
+    def record_checkout(self, wait_ms: float, record=None):
+        """
+        Record one checkout from the pool
+        :param wait_ms (float): Time spent waiting for a connection in milliseconds
+        :param record: Connection record handed out, None if the checkout timed out
+        """
+        with self.lock:
+            self.checkouts += 1
+            if record is None:
+                self.timeouts += 1
+            else:
+                self.records.add(record)
+            self.wait_buckets[bisect_left(WAIT_BUCKETS_MS, wait_ms)] += 1
+            self.wait_total_ms += wait_ms
+            self.wait_max_ms = max(self.wait_max_ms, wait_ms)
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        with self.lock:
+            ages = [
+                now - record.starttime
+                for record in self.records
+                if record.dbapi_connection is not None
+            ]
+            labels = [f"<={bound}" for bound in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}"]
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms": {
+                    "mean": round(self.wait_total_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                    "max": round(self.wait_max_ms, 3),
+                    "histogram": dict(zip(labels, self.wait_buckets)),
+                },
+                "connection_age_seconds": {
+                    "connections": len(ages),
+                    "min": round(min(ages), 3) if ages else None,
+                    "max": round(max(ages), 3) if ages else None,
+                    "mean": round(sum(ages) / len(ages), 3) if ages else None,
+                },
+            }
+
+
+class InstrumentedPoolMixin:
+    """
+    Times every checkout of a queue pool and keeps the stats across engine.dispose()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_checkout((time.perf_counter() - start) * 1000)
+            raise
+        self.stats.record_checkout((time.perf_counter() - start) * 1000, record)
+        return record
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_pool_status(pool: Pool) -> dict:
+    """
+    Get the current state and the stats of a connection pool
+    :param pool (Pool): Connection pool
+    :return (dict): Pool status
+    """
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    if isinstance(pool, InstrumentedPoolMixin):
+        status.update(pool.stats.to_dict())
+    return status
@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Statements slower than this are printed with their parameters
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 200)
+# Longest parameter repr printed with a slow statement
+SLOW_QUERY_MAX_PARAMETERS_LENGTH = 500
+
+
+class QueryStats:
+    """
+    Number of statements and time spent on them while tracking was active
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration_ms = 0.0
+
+    def record(self, duration_ms: float):
+        self.count += 1
+        self.duration_ms += duration_ms
+
+    def server_timing(self) -> str:
+        """
+        Format the stats as a Server-Timing header value
+        :return (str): Header value
+        """
+        return f'db;dur={self.duration_ms:.1f};desc="{self.count} queries"'
+
+
+# The stats of the request being handled. Sync routes and dependencies run in the threadpool
+# with a copy of the request's context, so they still see and update the same object.
+current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+@contextmanager
+def track() -> Iterator[QueryStats]:
+    """
+    Count the statements executed in the current context, on every engine
+    :return (Iterator[QueryStats]): Stats, updated as statements run
+    """
+    stats = QueryStats()
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+
+
+def log_slow_query(statement: str, parameters, duration_ms: float):
+    parameters = repr(parameters)
+    if len(parameters) > SLOW_QUERY_MAX_PARAMETERS_LENGTH:
+        parameters = parameters[:SLOW_QUERY_MAX_PARAMETERS_LENGTH] + "..."
+    statement = " ".join(statement.split())
+    print(f"Slow query ({duration_ms:.1f}ms): {statement} parameters={parameters}")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+    stats = current_stats.get()
+    if stats is not None:
+        stats.record(duration_ms)
+    if duration_ms >= SLOW_QUERY_MS:
+        log_slow_query(statement, parameters, duration_ms)
+
+
+@event.listens_for(Engine, "handle_error")
+def handle_error(context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    if context.connection is not None and context.connection.info.get("query_start"):
+        context.connection.info["query_start"].pop()
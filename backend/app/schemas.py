@@ -1,6 +1,6 @@
 from __future__ import annotations
 from enum import Enum
-from typing import Optional, List
+from typing import Generic, Optional, List, TypeVar
 from pydantic import BaseModel
 from datetime import datetime, date
 
@@ -18,6 +18,12 @@ class DepressionRiskLogCreate(DepressionRiskLogBase):
     """
     pass
 
+class DepressionRiskUpdate(DepressionRiskLogBase):
+    """
+    Depression Risk Update Schema, a risk log together with the resulting patient severity
+    """
+    severity: str
+
 class DepressionRiskLog(DepressionRiskLogBase):
     """
     Depression Risk Log Schema
@@ -27,6 +33,47 @@ class DepressionRiskLog(DepressionRiskLogBase):
     class Config:
         from_attributes = True
 
+class BatchJobStatus(str, Enum):
+    """
+    Batch Job Status Enum
+    """
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+class BatchJobCreate(BaseModel):
+    """
+    Batch Job Create Schema
+    """
+    force: bool = False
+
+class BatchJob(BatchJobCreate):
+    """
+    Batch Job Schema, with the progress of the run
+    """
+    id: int
+    status: BatchJobStatus
+    total: Optional[int] = None
+    processed: int
+    remaining: Optional[int] = None
+    scored: int
+    errors: int
+    model_calls: int
+    last_patient_id: int
+    elapsed_seconds: float
+    patients_per_second: float
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    claimed_by: Optional[str] = None
+    heartbeat_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+        protected_namespaces = ()
+
 class ChatMessageBase(BaseModel):
     """
     Chat Message Base Schema
@@ -51,6 +98,20 @@ class ChatMessage(ChatMessageBase):
     class Config:
         from_attributes = True
 
+class ChatThread(BaseModel):
+    """
+    Chat Thread Schema, a conversation in the current user's inbox
+    """
+    other_user_id: int
+    last_message_id: int
+    last_sender_id: int
+    last_message: str
+    last_timestamp: datetime
+    unread_count: int
+
+    class Config:
+        from_attributes = True
+
 class CognitiveDistortion(str, Enum):
     """
     Cognitive Distortion Enum
@@ -397,4 +458,16 @@ class TherapistData(TherapistDataBase):
     patients: Optional[list["PatientData"]] = []
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+T = TypeVar("T")
+
+
+class CursorPage(BaseModel, Generic[T]):
+    """
+    Cursor Page Schema, pass next_cursor back as the cursor to get the next page
+    """
+
+    items: List[T]
+    next_cursor: Optional[str] = None
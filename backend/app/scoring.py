@@ -0,0 +1,173 @@
+import asyncio
+import time
+from typing import Dict, List
+
+import aiohttp
+
+from app import models
+
+
+def get_severity(prob: float) -> str:
+    """
+    Map a depression probability to a severity label
+    :param prob (float): Depression probability
+    :return (str): Severity
+    """
+    if prob >= 0.8:
+        return "Severe"
+    elif prob >= 0.6:
+        return "Moderately Severe"
+    elif prob >= 0.4:
+        return "Moderate"
+    elif prob >= 0.2:
+        return "Mild"
+    return "None"
+
+
+def build_timeline(patient: models.User) -> dict:
+    """
+    Build the model input for one patient from their loaded journal entries
+    :param patient (models.User): Patient with patient_data.journal_entries loaded
+    :return (dict): Patient timeline ({patient_id, data})
+    """
+    inputs = []
+    for journal in patient.patient_data.journal_entries:
+        inputs.append(
+            {
+                "text": journal.title + "\n" + journal.body,
+                "timestamp": journal.date.isoformat(),
+                "image": journal.image if journal.image else None,
+            }
+        )
+    return {"patient_id": patient.id, "data": inputs}
+
+
+class ScoringError(Exception):
+    """
+    Raised when a chunk of patients could not be scored after all retries
+    """
+    pass
+
+
+class ScoringReport:
+    """
+    Outcome of one scoring run: probabilities per patient, failures and throughput
+    """
+
+    def __init__(self, patients: int):
+        self.patients = patients
+        self.probabilities: Dict[int, float] = {}
+        self.failures: List[dict] = []
+        self.model_calls = 0
+        self.started_at = time.perf_counter()
+        self.elapsed = 0.0
+
+    def merge(self, other: "ScoringReport"):
+        """
+        Fold the results of another (partial) run into this one
+        """
+        self.patients += other.patients
+        self.probabilities.update(other.probabilities)
+        self.failures.extend(other.failures)
+        self.model_calls += other.model_calls
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "patients": self.patients,
+            "scored": len(self.probabilities),
+            "failed": sum(len(failure["patient_ids"]) for failure in self.failures),
+            "model_calls": self.model_calls,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "patients_per_second": round(len(self.probabilities) / self.elapsed, 3) if self.elapsed else 0.0,
+            "failures": self.failures,
+        }
+
+
+async def post_chunk(
+    session: aiohttp.ClientSession,
+    endpoint: str,
+    chunk: List[dict],
+    semaphore: asyncio.Semaphore,
+    timeout: float,
+    retries: int,
+    backoff: float,
+) -> dict:
+    """
+    Send one chunk of patient timelines to the model's bulk endpoint
+    :param session (aiohttp.ClientSession): HTTP session
+    :param endpoint (str): Bulk scoring endpoint
+    :param chunk (List[dict]): Patient timelines ({patient_id, data})
+    :param semaphore (asyncio.Semaphore): Bounds the number of calls in flight
+    :param timeout (float): Timeout of a single attempt in seconds
+    :param retries (int): Number of retries after the first attempt
+    :param backoff (float): Base delay between attempts in seconds, doubled after each attempt
+    :return (dict): Model output keyed by patient ID
+    :raises (ScoringError): If every attempt failed
+    """
+    async with semaphore:
+        error = None
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            try:
+                async with session.post(
+                    endpoint, json=chunk, timeout=aiohttp.ClientTimeout(total=timeout)
+                ) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    error = f"Model returned HTTP {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = f"{type(e).__name__}: {e}"
+        raise ScoringError(error)
+
+
+async def score_timelines(
+    session: aiohttp.ClientSession,
+    endpoint: str,
+    timelines: List[dict],
+    bulk_size: int = 64,
+    concurrency: int = 4,
+    timeout: float = 120,
+    retries: int = 2,
+    backoff: float = 1,
+) -> ScoringReport:
+    """
+    Score patient timelines by fanning chunks out to the model concurrently
+    :param session (aiohttp.ClientSession): HTTP session
+    :param endpoint (str): Bulk scoring endpoint
+    :param timelines (List[dict]): Patient timelines ({patient_id, data})
+    :param bulk_size (int): Number of patients per model call
+    :param concurrency (int): Maximum number of model calls in flight
+    :param timeout (float): Timeout of a single model call in seconds
+    :param retries (int): Number of retries per model call
+    :param backoff (float): Base delay between retries in seconds
+    :return (ScoringReport): Probabilities, failures and throughput of the run
+    """
+    report = ScoringReport(len(timelines))
+    semaphore = asyncio.Semaphore(concurrency)
+    chunks = [timelines[start:start + bulk_size] for start in range(0, len(timelines), bulk_size)]
+    report.model_calls = len(chunks)
+
+    outputs = await asyncio.gather(
+        *[
+            post_chunk(session, endpoint, chunk, semaphore, timeout, retries, backoff)
+            for chunk in chunks
+        ],
+        return_exceptions=True,
+    )
+
+    for chunk, output in zip(chunks, outputs):
+        if isinstance(output, BaseException):
+            report.failures.append({
+                "patient_ids": [timeline["patient_id"] for timeline in chunk],
+                "error": str(output),
+            })
+            continue
+        for patient_id, result in output.items():
+            report.probabilities[int(patient_id)] = result["probas"][0]
+
+    report.finish()
+    return report
@@ -0,0 +1,142 @@
+"""
+Chat fan-out benchmark.
+
+Connects thousands of simulated sockets to the chat ConnectionManager, a share of
+them slow, and sends messages to every user. Reports how long the sender is held
+up per message and how long messages take to reach fast sockets, for each slow
+consumer policy and for the old inline send_json as a baseline. Needs no server
+or database, for example:
+
+    cd backend
+    python -m scripts.chat_fanout_benchmark --users 2000 --sockets-per-user 2 --messages 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import List
+
+os.environ["CHAT_BROKER"] = "local"
+
+from app.chat_manager import ConnectionManager  # noqa: E402
+
+
+class SimulatedWebSocket:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.arrivals: List[float] = []  # Seconds from send to arrival
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await asyncio.sleep(self.latency)
+        self.arrivals.append(time.perf_counter() - message["sent_at"])
+
+    async def close(self, code):
+        pass
+
+
+class InlineManager:
+    """
+    The previous manager: one socket per user, sent to inline by the sender
+    """
+
+    def __init__(self):
+        self.active_connections = {}
+
+    async def connect(self, websocket, user_id):
+        await websocket.accept()
+        self.active_connections[user_id] = websocket
+
+    async def send_personal_message(self, message, user_id):
+        if user_id in self.active_connections:
+            await self.active_connections[user_id].send_json(message)
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(name: str, manager, args) -> dict:
+    rng = random.Random(args.seed)
+    sockets = []
+    sockets_per_user = 1 if isinstance(manager, InlineManager) else args.sockets_per_user
+    for user_id in range(args.users):
+        for _ in range(sockets_per_user):
+            slow = rng.random() < args.slow_share
+            websocket = SimulatedWebSocket(args.slow_latency if slow else args.fast_latency)
+            websocket.slow = slow
+            await manager.connect(websocket, user_id)
+            sockets.append(websocket)
+
+    sender_waits = []
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        for user_id in range(args.users):
+            sent_at = time.perf_counter()
+            await manager.send_personal_message({"content": "Hello", "sent_at": sent_at}, user_id)
+            sender_waits.append(time.perf_counter() - sent_at)
+        await asyncio.sleep(args.interval)
+    elapsed = time.perf_counter() - start
+    # Let the writers drain what fast sockets still have queued
+    await asyncio.sleep(args.fast_latency * 10 + 0.1)
+
+    fast_arrivals = [arrival for websocket in sockets if not websocket.slow for arrival in websocket.arrivals]
+    expected_fast = args.messages * sum(1 for websocket in sockets if not websocket.slow)
+    result = {
+        "name": name,
+        "sockets": len(sockets),
+        "send_rate": len(sender_waits) / elapsed,
+        "sender_p99_ms": percentile(sender_waits, 0.99) * 1000,
+        "fast_p50_ms": percentile(fast_arrivals, 0.5) * 1000,
+        "fast_p99_ms": percentile(fast_arrivals, 0.99) * 1000,
+        "fast_delivered": len(fast_arrivals) / expected_fast if expected_fast else 1.0,
+        "slow_consumers": getattr(manager, "slow_consumers", 0),
+    }
+    if isinstance(manager, ConnectionManager):
+        for connections in list(manager.active_connections.values()):
+            for connection in list(connections):
+                manager.disconnect(connection)
+    return result
+
+
+async def main(args):
+    print(
+        f"{args.users} users, {args.sockets_per_user} sockets each, {args.slow_share:.0%} slow "
+        f"({args.slow_latency * 1000:.0f}ms per send), {args.messages} messages per user"
+    )
+    results = [await run("inline (old)", InlineManager(), args)]
+    for policy in ("disconnect", "drop", "wait"):
+        manager = ConnectionManager(queue_size=args.queue_size, policy=policy, send_timeout=args.send_timeout)
+        results.append(await run(policy, manager, args))
+
+    print(
+        f"\n{'manager':<14} {'sockets':>8} {'msg/s':>10} {'sender p99':>11} "
+        f"{'fast p50':>9} {'fast p99':>9} {'fast got':>9} {'slow cut':>9}"
+    )
+    for r in results:
+        print(
+            f"{r['name']:<14} {r['sockets']:>8} {r['send_rate']:>10.0f} {r['sender_p99_ms']:>9.2f}ms "
+            f"{r['fast_p50_ms']:>7.2f}ms {r['fast_p99_ms']:>7.2f}ms {r['fast_delivered']:>9.1%} "
+            f"{r['slow_consumers']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat fan-out with slow consumers")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--sockets-per-user", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=10, help="Messages sent to every user")
+    parser.add_argument("--interval", type=float, default=0.01, help="Seconds between rounds of messages")
+    parser.add_argument("--slow-share", type=float, default=0.02, help="Share of sockets that are slow")
+    parser.add_argument("--fast-latency", type=float, default=0.0005, help="Seconds per send on a fast socket")
+    parser.add_argument("--slow-latency", type=float, default=0.2, help="Seconds per send on a slow socket")
+    parser.add_argument("--queue-size", type=int, default=8)
+    parser.add_argument("--send-timeout", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
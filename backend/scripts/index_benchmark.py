@@ -0,0 +1,206 @@
+"""
+Index benchmark.
+
+Seeds a scratch schema with realistic volumes of mood, journal, guided journal,
+depression risk and chat rows, then runs EXPLAIN ANALYZE on the backend's hot
+queries with the old single-column indexes and again with the composite ones, and
+prints the execution time of each (and the plans with --verbose). Uses the DB_*
+settings of the backend and drops the scratch schema afterwards, for example:
+
+    cd backend
+    python -m scripts.index_benchmark --patients 2000 --days 365 --messages 500000
+"""
+import argparse
+import re
+
+from sqlalchemy import create_engine, text
+
+from app.database import DATABASE_LOCATION, Base
+from app import models  # noqa: F401, registers the tables on Base
+
+SCHEMA = "index_benchmark"
+
+# Index sets compared, both created on top of the primary keys and unique constraints
+OLD_INDEXES = [
+    "CREATE INDEX ix_mood_entries_date ON mood_entries (date)",
+    "CREATE INDEX ix_mood_entries_date_desc ON mood_entries (date DESC)",
+    "CREATE INDEX ix_mood_entries_patient_data_id ON mood_entries (patient_data_id)",
+    "CREATE INDEX ix_journal_entries_date ON journal_entries (date)",
+    "CREATE INDEX ix_journal_entries_date_desc ON journal_entries (date DESC)",
+    "CREATE INDEX ix_journal_entries_patient_data_id ON journal_entries (patient_data_id)",
+    "CREATE INDEX ix_guided_journal_entries_date ON guided_journal_entries (date)",
+    "CREATE INDEX ix_guided_journal_entries_date_desc ON guided_journal_entries (date DESC)",
+    "CREATE INDEX ix_guided_journal_entries_patient_data_id ON guided_journal_entries (patient_data_id)",
+    "CREATE INDEX ix_chat_messages_id ON chat_messages (id)",
+]
+NEW_INDEXES = [
+    "CREATE INDEX ix_mood_entries_patient_data_id_date_desc ON mood_entries "
+    "(patient_data_id, date DESC, id DESC) INCLUDE (mood, eat, sleep)",
+    "CREATE INDEX ix_journal_entries_patient_data_id_date_desc ON journal_entries "
+    "(patient_data_id, date DESC, id DESC)",
+    "CREATE INDEX ix_guided_journal_entries_patient_data_id_date_desc ON guided_journal_entries "
+    "(patient_data_id, date DESC, id DESC)",
+    "CREATE INDEX ix_chat_messages_sender_id_recipient_id_timestamp ON chat_messages "
+    "(sender_id, recipient_id, timestamp, id)",
+]
+
+# The queries behind the list, date range, by-date, chat history and latest risk routes
+QUERIES = {
+    "mood page": """
+        SELECT * FROM mood_entries WHERE patient_data_id = :patient_data_id
+        ORDER BY date DESC, id DESC LIMIT 100
+    """,
+    "mood date range": """
+        SELECT * FROM mood_entries WHERE patient_data_id = :patient_data_id
+        AND date BETWEEN CURRENT_DATE - 30 AND CURRENT_DATE ORDER BY date
+    """,
+    "journal page": """
+        SELECT * FROM journal_entries WHERE patient_data_id = :patient_data_id
+        ORDER BY date DESC, id DESC LIMIT 100
+    """,
+    "guided journal by date": """
+        SELECT * FROM guided_journal_entries WHERE patient_data_id = :patient_data_id
+        AND date = CURRENT_DATE - 7
+    """,
+    "chat history": """
+        SELECT * FROM chat_messages
+        WHERE (sender_id = :user_id AND recipient_id = :other_user_id)
+        OR (sender_id = :other_user_id AND recipient_id = :user_id)
+        ORDER BY timestamp DESC, id DESC LIMIT 100
+    """,
+    "latest depression risk": """
+        SELECT * FROM depression_risk_logs WHERE user_id = :user_id ORDER BY date DESC LIMIT 1
+    """,
+}
+
+
+def seed(connection, args):
+    """
+    Fill the scratch schema, every patient writes every day and talks to one of the therapists
+    """
+    print(f"Seeding {args.patients} patients x {args.days} days and {args.messages} chat messages...")
+    parameters = {
+        "patients": args.patients,
+        "therapists": args.therapists,
+        "days": args.days,
+        "messages": args.messages,
+    }
+    for statement in [
+        """
+        INSERT INTO users (id, name, email, role, streak)
+        SELECT n, 'User ' || n, 'user' || n || '@example.com',
+               CASE WHEN n <= :therapists THEN 'therapist' ELSE 'patient' END, 0
+        FROM generate_series(1, :therapists + :patients) AS n
+        """,
+        """
+        INSERT INTO patient_data (id, user_id, severity)
+        SELECT n, :therapists + n, 'Unknown' FROM generate_series(1, :patients) AS n
+        """,
+        """
+        INSERT INTO mood_entries (patient_data_id, date, mood, eat, sleep)
+        SELECT p, CURRENT_DATE - d, (random() * 4)::int + 1, (random() * 4)::int + 1, (random() * 4)::int + 1
+        FROM generate_series(1, :patients) AS p, generate_series(0, :days - 1) AS d
+        """,
+        """
+        INSERT INTO journal_entries (patient_data_id, date, title, body)
+        SELECT p, CURRENT_DATE - d, 'Entry ' || d, repeat('Journal text. ', 40)
+        FROM generate_series(1, :patients) AS p, generate_series(0, :days - 1) AS d
+        """,
+        """
+        INSERT INTO guided_journal_entries (patient_data_id, date, body)
+        SELECT p, CURRENT_DATE - d, '{"feeling": "fine"}'::json
+        FROM generate_series(1, :patients) AS p, generate_series(0, :days - 1) AS d
+        """,
+        """
+        INSERT INTO depression_risk_logs (user_id, date, value)
+        SELECT :therapists + p, CURRENT_DATE - d, random()
+        FROM generate_series(1, :patients) AS p, generate_series(0, :days - 1) AS d
+        """,
+        """
+        INSERT INTO chat_messages (sender_id, recipient_id, content, timestamp)
+        SELECT CASE WHEN n % 2 = 0 THEN t ELSE u END, CASE WHEN n % 2 = 0 THEN u ELSE t END,
+               'Message ' || n, now() - n * interval '1 second'
+        FROM (
+            SELECT n, :therapists + 1 + (n % :patients) AS u, 1 + (n % :patients) % :therapists AS t
+            FROM generate_series(1, :messages) AS n
+        ) AS conversations
+        """,
+    ]:
+        connection.execute(text(statement), parameters)
+    connection.execute(text("ANALYZE"))
+
+
+def drop_indexes(connection, statements):
+    for statement in statements:
+        name = re.match(r"CREATE INDEX (\w+)", statement).group(1)
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+
+def explain(connection, args) -> dict:
+    """
+    EXPLAIN ANALYZE every query
+    :return (dict): Execution time in milliseconds of each query
+    """
+    parameters = {
+        "patient_data_id": args.patients // 2,
+        "user_id": args.therapists + args.patients // 2,
+        "other_user_id": 1 + (args.patients // 2 - 1) % args.therapists,  # Their therapist
+    }
+    timings = {}
+    for name, query in QUERIES.items():
+        # Warm the cache first, the comparison is about plans, not disk reads
+        connection.execute(text(query), parameters).fetchall()
+        plan = connection.execute(
+            text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), parameters
+        ).scalars().all()
+        timings[name] = float(re.search(r"Execution Time: ([\d.]+)", plan[-1]).group(1))
+        if args.verbose:
+            print(f"\n-- {name}")
+            print("\n".join(plan))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the old and composite indexes with EXPLAIN ANALYZE")
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--therapists", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365, help="Days of entries per patient")
+    parser.add_argument("--messages", type=int, default=500000)
+    parser.add_argument("--verbose", action="store_true", help="Print the full plans")
+    args = parser.parse_args()
+
+    engine = create_engine(f"postgresql://{DATABASE_LOCATION}")
+    with engine.connect() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        connection.execute(text(f"SET search_path TO {SCHEMA}"))
+        connection.commit()
+        try:
+            Base.metadata.create_all(connection)
+            drop_indexes(connection, NEW_INDEXES)
+            seed(connection, args)
+
+            for statement in OLD_INDEXES:
+                connection.execute(text(statement))
+            connection.execute(text("ANALYZE"))
+            before = explain(connection, args)
+
+            drop_indexes(connection, OLD_INDEXES)
+            for statement in NEW_INDEXES:
+                connection.execute(text(statement))
+            connection.execute(text("ANALYZE"))
+            after = explain(connection, args)
+            connection.rollback()
+        finally:
+            connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            connection.commit()
+
+    print(f"\n{'query':<24} {'before':>10} {'after':>10} {'speedup':>8}")
+    for name in QUERIES:
+        speedup = before[name] / after[name] if after[name] else float("inf")
+        print(f"{name:<24} {before[name]:>8.2f}ms {after[name]:>8.2f}ms {speedup:>7.1f}x")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Login storm benchmark.
+
+Measures the latency of a cheap route while a burst of sign-ins hits a running
+backend, to check that bcrypt work does not starve other requests. Create the
+account first, then for example:
+
+    cd backend
+    python -m scripts.login_storm --url http://localhost:8000 \
+        --email storm@example.com --password stormpassword --logins 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+import aiohttp
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def probe(session: aiohttp.ClientSession, args, stop: asyncio.Event) -> List[float]:
+    """
+    Call the probe route back to back until told to stop
+    :return (List[float]): Latencies in milliseconds
+    """
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        async with session.get(f"{args.url}{args.probe_path}") as response:
+            await response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(args.probe_interval)
+    return latencies
+
+
+async def storm(session: aiohttp.ClientSession, args) -> List[float]:
+    """
+    Sign in `args.logins` times with at most `args.concurrency` sign-ins in flight
+    :return (List[float]): Sign-in latencies in milliseconds
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def login():
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.post(
+                f"{args.url}/signin", data={"username": args.email, "password": args.password}
+            ) as response:
+                await response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"Sign-in failed with HTTP {response.status}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*[login() for _ in range(args.logins)])
+    return latencies
+
+
+async def run_probe(session: aiohttp.ClientSession, args, seconds: float) -> List[float]:
+    stop = asyncio.Event()
+    task = asyncio.create_task(probe(session, args, stop))
+    await asyncio.sleep(seconds)
+    stop.set()
+    return await task
+
+
+def report(name: str, latencies: List[float]):
+    print(
+        f"{name:<22} n={len(latencies):<6} p50={percentile(latencies, 0.5):8.1f}ms "
+        f"p99={percentile(latencies, 0.99):8.1f}ms max={max(latencies, default=0):8.1f}ms"
+    )
+
+
+async def main(args):
+    connector = aiohttp.TCPConnector(limit=args.concurrency + 10)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        baseline = await run_probe(session, args, args.baseline_seconds)
+
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(session, args, stop))
+        start = time.perf_counter()
+        logins = await storm(session, args)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        during = await probe_task
+
+    report("probe, idle", baseline)
+    report("probe, during storm", during)
+    report("sign-in", logins)
+    print(f"{len(logins) / elapsed:.1f} sign-ins per second")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure other routes' latency during a login storm")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--probe-path", default="/users/check-email?email=probe@example.com")
+    parser.add_argument("--probe-interval", type=float, default=0.01, help="Seconds between probes")
+    parser.add_argument("--baseline-seconds", type=float, default=5)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,101 @@
+"""
+Connection pool load test.
+
+Runs the same query from many threads against engines with growing pool sizes and
+prints throughput and checkout wait times for each, to find the pool size where
+throughput stops improving. Uses the DB_* settings of the backend, for example:
+
+    cd backend
+    python -m scripts.pool_load_test --workers 64 --pool-sizes 2 5 10 20 40
+"""
+import argparse
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+
+from app.database import DATABASE_LOCATION, get_pool_options
+from app.pool_stats import InstrumentedQueuePool, get_pool_status
+
+
+def run(pool_size: int, args) -> dict:
+    """
+    Hammer one engine with `args.workers` threads for `args.duration` seconds
+    :param pool_size (int): Pool size of the engine
+    :param args (argparse.Namespace): Command line arguments
+    :return (dict): Throughput and pool status of the run
+    """
+    options = get_pool_options()
+    options.update(pool_size=pool_size, max_overflow=0)
+    engine = create_engine(
+        f"postgresql://{DATABASE_LOCATION}", poolclass=InstrumentedQueuePool, **options
+    )
+    query = text(args.query)
+    deadline = time.perf_counter() + args.duration
+    done = [0] * args.workers
+    errors = [0] * args.workers
+
+    def worker(index: int):
+        while time.perf_counter() < deadline:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(query).fetchall()
+                done[index] += 1
+            except Exception:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    status = get_pool_status(engine.pool)
+    engine.dispose()
+    return {
+        "pool_size": pool_size,
+        "queries_per_second": sum(done) / elapsed,
+        "errors": sum(errors),
+        "wait_mean_ms": status["wait_ms"]["mean"],
+        "wait_max_ms": status["wait_ms"]["max"],
+        "timeouts": status["timeouts"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the pool size where throughput saturates")
+    parser.add_argument("--workers", type=int, default=64, help="Number of concurrent threads")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per pool size")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[2, 5, 10, 20, 40])
+    parser.add_argument(
+        "--query", default="SELECT pg_sleep(0.005)", help="Query each worker runs in a loop"
+    )
+    parser.add_argument(
+        "--gain", type=float, default=0.05, help="Smallest relative throughput gain that counts"
+    )
+    args = parser.parse_args()
+
+    print(f"{'pool':>6} {'q/s':>10} {'wait mean':>10} {'wait max':>10} {'timeouts':>9} {'errors':>7}")
+    results = []
+    for pool_size in args.pool_sizes:
+        result = run(pool_size, args)
+        results.append(result)
+        print(
+            f"{result['pool_size']:>6} {result['queries_per_second']:>10.1f} "
+            f"{result['wait_mean_ms']:>8.1f}ms {result['wait_max_ms']:>8.1f}ms "
+            f"{result['timeouts']:>9} {result['errors']:>7}"
+        )
+
+    # The first size after which a bigger pool gains less than args.gain throughput
+    saturation = results[-1]
+    for previous, current in zip(results, results[1:]):
+        if current["queries_per_second"] < previous["queries_per_second"] * (1 + args.gain):
+            saturation = previous
+            break
+    print(f"Throughput saturates at a pool size of {saturation['pool_size']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import os
 import pytest
 from fastapi.testclient import TestClient
@@ -5,6 +6,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app, get_db
 from app.database import Base
+from app.auth_cache import auth_cache
 
 @pytest.fixture(scope="function")
 def test_db():
@@ -24,6 +26,7 @@ def test_db():
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    auth_cache.clear()
 
     Base.metadata.create_all(bind=engine)
 
@@ -101,3 +104,131 @@ def test_get_current_user_profile(test_db):
     assert actual_response["name"] == expected_response["name"]
     assert actual_response["role"] == expected_response["role"]
     assert "hashed_password" not in actual_response 
+
+def test_get_stats_single_query(test_db, max_queries):
+    client = test_db
+
+    user_data = {
+        "email": "statsuser@example.com",
+        "name": "Stats User",
+        "password": "statspassword",
+        "role": "patient",
+    }
+    assert client.post("/signup", json=user_data).status_code == 200
+    signin_response = client.post(
+        "/signin",
+        data={"username": user_data["email"], "password": user_data["password"]},
+    )
+    headers = {"Authorization": f"Bearer {signin_response.json()['access_token']}"}
+
+    mood = {"mood": 3, "eat": 3, "sleep": 3, "date": "2024-08-01"}
+    journal = {"title": "Title", "body": "Body", "date": "2024-08-01"}
+    assert client.post("/mood", json=mood, headers=headers).status_code == 200
+    assert client.post("/journals", json=journal, headers=headers).status_code == 200
+
+    # The first request loads the current user, later ones take it from the auth cache
+    assert client.get("/users/stats", headers=headers).status_code == 200
+
+    with max_queries(1):
+        response = client.get("/users/stats", headers=headers)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["journal_count"] == 1
+    assert data["guided_journal_count"] == 0
+    assert data["mood_count"] == 1
+    assert data["streak"] == 1
+    assert data["last_login"].startswith("2024-08-01")
+    assert response.headers["X-DB-Queries"] == "1"
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+
+def test_mood_entries_pages(test_db, max_queries):
+    client = test_db
+
+    user_data = {
+        "email": "pageuser@example.com",
+        "name": "Page User",
+        "password": "pagepassword",
+        "role": "patient",
+    }
+    assert client.post("/signup", json=user_data).status_code == 200
+    signin_response = client.post(
+        "/signin",
+        data={"username": user_data["email"], "password": user_data["password"]},
+    )
+    headers = {"Authorization": f"Bearer {signin_response.json()['access_token']}"}
+
+    days = [f"2024-08-{day:02d}" for day in range(1, 6)]
+    for day in days:
+        mood = {"mood": 3, "eat": 3, "sleep": 3, "date": day}
+        assert client.post("/mood", json=mood, headers=headers).status_code == 200
+
+    # Posting mood entries drops the user from the auth cache, load it again
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    dates, cursor = [], None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        # Every page is a single query, however deep
+        with max_queries(1):
+            response = client.get("/mood/page", params=params, headers=headers)
+        assert response.status_code == 200
+        page = response.json()
+        dates += [entry["date"] for entry in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert dates == list(reversed(days))
+
+    # The skip/limit route keeps working
+    response = client.get("/mood", params={"skip": 1, "limit": 2}, headers=headers)
+    assert [entry["date"] for entry in response.json()] == ["2024-08-04", "2024-08-03"]
+
+    response = client.get("/mood/page", params={"cursor": "invalid"}, headers=headers)
+    assert response.status_code == 400
+
+def test_export_patient_and_caseload(test_db):
+    client = test_db
+
+    def sign_up(email, role):
+        user_data = {"email": email, "name": email, "password": "exportpassword", "role": role}
+        assert client.post("/signup", json=user_data).status_code == 200
+        response = client.post("/signin", data={"username": email, "password": "exportpassword"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return headers, client.get("/users/me", headers=headers).json()["id"]
+
+    therapist_headers, therapist_id = sign_up("exporttherapist@example.com", "therapist")
+    patient_headers, patient_id = sign_up("exportpatient@example.com", "patient")
+    _, other_id = sign_up("exportother@example.com", "patient")
+    assert client.post(f"/assign-therapist/{therapist_id}", headers=patient_headers).status_code == 200
+
+    for day in ["2024-08-01", "2024-08-02", "2024-08-03"]:
+        mood = {"mood": 3, "eat": 3, "sleep": 3, "date": day}
+        journal = {"title": day, "body": "Body", "date": day}
+        assert client.post("/mood", json=mood, headers=patient_headers).status_code == 200
+        assert client.post("/journals", json=journal, headers=patient_headers).status_code == 200
+
+    def export(headers, **params):
+        response = client.get("/export", params=params, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    rows = export(patient_headers)
+    assert [(row["type"], row["data"]["date"]) for row in rows] == [
+        ("journal", "2024-08-03"), ("journal", "2024-08-02"), ("journal", "2024-08-01"),
+        ("mood", "2024-08-03"), ("mood", "2024-08-02"), ("mood", "2024-08-01"),
+    ]
+    assert {row["user_id"] for row in rows} == {patient_id}
+
+    rows = export(therapist_headers, start_date="2024-08-02", end_date="2024-08-02")
+    assert [(row["type"], row["user_id"]) for row in rows] == [("journal", patient_id), ("mood", patient_id)]
+    assert rows[0]["data"]["title"] == "2024-08-02"
+
+    assert export(therapist_headers, patient_id=patient_id) == export(patient_headers)
+    response = client.get("/export", params={"patient_id": other_id}, headers=therapist_headers)
+    assert response.status_code == 403
+    response = client.get(
+        "/export", params={"start_date": "2024-08-03", "end_date": "2024-08-01"}, headers=patient_headers
+    )
+    assert response.status_code == 400
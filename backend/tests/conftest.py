@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.patient_cache import patient_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_patient_cache():
+    """
+    Test databases reuse user IDs, so forget the patients cached by earlier tests
+    """
+    patient_cache.clear()
+
+
+@pytest.fixture
+def max_queries():
+    """
+    Assert that a block runs at most a given number of SQL statements, on any engine
+
+        with max_queries(2):
+            client.get("/users/stats", headers=headers)
+    """
+
+    @contextmanager
+    def check(limit: int) -> Iterator[List[str]]:
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", record)
+        try:
+            yield statements
+        finally:
+            event.remove(Engine, "before_cursor_execute", record)
+        assert len(statements) <= limit, (
+            f"Expected at most {limit} queries, got {len(statements)}:\n" + "\n".join(statements)
+        )
+
+    return check
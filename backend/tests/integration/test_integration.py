@@ -9,6 +9,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app, get_db
 from app.database import Base
+from app.auth_cache import auth_cache
 from PIL import Image
 from datetime import date, timedelta
 
@@ -30,6 +31,7 @@ def test_db():
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    auth_cache.clear()
 
     Base.metadata.create_all(bind=engine)
 
@@ -0,0 +1,222 @@
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+from app import async_commands, commands, schemas
+from app.auth_cache import auth_cache
+from app.database import Base
+from app.main import app, get_async_db, get_db
+from app.passwords import hash_password_async
+from datetime import date, timedelta
+
+@pytest.fixture
+def sessions(tmp_path):
+    path = tmp_path / "async.db"
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    AsyncTestingSessionLocal = async_sessionmaker(
+        autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine
+    )
+
+    db = TestingSessionLocal()
+    therapist = commands.create_user(db, schemas.UserCreate(
+        email="therapist@example.com",
+        name="Therapist",
+        password=asyncio.run(hash_password_async("therapistpassword")),
+        role="therapist",
+    ))
+    patient = commands.create_user(db, schemas.UserCreate(
+        email="patient@example.com",
+        name="Patient",
+        password="patientpassword",
+        role="patient",
+    ))
+    commands.create_user(db, schemas.UserCreate(
+        email="other@example.com",
+        name="Other",
+        password="otherpassword",
+        role="patient",
+    ))
+    commands.assign_therapist_to_patient(db, patient, therapist.id)
+    commands.bulk_upsert_depression_risk_logs(db, [
+        schemas.DepressionRiskLogCreate(user_id=patient.id, value=0.1 * days_ago, date=date.today() - timedelta(days=days_ago))
+        for days_ago in range(3)
+    ])
+    db.close()
+
+    yield TestingSessionLocal, AsyncTestingSessionLocal
+    asyncio.run(async_engine.dispose())
+    engine.dispose()
+
+def test_async_commands(sessions):
+    _, AsyncTestingSessionLocal = sessions
+
+    async def run():
+        async with AsyncTestingSessionLocal() as db:
+            therapist = await async_commands.get_user_by_id(db, 1)
+            patient = await async_commands.get_user_by_id(db, 2)
+            assert (therapist.email, patient.email) == ("therapist@example.com", "patient@example.com")
+            assert therapist.therapist_data is not None
+            assert patient.patient_data.therapist_user_id == therapist.id
+            assert await async_commands.get_patient_ids_by_therapist(db, therapist) == [patient.id]
+
+            logs = await async_commands.get_depression_risk_logs_by_user(db, patient.id)
+            assert [log.date for log in logs] == [date.today() - timedelta(days=i) for i in range(3)]
+            latest = await async_commands.get_latest_depression_risk_log_by_user(db, patient.id)
+            assert latest.date == date.today()
+
+            for content in ["Hello", "How are you?"]:
+                await async_commands.insert_chat_message(db, schemas.ChatMessageCreate(
+                    content=content, sender_id=therapist.id, recipient_id=patient.id
+                ))
+            messages = await async_commands.get_chat_messages(db, patient, therapist.id)
+            assert [message.content for message in messages] == ["Hello", "How are you?"]
+
+    asyncio.run(run())
+
+def test_depression_risk_routes_use_async_session(sessions):
+    TestingSessionLocal, AsyncTestingSessionLocal = sessions
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    auth_cache.clear()
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/signin",
+            data={"username": "therapist@example.com", "password": "therapistpassword"},
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        response = client.get("/user/depression-risks/2", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == 3
+
+        response = client.get("/user/depression-risk/2", headers=headers)
+        assert response.status_code == 200
+        assert response.json()["date"] == date.today().isoformat()
+
+        # Not their patient
+        response = client.get("/user/depression-risk/3", headers=headers)
+        assert response.status_code == 403
+    finally:
+        app.dependency_overrides.clear()
+
+def test_chat_messages_page_route(sessions):
+    TestingSessionLocal, AsyncTestingSessionLocal = sessions
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    async def send():
+        async with AsyncTestingSessionLocal() as db:
+            for index in range(5):
+                await async_commands.insert_chat_message(db, schemas.ChatMessageCreate(
+                    content=f"Message {index}", sender_id=1, recipient_id=2
+                ))
+
+    asyncio.run(send())
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    auth_cache.clear()
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/signin",
+            data={"username": "therapist@example.com", "password": "therapistpassword"},
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        contents, cursor = [], None
+        for _ in range(3):
+            params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+            response = client.get("/chat/messages/2/page", params=params, headers=headers)
+            assert response.status_code == 200
+            page = response.json()
+            contents += [message["content"] for message in page["items"]]
+            cursor = page["next_cursor"]
+        assert contents == [f"Message {index}" for index in reversed(range(5))]
+        assert cursor is None
+
+        response = client.get("/chat/messages/2/page", params={"cursor": "invalid"}, headers=headers)
+        assert response.status_code == 400
+    finally:
+        app.dependency_overrides.clear()
+
+def test_chat_threads_route(sessions, max_queries):
+    TestingSessionLocal, AsyncTestingSessionLocal = sessions
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as db:
+            yield db
+
+    async def send():
+        async with AsyncTestingSessionLocal() as db:
+            for sender_id, recipient_id, content in [(2, 1, "Hello"), (2, 1, "Are you there?"), (1, 3, "Welcome")]:
+                await async_commands.insert_chat_message(db, schemas.ChatMessageCreate(
+                    content=content, sender_id=sender_id, recipient_id=recipient_id
+                ))
+
+    asyncio.run(send())
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    auth_cache.clear()
+    try:
+        client = TestClient(app)
+        response = client.post(
+            "/signin",
+            data={"username": "therapist@example.com", "password": "therapistpassword"},
+        )
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        client.get("/users/me", headers=headers)
+
+        with max_queries(1):
+            response = client.get("/chat/threads", headers=headers)
+        assert response.status_code == 200
+        threads = [
+            (thread["other_user_id"], thread["last_message"], thread["last_sender_id"], thread["unread_count"])
+            for thread in response.json()
+        ]
+        assert threads == [(3, "Welcome", 1, 0), (2, "Are you there?", 2, 2)]
+
+        response = client.post("/chat/threads/2/read", headers=headers)
+        assert response.status_code == 200
+        assert [thread["unread_count"] for thread in client.get("/chat/threads", headers=headers).json()] == [0, 0]
+
+        response = client.post("/chat/threads/99/read", headers=headers)
+        assert response.status_code == 404
+    finally:
+        app.dependency_overrides.clear()
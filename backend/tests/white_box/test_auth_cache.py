@@ -0,0 +1,78 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import models
+from app.auth_cache import AuthCache, auth_cache
+from app.database import Base
+from app.main import app, get_db
+
+def user(user_id):
+    return models.User(id=user_id, email=f"user{user_id}@example.com")
+
+def test_auth_cache_expires_and_evicts():
+    cache = AuthCache(max_size=2, ttl=0.05)
+    for user_id in (1, 2, 3):
+        cache.put(user(user_id), cache.marker())
+
+    assert cache.get(1) is None  # Evicted, least recently used
+    assert cache.get(3).id == 3
+    time.sleep(0.06)
+    assert cache.get(3) is None  # Expired
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 2, 1)
+
+def test_auth_cache_skips_users_loaded_before_an_invalidation():
+    cache = AuthCache()
+    marker = cache.marker()
+    cache.invalidate(1)
+    cache.put(user(1), marker)
+    assert cache.get(1) is None
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'auth.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    auth_cache.clear()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+def test_current_user_is_cached_until_updated(client):
+    client.post("/signup", json={
+        "email": "cached@example.com",
+        "name": "Cached",
+        "password": "cachedpassword",
+        "role": "patient",
+    })
+    response = client.post(
+        "/signin", data={"username": "cached@example.com", "password": "cachedpassword"}
+    )
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    before = auth_cache.stats()
+    assert client.get("/users/me", headers=headers).json()["name"] == "Cached"
+    assert client.get("/users/me", headers=headers).json()["name"] == "Cached"
+    after = auth_cache.stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 1
+
+    # Updating the user drops them from the cache
+    response = client.patch("/users/me", json={"email": "cached@example.com", "name": "Renamed"}, headers=headers)
+    assert response.status_code == 200
+    assert client.get("/users/me", headers=headers).json()["name"] == "Renamed"
+    assert auth_cache.stats()["misses"] - after["misses"] == 1
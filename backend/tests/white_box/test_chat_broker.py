@@ -0,0 +1,101 @@
+import asyncio
+import os
+import pytest
+from app import chat_broker
+from app.chat_broker import LocalBroker, PostgresBroker, create_broker
+
+class Recorder:
+    def __init__(self):
+        self.delivered = []
+
+    async def __call__(self, user_id, message):
+        self.delivered.append((user_id, message))
+
+def test_local_broker_delivers_in_process():
+    recorder = Recorder()
+    broker = LocalBroker(recorder)
+    asyncio.run(broker.publish(7, {"content": "Hello"}))
+    assert recorder.delivered == [(7, {"content": "Hello"})]
+
+def test_postgres_broker_payloads_round_trip():
+    sender = PostgresBroker(Recorder(), "postgresql://unused")
+    receiver = PostgresBroker(Recorder(), "postgresql://unused")
+    receiver.inbox = asyncio.Queue()
+    message = {"content": "x" * (chat_broker.MAX_PART_SIZE * 2), "id": 1}
+
+    payloads = sender.encode(7, message)
+    assert len(payloads) == 3
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+
+    # Parts may arrive out of order, the message is queued once all of them did
+    for payload in reversed(payloads):
+        assert receiver.inbox.empty()
+        receiver.receive(payload)
+    assert receiver.inbox.get_nowait() == (7, message)
+    assert receiver.parts == {}
+
+    # A broker skips its own notifications, it already delivered them locally
+    sender.inbox = asyncio.Queue()
+    for payload in payloads:
+        sender.receive(payload)
+    assert sender.inbox.empty()
+
+@pytest.mark.parametrize("content", ['"' * 4000, "\u5fc3" * 2000, "\\\n\u00e9\U0001f600" * 3000])
+def test_postgres_broker_payloads_fit_notify(content):
+    sender = PostgresBroker(Recorder(), "postgresql://unused")
+    receiver = PostgresBroker(Recorder(), "postgresql://unused")
+    receiver.inbox = asyncio.Queue()
+    message = {"content": content, "id": 1}
+
+    payloads = sender.encode(7, message)
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+    for payload in payloads:
+        receiver.receive(payload)
+    assert receiver.inbox.get_nowait() == (7, message)
+
+def test_postgres_broker_publish_survives_notify_failure():
+    class FailingPool:
+        def acquire(self):
+            raise OSError("connection lost")
+
+    recorder = Recorder()
+    broker = PostgresBroker(recorder, "postgresql://unused")
+    broker.publisher = FailingPool()
+    asyncio.run(broker.publish(7, {"content": "Hello"}))
+    assert recorder.delivered == [(7, {"content": "Hello"})]
+
+def test_create_broker(monkeypatch):
+    monkeypatch.delenv("CHAT_BROKER", raising=False)
+    assert isinstance(create_broker(Recorder()), LocalBroker)
+    monkeypatch.setenv("CHAT_BROKER", "postgres")
+    assert isinstance(create_broker(Recorder()), PostgresBroker)
+    monkeypatch.setenv("CHAT_BROKER", "redis")
+    with pytest.raises(ValueError):
+        create_broker(Recorder())
+
+@pytest.mark.skipif(
+    not os.getenv("CHAT_BROKER_TEST_DSN"),
+    reason="Set CHAT_BROKER_TEST_DSN to a PostgreSQL DSN to test LISTEN/NOTIFY",
+)
+def test_postgres_broker_fans_out_between_workers():
+    dsn = os.getenv("CHAT_BROKER_TEST_DSN")
+
+    async def run():
+        worker_a, worker_b = Recorder(), Recorder()
+        broker_a, broker_b = PostgresBroker(worker_a, dsn), PostgresBroker(worker_b, dsn)
+        await broker_a.start()
+        await broker_b.start()
+        try:
+            await broker_a.publish(7, {"content": "Hello"})
+            await broker_a.publish(8, {"content": "y" * 20000})
+            for _ in range(100):
+                if len(worker_b.delivered) == 2:
+                    break
+                await asyncio.sleep(0.05)
+        finally:
+            await broker_a.stop()
+            await broker_b.stop()
+        assert [user_id for user_id, _ in worker_a.delivered] == [7, 8]
+        assert worker_b.delivered == worker_a.delivered
+
+    asyncio.run(run())
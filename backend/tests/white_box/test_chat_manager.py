@@ -0,0 +1,85 @@
+import asyncio
+import pytest
+from app.chat_manager import ConnectionManager
+
+class FakeWebSocket:
+    """
+    Stands in for a WebSocket, sending stalls until `release` is set
+    """
+    def __init__(self, stalled=False):
+        self.sent = []
+        self.closed_with = None
+        self.release = asyncio.Event()
+        if not stalled:
+            self.release.set()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await self.release.wait()
+        self.sent.append(message)
+
+    async def close(self, code):
+        self.closed_with = code
+
+@pytest.fixture(autouse=True)
+def local_broker(monkeypatch):
+    monkeypatch.delenv("CHAT_BROKER", raising=False)
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_every_socket_of_a_user_receives_messages():
+    async def run():
+        manager = ConnectionManager()
+        phone, laptop, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        phone_connection = await manager.connect(phone, 1)
+        await manager.connect(laptop, 1)
+        await manager.connect(other, 2)
+
+        await manager.send_personal_message({"content": "Hello"}, 1)
+        await settle()
+        assert phone.sent == laptop.sent == [{"content": "Hello"}]
+        assert other.sent == []
+
+        manager.disconnect(phone_connection)
+        await manager.send_personal_message({"content": "Again"}, 1)
+        await settle()
+        assert phone.sent == [{"content": "Hello"}]
+        assert laptop.sent == [{"content": "Hello"}, {"content": "Again"}]
+        assert len(manager.active_connections[1]) == 1
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("policy", ["disconnect", "drop", "wait"])
+def test_slow_consumer_does_not_block_the_sender(policy):
+    async def run():
+        manager = ConnectionManager(queue_size=2, policy=policy, send_timeout=0.01)
+        slow, fast = FakeWebSocket(stalled=True), FakeWebSocket()
+        slow_connection = await manager.connect(slow, 1)
+        await manager.connect(fast, 1)
+
+        for index in range(5):
+            await asyncio.wait_for(manager.send_personal_message({"index": index}, 1), 1)
+        await settle()
+        assert [message["index"] for message in fast.sent] == [0, 1, 2, 3, 4]
+
+        if policy == "drop":
+            # The writer holds one message, the queue two more, the rest are dropped
+            assert slow_connection.dropped == 2
+            assert slow_connection in manager.active_connections[1]
+            slow.release.set()
+            await settle()
+            assert [message["index"] for message in slow.sent] == [0, 1, 2]
+        else:
+            assert manager.slow_consumers == 1
+            assert slow_connection not in manager.active_connections[1]
+            assert slow.closed_with == 1013
+
+    asyncio.run(run())
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ConnectionManager(policy="block")
@@ -0,0 +1,106 @@
+import asyncio
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+from app import models, schemas
+from app.chat_writer import ChatWriter
+from app.database import Base
+
+@pytest.fixture
+def session_factory(tmp_path):
+    path = tmp_path / "chat.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    engine.dispose()
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    yield async_sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine)
+    asyncio.run(async_engine.dispose())
+
+def message(index):
+    return schemas.ChatMessageCreate(content=f"Message {index}", sender_id=1, recipient_id=2)
+
+async def stored(session_factory):
+    async with session_factory() as db:
+        result = await db.execute(select(models.ChatMessage).order_by(models.ChatMessage.id))
+        return [(row.id, row.content) for row in result.scalars()]
+
+def test_chat_writer_writes_behind_in_batches(session_factory):
+    async def run():
+        writer = ChatWriter(session_factory, batch_size=3, interval_ms=60000, id_block_size=2)
+        async with session_factory() as db:
+            db.add(models.ChatMessage(content="Existing", sender_id=2, recipient_id=1))
+            await db.commit()
+
+        messages = [await writer.write(message(index)) for index in range(7)]
+        # IDs continue across several reserved blocks, after the rows already stored
+        assert [m.id for m in messages] == list(range(2, 9))
+
+        await writer.stop()
+        assert await stored(session_factory) == [(1, "Existing")] + [
+            (index + 2, f"Message {index}") for index in range(7)
+        ]
+        assert writer.stats() == {"pending": 0, "batches": 3, "written": 7, "dropped": 0}
+
+    asyncio.run(run())
+
+def test_chat_writer_flushes_on_interval(session_factory):
+    async def run():
+        writer = ChatWriter(session_factory, interval_ms=5)
+        await writer.write(message(0))
+        await asyncio.sleep(0.2)
+        assert await stored(session_factory) == [(1, "Message 0")]
+        await writer.stop()
+
+    asyncio.run(run())
+
+def test_chat_writer_drops_only_rejected_messages(session_factory):
+    async def run():
+        writer = ChatWriter(session_factory, interval_ms=60000)
+        messages = [await writer.write(message(index)) for index in range(3)]
+        # Assigned before anything is written
+        assert [m.id for m in messages] == [1, 2, 3]
+        assert all(m.timestamp is not None for m in messages)
+        assert await stored(session_factory) == []
+        # Takes the ID reserved for the first buffered message
+        async with session_factory() as db:
+            db.add(models.ChatMessage(id=1, content="Conflict", sender_id=2, recipient_id=1))
+            await db.commit()
+
+        await writer.stop()
+        assert await stored(session_factory) == [(1, "Conflict"), (2, "Message 1"), (3, "Message 2")]
+        assert writer.stats()["dropped"] == 1
+
+    asyncio.run(run())
+
+def test_chat_writer_updates_threads(session_factory):
+    async def run():
+        writer = ChatWriter(session_factory, interval_ms=60000)
+        for index in range(3):
+            await writer.write(message(index))
+        await writer.write(schemas.ChatMessageCreate(content="Reply", sender_id=2, recipient_id=1))
+        await writer.stop()
+
+        async with session_factory() as db:
+            result = await db.execute(select(models.ChatThread).order_by(models.ChatThread.user_id))
+            threads = [
+                (thread.user_id, thread.other_user_id, thread.last_message_id, thread.unread_count)
+                for thread in result.scalars()
+            ]
+        # One batch, both sides of the conversation get its last message
+        assert threads == [(1, 2, 4, 1), (2, 1, 4, 3)]
+
+    asyncio.run(run())
+
+def test_chat_writer_writes_through_after_stop(session_factory):
+    async def run():
+        writer = ChatWriter(session_factory, interval_ms=60000)
+        await writer.write(message(0))
+        await writer.stop()
+
+        # A message sent while the app shuts down is written, not buffered for a task that is gone
+        await writer.write(message(1))
+        assert writer.task is None
+        assert await stored(session_factory) == [(1, "Message 0"), (2, "Message 1")]
+
+    asyncio.run(run())
@@ -3,8 +3,17 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 from app import models, schemas
 from app.database import Base
-from app.commands import upsert_journal_entry, create_user, assign_therapist_to_patient, get_user_by_email
-from datetime import date
+from app.commands import (
+    upsert_journal_entry,
+    upsert_mood_entry,
+    create_user,
+    assign_therapist_to_patient,
+    get_user_by_email,
+    bulk_upsert_depression_risk_logs,
+    bulk_update_patient_severity,
+    iter_patients_with_recent_entries,
+)
+from datetime import date, datetime, timedelta, timezone
 
 @pytest.fixture(scope="module")
 def test_db():
@@ -120,4 +129,127 @@ def test_assign_therapist_to_non_patient(db_session: Session):
 
     with pytest.raises(Exception) as exc_info:
         assign_therapist_to_patient(db_session, therapist1, therapist2.id)
-    assert str(exc_info.value) == "Patient data not found"
\ No newline at end of file
+    assert str(exc_info.value) == "Patient data not found"
+def test_bulk_upsert_depression_risks(db_session: Session):
+    patient = db_session.query(models.User).filter_by(email="patient@example.com").first()
+    journal_user = db_session.query(models.User).filter_by(email="journaluser@example.com").first()
+
+    records = [
+        schemas.DepressionRiskUpdate(user_id=patient.id, value=0.1, date=date.today(), severity="None"),
+        schemas.DepressionRiskUpdate(user_id=journal_user.id, value=0.5, date=date.today(), severity="Moderate"),
+    ]
+    bulk_upsert_depression_risk_logs(db_session, records, commit=False)
+    bulk_update_patient_severity(db_session, records)
+
+    # Same day again only updates the existing logs
+    records[0] = schemas.DepressionRiskUpdate(user_id=patient.id, value=0.9, date=date.today(), severity="Severe")
+    bulk_upsert_depression_risk_logs(db_session, records, commit=False)
+    bulk_update_patient_severity(db_session, records)
+
+    logs = db_session.query(models.DepressionRiskLog).filter_by(user_id=patient.id).all()
+    assert len(logs) == 1
+    assert logs[0].value == 0.9
+
+    db_session.expire_all()
+    assert patient.patient_data.severity == "Severe"
+    assert journal_user.patient_data.severity == "Moderate"
+
+
+def test_iter_patients_with_recent_entries(db_session: Session):
+    writer = create_user(db_session, schemas.UserCreate(
+        email="writer@example.com",
+        name="Writer",
+        password="testpassword",
+        role="patient",
+    ))
+    for days_ago in range(3):
+        upsert_journal_entry(db_session, schemas.JournalEntryCreate(
+            title=f"Entry {days_ago}",
+            body="Body",
+            date=date.today() - timedelta(days=days_ago),
+        ), writer)
+
+    patients = list(iter_patients_with_recent_entries(db_session, window_size=2, page_size=1))
+
+    # Patients without journal entries are skipped, the rest come in ID order
+    assert [patient.email for patient in patients] == ["journaluser@example.com", "writer@example.com"]
+    assert all(len(patient.patient_data.journal_entries) <= 2 for patient in patients)
+
+    # Only the most recent entries, oldest first
+    writer_entries = patients[-1].patient_data.journal_entries
+    assert [entry.title for entry in writer_entries] == ["Entry 1", "Entry 0"]
+
+def test_iter_patients_changed_since_last_scored(db_session: Session):
+    scored_at = datetime.now(timezone.utc)
+    patients = list(iter_patients_with_recent_entries(db_session, changed_only=True))
+    records = [
+        schemas.DepressionRiskUpdate(user_id=patient.id, value=0.1, date=date.today(), severity="None")
+        for patient in patients
+    ]
+    bulk_update_patient_severity(db_session, records, scored_at=scored_at)
+
+    # Nothing was written since the run started
+    assert list(iter_patients_with_recent_entries(db_session, changed_only=True)) == []
+    assert len(list(iter_patients_with_recent_entries(db_session))) == len(patients)
+
+    writer = get_user_by_email(db_session, "writer@example.com")
+    entry = upsert_journal_entry(db_session, schemas.JournalEntryCreate(
+        title="Edited",
+        body="Body",
+        date=date.today(),
+    ), writer)
+    db_session.add(entry)
+    entry.updated_at = scored_at + timedelta(seconds=1)
+    db_session.commit()
+
+    changed = list(iter_patients_with_recent_entries(db_session, changed_only=True))
+    assert [patient.email for patient in changed] == ["writer@example.com"]
+
+def test_upsert_mood_entry_streak(db_session: Session, max_queries):
+    user = create_user(db_session, schemas.UserCreate(
+        email="mooduser@example.com",
+        name="Mood User",
+        password="testpassword",
+        role="patient",
+    ))
+    # Detached like the cached current user of a request, so reading it costs no queries
+    db_session.refresh(user)
+    db_session.expunge(user)
+    first_day = date(2024, 8, 1)
+
+    def post(day: date, mood: int = 3):
+        with max_queries(2):
+            entry = upsert_mood_entry(db_session, schemas.MoodEntryCreate(
+                mood=mood, eat=3, sleep=3, date=day,
+            ), user)
+        db_user = db_session.get(models.User, user.id, populate_existing=True)
+        return entry, db_user.streak, db_user.last_login
+
+    entry, streak, last_login = post(first_day)
+    assert (streak, last_login) == (1, datetime(2024, 8, 1))
+
+    _, streak, _ = post(first_day + timedelta(days=1))
+    assert streak == 2
+
+    # Posting the same day again updates the entry and keeps the streak
+    updated, streak, _ = post(first_day + timedelta(days=1), mood=5)
+    assert streak == 2
+    assert updated.mood == 5
+    assert db_session.query(models.MoodEntry).filter_by(patient_data_id=entry.patient_data_id).count() == 2
+
+    _, streak, last_login = post(first_day + timedelta(days=3))
+    assert (streak, last_login) == (1, datetime(2024, 8, 4))
+
+    # An older entry resets the streak but does not move last_login back
+    _, streak, last_login = post(first_day)
+    assert (streak, last_login) == (1, datetime(2024, 8, 4))
+
+def test_upsert_mood_entry_without_patient_data(db_session: Session):
+    therapist = db_session.query(models.User).filter_by(email="therapist@example.com").first()
+
+    with pytest.raises(Exception) as exc_info:
+        upsert_mood_entry(db_session, schemas.MoodEntryCreate(
+            mood=3, eat=3, sleep=3, date=date.today(),
+        ), therapist)
+    assert str(exc_info.value) == "Patient data not found"
+    assert db_session.query(models.MoodEntry).filter_by(patient_data_id=None).count() == 0
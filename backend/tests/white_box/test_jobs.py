@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from app import commands, models, schemas
+from app.auth_cache import auth_cache
+from app.database import Base
+from app.jobs import BatchJobRunner
+from datetime import date, datetime, timedelta, timezone
+
+class FakeResponse:
+    def __init__(self, body):
+        self.status = 200
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.body
+
+class FakeSession:
+    """
+    Stands in for aiohttp.ClientSession, scoring every patient 0.9
+    """
+    def __init__(self):
+        self.scored_ids = []
+
+    def post(self, endpoint, json, timeout):
+        ids = [timeline["patient_id"] for timeline in json]
+        self.scored_ids.extend(ids)
+        return FakeResponse({str(i): {"logits": [0.0], "probas": [0.9]} for i in ids})
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    db = TestingSessionLocal()
+    for i in range(5):
+        user = commands.create_user(db, schemas.UserCreate(
+            email=f"patient{i}@example.com",
+            name=f"Patient {i}",
+            password="testpassword",
+            role="patient",
+        ))
+        commands.upsert_journal_entry(db, schemas.JournalEntryCreate(
+            title="Title",
+            body="Body",
+            date=date.today(),
+        ), user)
+    db.close()
+
+    yield TestingSessionLocal
+    engine.dispose()
+
+def run_job(session_factory, http, job_id):
+    runner = BatchJobRunner(session_factory, "http://model/check/bulk", bulk_size=2, concurrency=1)
+    runner.http = http
+    asyncio.run(runner.run(job_id))
+
+def test_batch_job_scores_every_patient(session_factory):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    http = FakeSession()
+    run_job(session_factory, http, job.id)
+
+    db.refresh(job)
+    assert job.status == "completed"
+    assert (job.total, job.processed, job.remaining, job.scored, job.errors) == (5, 5, 0, 5, 0)
+    assert job.model_calls == 3
+    assert sorted(http.scored_ids) == [1, 2, 3, 4, 5]
+    assert db.query(models.PatientData).filter(models.PatientData.severity == "Severe").count() == 5
+
+    # Nothing changed since, a new job has nothing to do
+    next_job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    assert next_job.id != job.id
+    run_job(session_factory, http, next_job.id)
+    db.refresh(next_job)
+    assert (next_job.status, next_job.total, next_job.processed) == ("completed", 0, 0)
+    db.close()
+
+def test_batch_job_resumes_after_last_patient(session_factory):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate(force=True))
+
+    # An earlier process scored the first two patients and was then stopped
+    assert commands.create_batch_job(db, schemas.BatchJobCreate()).id == job.id
+    run_job(session_factory, FakeSession(), job.id)
+    db.refresh(job)
+    job.status = "running"
+    job.processed = 2
+    job.scored = 2
+    job.last_patient_id = 2
+    job.finished_at = None
+    job.heartbeat_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db.commit()
+
+    http = FakeSession()
+    run_job(session_factory, http, job.id)
+
+    db.refresh(job)
+    assert job.status == "completed"
+    assert sorted(http.scored_ids) == [3, 4, 5]
+    assert (job.processed, job.scored, job.remaining) == (5, 5, 0)
+    db.close()
+
+def test_create_batch_job_keeps_one_unfinished(session_factory, monkeypatch):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    get_unfinished_batch_jobs = commands.get_unfinished_batch_jobs
+
+    # A concurrent request that checked before the first job was committed
+    def stale_check(db):
+        monkeypatch.setattr(commands, "get_unfinished_batch_jobs", get_unfinished_batch_jobs)
+        return []
+
+    monkeypatch.setattr(commands, "get_unfinished_batch_jobs", stale_check)
+    assert commands.create_batch_job(db, schemas.BatchJobCreate(force=True)).id == job.id
+    assert db.query(models.BatchJob).count() == 1
+    db.close()
+
+def test_batch_job_runs_in_one_worker(session_factory):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    assert commands.claim_batch_job(db, job.id, "other-worker", lease_seconds=60)
+
+    # Claimed by a live worker, left alone
+    http = FakeSession()
+    run_job(session_factory, http, job.id)
+    db.refresh(job)
+    assert (job.status, job.claimed_by, http.scored_ids) == ("running", "other-worker", [])
+
+    # That worker stopped renewing its claim, taken over
+    job.heartbeat_at = datetime.now(timezone.utc) - timedelta(hours=1)
+    db.commit()
+    run_job(session_factory, http, job.id)
+    db.refresh(job)
+    assert job.status == "completed"
+    assert job.claimed_by != "other-worker"
+    assert sorted(http.scored_ids) == [1, 2, 3, 4, 5]
+    db.close()
+
+def test_batch_job_invalidates_auth_cache_after_commit(session_factory, monkeypatch):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    severities = []
+
+    # A request between the invalidation and the commit would cache the old severity again
+    def invalidate(*user_ids):
+        reader = session_factory()
+        severities.extend(
+            reader.query(models.PatientData.severity).filter(models.PatientData.user_id.in_(user_ids)).all()
+        )
+        reader.close()
+
+    monkeypatch.setattr(auth_cache, "invalidate", invalidate)
+    run_job(session_factory, FakeSession(), job.id)
+    assert severities == [("Severe",)] * 5
+    db.close()
+
+def test_batch_job_queries_off_the_event_loop(session_factory):
+    db = session_factory()
+    job = commands.create_batch_job(db, schemas.BatchJobCreate())
+    db.close()
+    loop_queries = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if threading.current_thread() is threading.main_thread():
+            loop_queries.append(statement)
+
+    engine = session_factory.kw["bind"]
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        run_job(session_factory, FakeSession(), job.id)
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    assert loop_queries == []
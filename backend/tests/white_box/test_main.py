@@ -1,16 +1,24 @@
+import asyncio
 import pytest
+from fastapi import HTTPException
+from jose import jwt
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 from passlib.context import CryptContext
 from app import models, schemas
 from app.database import Base
-from app.main import authenticate_user 
+from app.auth_cache import auth_cache
+from app.commands import create_user
+from app.main import ALGORITHM, SECRET_KEY, authenticate_user_async, create_access_token, get_current_user
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 @pytest.fixture(scope="module")
-def test_db():
-    engine = create_engine('sqlite:///:memory:')
+def test_db(tmp_path_factory):
+    # A file rather than :memory:, authentication looks the user up from another thread
+    engine = create_engine(
+        f"sqlite:///{tmp_path_factory.mktemp('main') / 'main.db'}", connect_args={"check_same_thread": False}
+    )
     Base.metadata.create_all(bind=engine)
     TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     yield TestingSessionLocal
@@ -35,7 +43,7 @@ def test_authenticate_user_valid(db_session: Session):
     db_session.add(test_user)
     db_session.commit()
 
-    authenticated_user = authenticate_user(db_session, test_user.email, password)
+    authenticated_user = asyncio.run(authenticate_user_async(db_session, test_user.email, password))
     assert authenticated_user is not None
     assert authenticated_user.email == test_user.email
 
@@ -43,7 +51,7 @@ def test_authenticate_user_invalid_password(db_session: Session):
     test_user = db_session.query(models.User).filter_by(email="testuser@example.com").first()
     wrong_password = "wrongpassword"
 
-    authenticated_user = authenticate_user(db_session, test_user.email, wrong_password)
+    authenticated_user = asyncio.run(authenticate_user_async(db_session, test_user.email, wrong_password))
     assert authenticated_user is None
 
 def test_authenticate_user_inactive(db_session: Session):
@@ -59,9 +67,31 @@ def test_authenticate_user_inactive(db_session: Session):
     db_session.add(inactive_user)
     db_session.commit()
 
-    authenticated_user = authenticate_user(db_session, inactive_user.email, password)
+    authenticated_user = asyncio.run(authenticate_user_async(db_session, inactive_user.email, password))
     assert authenticated_user is None
 
 def test_authenticate_user_nonexistent(db_session: Session):
-    authenticated_user = authenticate_user(db_session, "nonexistent@example.com", "nopassword")
+    authenticated_user = asyncio.run(authenticate_user_async(db_session, "nonexistent@example.com", "nopassword"))
     assert authenticated_user is None
+
+def test_get_current_user_by_id(db_session: Session):
+    patient = create_user(db_session, schemas.UserCreate(
+        email="tokenuser@example.com",
+        name="Token User",
+        password="hashed",
+        role="patient",
+    ))
+    auth_cache.clear()
+
+    current_user = get_current_user(create_access_token(patient), db_session)
+    assert current_user.id == patient.id
+    # Patient and therapist data come with the user, no lazy load needed later
+    assert "patient_data" in current_user.__dict__
+    assert "therapist_data" in current_user.__dict__
+    assert current_user.patient_data.user_id == patient.id
+
+def test_get_current_user_requires_id_claim(db_session: Session):
+    token = jwt.encode({"sub": "tokenuser@example.com"}, SECRET_KEY, algorithm=ALGORITHM)
+    with pytest.raises(HTTPException) as error:
+        get_current_user(token, db_session)
+    assert error.value.status_code == 401
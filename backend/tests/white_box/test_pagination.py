@@ -0,0 +1,24 @@
+from datetime import date, datetime
+import pytest
+from app.pagination import InvalidCursor, decode_cursor, encode_cursor, paginate
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor((date(2024, 8, 1), 42)), date) == (date(2024, 8, 1), 42)
+    timestamp = datetime(2024, 8, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor((timestamp, 7)), datetime) == (timestamp, 7)
+
+
+@pytest.mark.parametrize("cursor", ["", "not-a-cursor", encode_cursor((date(2024, 8, 1), 1))[:-2], "WyJ4IiwxXQ"])
+def test_decode_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, date)
+
+
+def test_paginate():
+    rows = [(date(2024, 8, day), day) for day in (5, 4, 3)]
+    assert paginate(rows, 3, lambda row: row) == (rows, None)
+
+    items, next_cursor = paginate(rows, 2, lambda row: row)
+    assert items == rows[:2]
+    assert decode_cursor(next_cursor, date) == (date(2024, 8, 4), 4)
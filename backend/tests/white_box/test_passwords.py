@@ -0,0 +1,16 @@
+import asyncio
+from app import passwords
+
+def test_hash_and_verify_async():
+    async def run():
+        hashed = await passwords.hash_password_async("secret")
+        results = await asyncio.gather(
+            passwords.verify_password_async("secret", hashed),
+            passwords.verify_password_async("wrong", hashed),
+        )
+        return hashed, results
+
+    hashed, results = asyncio.run(run())
+    assert hashed.startswith("$2b$")
+    assert hashed.split("$")[2] == f"{passwords.BCRYPT_ROUNDS:02d}"
+    assert results == [True, False]
@@ -0,0 +1,86 @@
+import time
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.auth_cache import auth_cache
+from app.database import Base
+from app.main import app, get_db
+from app.patient_cache import PatientCache, patient_cache
+
+def test_patient_cache_expires_and_evicts():
+    cache = PatientCache(max_size=2, ttl=0.05)
+    for therapist_id in (1, 2, 3):
+        cache.put(therapist_id, [therapist_id * 10], cache.marker())
+
+    assert cache.get(1) is None  # Evicted, least recently used
+    assert cache.get(3) == {30}
+    time.sleep(0.06)
+    assert cache.get(3) is None  # Expired
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 2, 1)
+
+def test_patient_cache_follows_assignments():
+    cache = PatientCache()
+    cache.put(1, [10], cache.marker())
+    before = cache.get(1)
+
+    cache.add(1, 11)
+    cache.remove(1, 10)
+    assert cache.get(1) == {11}
+    assert before == {10}  # Sets already handed out do not change
+    # Not cached, left to be loaded on the next lookup
+    cache.add(2, 20)
+    assert cache.get(2) is None
+
+def test_patient_cache_skips_patients_loaded_before_an_assignment():
+    cache = PatientCache()
+    marker = cache.marker()
+    cache.add(1, 11)
+    assert cache.put(1, [10], marker) == {10}
+    assert cache.get(1) is None
+
+@pytest.fixture
+def client(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'patients.db'}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        try:
+            db = TestingSessionLocal()
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    auth_cache.clear()
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    engine.dispose()
+
+def test_therapist_checks_use_cached_patients(client):
+    def sign_up(email, role):
+        client.post("/signup", json={"email": email, "name": email, "password": "patientcache", "role": role})
+        response = client.post("/signin", data={"username": email, "password": "patientcache"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return headers, client.get("/users/me", headers=headers).json()["id"]
+
+    therapist_headers, therapist_id = sign_up("cachetherapist@example.com", "therapist")
+    patient_headers, patient_id = sign_up("cachepatient@example.com", "patient")
+
+    def export_status():
+        return client.get("/export", params={"patient_id": patient_id}, headers=therapist_headers).status_code
+
+    assert export_status() == 403
+    misses = patient_cache.stats()["misses"]
+
+    # Assigning and removing the patient updates the cached set instead of dropping it
+    assert client.post(f"/assign-therapist/{therapist_id}", headers=patient_headers).status_code == 200
+    assert export_status() == 200
+    assert client.delete("/unassign-therapist", headers=patient_headers).status_code == 200
+    assert export_status() == 403
+    assert patient_cache.stats()["misses"] == misses
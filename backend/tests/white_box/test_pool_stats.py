@@ -0,0 +1,55 @@
+import threading
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc, text
+from app.main import app
+from app.pool_stats import InstrumentedQueuePool, get_pool_status
+
+def test_pool_stats_record_checkouts_and_timeouts(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        status = get_pool_status(engine.pool)
+        assert status["checked_out"] == 1
+
+        # The only connection is taken, a second checkout has to time out
+        errors = []
+        def checkout():
+            try:
+                engine.connect()
+            except exc.TimeoutError as e:
+                errors.append(e)
+        thread = threading.Thread(target=checkout)
+        thread.start()
+        thread.join()
+        assert len(errors) == 1
+
+    status = get_pool_status(engine.pool)
+    assert status["checked_out"] == 0
+    assert status["checkouts"] == 2
+    assert status["timeouts"] == 1
+    assert status["wait_ms"]["max"] >= 50
+    assert sum(status["wait_ms"]["histogram"].values()) == 2
+    assert status["connection_age_seconds"]["connections"] == 1
+
+    # Stats survive the pool being recreated
+    engine.dispose()
+    assert get_pool_status(engine.pool)["checkouts"] == 2
+    assert get_pool_status(engine.pool)["connection_age_seconds"]["connections"] == 0
+
+def test_admin_pool_requires_token(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "admin")
+    client = TestClient(app)
+
+    assert client.get("/admin/pool?token=wrong").status_code == 403
+
+    response = client.get("/admin/pool?token=admin")
+    assert response.status_code == 200
+    assert response.json()["sync"]["pool"] == "InstrumentedQueuePool"
+    assert response.json()["async"]["pool"] == "InstrumentedAsyncQueuePool"
@@ -0,0 +1,39 @@
+from sqlalchemy import create_engine, text
+from app import query_stats
+
+
+def test_track_counts_statements_in_context():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+        with query_stats.track() as stats:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        connection.execute(text("SELECT 3"))
+
+    assert stats.count == 2
+    assert stats.duration_ms >= 0
+    assert stats.server_timing().endswith('desc="2 queries"')
+    assert query_stats.current_stats.get() is None
+
+
+def test_slow_queries_are_logged_with_parameters(monkeypatch, capsys):
+    monkeypatch.setattr(query_stats, "SLOW_QUERY_MS", 0)
+    engine = create_engine("sqlite:///:memory:")
+    with engine.connect() as connection:
+        connection.execute(text("SELECT :value"), {"value": 42})
+
+    output = capsys.readouterr().out
+    assert "Slow query" in output
+    assert "SELECT ?" in output
+    assert "42" in output
+
+
+def test_failed_statement_does_not_leak_start_time():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.connect() as connection:
+        try:
+            connection.execute(text("SELECT * FROM missing_table"))
+        except Exception:
+            pass
+        assert connection.info["query_start"] == []
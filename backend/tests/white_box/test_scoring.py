@@ -0,0 +1,66 @@
+import asyncio
+import aiohttp
+from app.scoring import get_severity, score_timelines
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self):
+        return self.body
+
+class FakeSession:
+    """
+    Stands in for aiohttp.ClientSession, failing the first `failures` calls per chunk
+    """
+    def __init__(self, failures=0, always_fail_ids=()):
+        self.failures = failures
+        self.always_fail_ids = set(always_fail_ids)
+        self.attempts = {}
+
+    def post(self, endpoint, json, timeout):
+        ids = tuple(timeline["patient_id"] for timeline in json)
+        self.attempts[ids] = self.attempts.get(ids, 0) + 1
+        if self.always_fail_ids & set(ids) or self.attempts[ids] <= self.failures:
+            raise aiohttp.ClientConnectionError("connection refused")
+        return FakeResponse(200, {str(i): {"logits": [0.0], "probas": [0.5]} for i in ids})
+
+def timelines(n):
+    return [{"patient_id": i, "data": []} for i in range(1, n + 1)]
+
+def test_get_severity():
+    assert get_severity(0.9) == "Severe"
+    assert get_severity(0.65) == "Moderately Severe"
+    assert get_severity(0.4) == "Moderate"
+    assert get_severity(0.2) == "Mild"
+    assert get_severity(0.1) == "None"
+
+def test_score_timelines_chunks_and_retries():
+    session = FakeSession(failures=1)
+    report = asyncio.run(score_timelines(
+        session, "http://model/check/bulk", timelines(5), bulk_size=2, concurrency=2, backoff=0
+    ))
+
+    assert report.model_calls == 3
+    assert report.probabilities == {i: 0.5 for i in range(1, 6)}
+    assert all(attempts == 2 for attempts in session.attempts.values())
+    assert report.to_dict()["failed"] == 0
+
+def test_score_timelines_reports_failures():
+    session = FakeSession(always_fail_ids=[3])
+    report = asyncio.run(score_timelines(
+        session, "http://model/check/bulk", timelines(4), bulk_size=2, retries=1, backoff=0
+    ))
+
+    summary = report.to_dict()
+    assert summary["scored"] == 2
+    assert summary["failed"] == 2
+    assert summary["failures"][0]["patient_ids"] == [3, 4]
+    assert session.attempts[(3, 4)] == 2
@@ -1,16 +1,16 @@
+import asyncio
 import datetime
 from io import BytesIO
 import os
 import traceback
 from types import SimpleNamespace
-from typing import List, Optional
+from typing import Dict, List, Optional
 import aiohttp
 from fastapi import Body, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import torch
 import time
-from sentence_transformers import SentenceTransformer
 from transformers import (
     CLIPProcessor, CLIPVisionModel,
     RobertaModel, RobertaTokenizer,
@@ -18,6 +18,7 @@ from transformers import (
 )
 
 import nomenclature
+from serving import EncoderRegistry, MicroBatcher
 from utils import extend_config, load_model
 from PIL import Image, UnidentifiedImageError
 
@@ -75,121 +76,125 @@ def load_args(args):
 
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 
-def process_inputs(inputs, model, args, embs_type):
-    device = next(model.parameters()).device
-
-    # Ensure inputs list length matches window_size
-    window_size = args.window_size
+def window_inputs(inputs, window_size):
+    """
+    Pad or truncate a timeline so that its length matches window_size
+    """
     seq_len = len(inputs)
 
-    # Adjust inputs to match window_size
     if seq_len < window_size:
         num_padding = window_size - seq_len
         padding_inputs = [{'text': None, 'image': None, 'timestamp': 0.0} for _ in range(num_padding)]
-        inputs.extend(padding_inputs)
-    elif seq_len > window_size:
-        inputs = inputs[:window_size]
+        return inputs + padding_inputs
+    return inputs[:window_size]
+
+
+def scatter_embeddings(encoder, items, payloads, positions, num_samples, window_size, embedding_dim, device):
+    """
+    Encode all items in one pass and place each embedding at its (sample, position) slot.
+    Items whose payload is already in the encoder's embedding cache are not encoded again.
+    """
+    embeddings = torch.zeros((num_samples, window_size, embedding_dim), device=device)
+    mask = torch.zeros((num_samples, 1, window_size), device=device)
+
+    if len(items) > 0:
+        encoded = encoder.encode_cached(items, payloads)
+        for (sample_idx, idx), emb in zip(positions, encoded):
+            embeddings[sample_idx, idx] = emb
+            mask[sample_idx, 0, idx] = 1
+
+    return embeddings, mask
+
+
+def build_samples(timelines, model, args, encoders):
+    """
+    Encode many timelines of entries into model input samples, each with a batch dimension of 1.
+    The texts and images of every timeline are encoded together in one pass per encoder.
+    """
+    device = next(model.parameters()).device
+    window_size = args.window_size
+    timelines = [window_inputs(inputs, window_size) for inputs in timelines]
 
-    # Now, seq_len == window_size
     texts = []
-    text_indices = []
+    text_payloads = []
+    text_positions = []
     images = []
-    image_indices = []
-    timestamps = []
-
-    for idx, input_item in enumerate(inputs):
-        timestamps.append(input_item['timestamp'])
-
-        if 'text' in input_item and input_item['text'] is not None:
-            texts.append(input_item['text'])
-            text_indices.append(idx)
-
-        if 'image' in input_item and input_item['image'] is not None:
-            images.append(input_item['image'])
-            image_indices.append(idx)
-
-    # Process text embeddings
-    if len(texts) > 0:
-        text_config = embs_type['text'][args.text_embeddings_type]
-        model_name = text_config['model_name']
-
-        if args.text_embeddings_type in ['roberta', 'emoberta']:
-            text_encoder = SentenceTransformer(model_name).to(device)
-            text_embeddings_list = text_encoder.encode(texts, convert_to_tensor=True)
-        else:
-            raise ValueError(f"Unsupported text embedding type: {args.text_embeddings_type}")
-
-        # Get the actual embedding dimension
-        text_embedding_dim = text_embeddings_list.shape[-1]
-        # Initialize text_embeddings with the correct dimension
-        text_embeddings = torch.zeros((window_size, text_embedding_dim), device=device)
-        text_mask = torch.zeros((1, 1, window_size), device=device)
-
-        # Place embeddings into the tensor
-        for idx, emb in zip(text_indices, text_embeddings_list):
-            text_embeddings[idx] = emb
-            text_mask[0, 0, idx] = 1
-    else:
-        # If no text embeddings, initialize with zeros of expected dimension
-        text_embedding_dim = args.TEXT_EMBEDDING_SIZES[args.text_embeddings_type]
-        text_embeddings = torch.zeros((window_size, text_embedding_dim), device=device)
-        text_mask = torch.zeros((1, 1, window_size), device=device)
-
-    # Process image embeddings
-    if len(images) > 0:
-        image_config = embs_type['image'][args.image_embeddings_type]
-        image_model_name = image_config['model_name']
-        image_model_class = image_config['model_class']
-        image_input_representation = image_config['input_representation']
-        image_processor = image_input_representation.from_pretrained(image_model_name)
-        image_model = image_model_class.from_pretrained(image_model_name).to(device)
-
-        image_inputs = image_processor(images=images, return_tensors="pt").to(device)
-        with torch.no_grad():
-            if args.image_embeddings_type == 'clip':
-                image_outputs = image_model(**image_inputs)
-                image_embeddings_list = image_outputs.last_hidden_state.mean(dim=1)
-            else:
-                raise ValueError(f"Unsupported image embedding type: {args.image_embeddings_type}")
-
-        # Get the actual embedding dimension
-        image_embedding_dim = image_embeddings_list.shape[-1]
-        # Initialize image_embeddings with the correct dimension
-        image_embeddings = torch.zeros((window_size, image_embedding_dim), device=device)
-        image_mask = torch.zeros((1, 1, window_size), device=device)
-
-        # Place embeddings into the tensor
-        for idx, emb in zip(image_indices, image_embeddings_list):
-            image_embeddings[idx] = emb
-            image_mask[0, 0, idx] = 1
-    else:
-        # If no image embeddings, initialize with zeros of expected dimension
-        image_embedding_dim = args.IMAGE_EMBEDDING_SIZES[args.image_embeddings_type]
-        image_embeddings = torch.zeros((window_size, image_embedding_dim), device=device)
-        image_mask = torch.zeros((1, 1, window_size), device=device)
-
-    # Prepare time tensor
-    time_tensor = torch.tensor(timestamps, dtype=torch.float32, device=device)
-    time_tensor = time_tensor.view(-1, window_size)
-
-    # Prepare the input sample
-    sample = {
-        'image_embeddings': image_embeddings.unsqueeze(0),  # Shape: (1, window_size, embedding_dim)
-        'text_embeddings': text_embeddings.unsqueeze(0),    # Shape: (1, window_size, embedding_dim)
-        'image_mask': image_mask,                           # Shape: (1, 1, window_size)
-        'text_mask': text_mask,                             # Shape: (1, 1, window_size)
-        'time': time_tensor,                                # Shape: (batch_size, window_size)
-        'label': torch.tensor([0.0]),  # Dummy label
-    }
+    image_payloads = []
+    image_positions = []
+
+    for sample_idx, inputs in enumerate(timelines):
+        for idx, input_item in enumerate(inputs):
+            if 'text' in input_item and input_item['text'] is not None:
+                texts.append(input_item['text'])
+                text_payloads.append(input_item['text'].encode('utf-8'))
+                text_positions.append((sample_idx, idx))
+
+            if 'image' in input_item and input_item['image'] is not None:
+                images.append(input_item['image'])
+                image_payloads.append(input_item['image_data'])
+                image_positions.append((sample_idx, idx))
+
+    text_embeddings, text_mask = scatter_embeddings(
+        encoders.get('text', args.text_embeddings_type),
+        texts,
+        text_payloads,
+        text_positions,
+        len(timelines),
+        window_size,
+        args.TEXT_EMBEDDING_SIZES[args.text_embeddings_type],
+        device,
+    )
+    image_embeddings, image_mask = scatter_embeddings(
+        encoders.get('image', args.image_embeddings_type),
+        images,
+        image_payloads,
+        image_positions,
+        len(timelines),
+        window_size,
+        args.IMAGE_EMBEDDING_SIZES[args.image_embeddings_type],
+        device,
+    )
+
+    samples = []
+    for sample_idx, inputs in enumerate(timelines):
+        timestamps = [input_item['timestamp'] for input_item in inputs]
+        samples.append({
+            'image_embeddings': image_embeddings[sample_idx:sample_idx + 1],  # Shape: (1, window_size, embedding_dim)
+            'text_embeddings': text_embeddings[sample_idx:sample_idx + 1],    # Shape: (1, window_size, embedding_dim)
+            'image_mask': image_mask[sample_idx:sample_idx + 1],              # Shape: (1, 1, window_size)
+            'text_mask': text_mask[sample_idx:sample_idx + 1],                # Shape: (1, 1, window_size)
+            'time': torch.tensor([timestamps], dtype=torch.float32, device=device),  # Shape: (1, window_size)
+            'label': torch.tensor([0.0], device=device),  # Dummy label
+        })
+
+    return samples
+
+
+def build_sample(inputs, model, args, encoders):
+    """
+    Encode one timeline of entries into a model input sample with a batch dimension of 1
+    """
+    return build_samples([inputs], model, args, encoders)[0]
+
 
-    # Move sample to device
-    for key in sample:
-        sample[key] = sample[key].to(device)
+def collate_samples(samples):
+    """
+    Stack samples built by `build_sample` into a single batch
+    """
+    return {key: torch.cat([sample[key] for sample in samples], dim=0) for key in samples[0]}
 
-    # Run the model
+
+def run_batch(samples):
+    """
+    Run one forward pass over a list of samples and split the output per sample
+    """
+    batch = collate_samples(samples)
     with torch.no_grad():
-        output = model(sample)
-    return output
+        output = model(batch)
+
+    logits = output['logits'].cpu().numpy().tolist()
+    probas = output['probas'].cpu().numpy().tolist()
+    return [{"logits": logits[i], "probas": probas[i]} for i in range(len(samples))]
 
 
 args, cfg = create_args_manually()
@@ -201,14 +206,35 @@ model.eval()
 model = model.to(device)
 print("Model loaded", "using cuda" if torch.cuda.is_available() else "using cpu")
 
+# Load the text and image encoders once, they are shared by every request.
+# Embeddings are cached on disk by content so unchanged entries are never re-encoded.
+encoders = EncoderRegistry(
+    embs_type,
+    device,
+    cache_directory=os.getenv("EMBEDDING_CACHE_DIR") or "embedding_cache",
+    cache_max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_MB") or 1024) * 1024 * 1024,
+)
+encoders.load('text', args.text_embeddings_type)
+encoders.load('image', args.image_embeddings_type)
+
+# Concurrent /check requests are gathered into one forward pass
+batcher = MicroBatcher(
+    run_batch,
+    max_batch_size=int(os.getenv("INFERENCE_MAX_BATCH_SIZE") or 32),
+    max_wait_ms=float(os.getenv("INFERENCE_MAX_WAIT_MS") or 5),
+)
+
 # Create FastAPI app
 async def init_session():
     return aiohttp.ClientSession()
 
 async def startup_event():
     app.state.session = await init_session()
+    batcher.start()
 
 async def shutdown_event():
+    await batcher.stop()
+    encoders.flush()
     await app.state.session.close()
 
 app = FastAPI(on_startup=[startup_event], on_shutdown=[shutdown_event])
@@ -250,6 +276,72 @@ class ResponseBody(BaseModel):
     logits: List[float]
     probas: List[float]
 
+class PatientTimeline(BaseModel):
+    """
+    Data model for one patient's entries in the bulk request body
+    """
+    patient_id: int
+    data: List[Entry]
+
+async def fetch_image(url: str):
+    """
+    Fetch and open an image from the backend
+    :param url: str - The URL (or backend path) of the image
+    :return: Optional[Tuple[Image.Image, bytes]] - The image and its raw bytes, None if it could not be fetched or opened
+    """
+    if not url.startswith("http"):
+        url = backend_endpoint + url
+    try:
+        # Fetch the image from the URL with timeout
+        async with app.state.session.get(url) as response:
+            response.raise_for_status()
+            image_data = await response.read()  # This reads the entire response body as bytes
+
+        # Open the image from the response content
+        return Image.open(BytesIO(image_data)), image_data
+    except aiohttp.ClientError as e:
+        print(f"Error fetching image: {url}")
+        print(f"Error details: {str(e)}")
+        traceback.print_exc()
+    except UnidentifiedImageError as e:
+        print(f"Error opening image: {url}")
+        print(f"Error details: {str(e)}")
+        traceback.print_exc()
+    except Exception as e:
+        print(f"Unexpected error processing image: {url}")
+        print(f"Error details: {str(e)}")
+        traceback.print_exc()
+    return None
+
+async def prepare_entry(data: Entry):
+    """
+    Convert a request entry into a model input item, entries whose image fails to load are dropped
+    """
+    timestamp = data.timestamp
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    item = {
+        'timestamp': datetime.datetime.fromisoformat(timestamp).timestamp()
+    }
+
+    if data.text:
+        item['text'] = data.text
+
+    if data.image:
+        fetched = await fetch_image(data.image)
+        if fetched is None:
+            return None
+        item['image'], item['image_data'] = fetched
+
+    return item
+
+async def prepare_entries(entries: List[Entry]):
+    """
+    Convert request entries into model input items, fetching their images concurrently
+    """
+    items = await asyncio.gather(*[prepare_entry(data) for data in entries])
+    return [item for item in items if item is not None]
+
 @app.post("/check", response_model=ResponseBody)
 async def check(body: RequestBody):
     """
@@ -257,54 +349,31 @@ async def check(body: RequestBody):
     It processes the entries and returns the logits and probabilities of the model.
     """
 
-    processed = []
-    for data in body.data:
-        print(data)
-        timestamp = data.timestamp
-        if timestamp.endswith('Z'):
-            timestamp = timestamp[:-1] + '+00:00'
-        item = {
-            'timestamp': datetime.datetime.fromisoformat(timestamp).timestamp()
-        }
-        
-        if data.text:
-            item['text'] = data.text
-        
-        if data.image:
-            if not data.image.startswith("http"):
-                data.image = backend_endpoint + data.image
-            try:
-                # Fetch the image from the URL with timeout
-                async with app.state.session.get(data.image) as response:
-                    response.raise_for_status()
-                    image_data = await response.read()  # This reads the entire response body as bytes
-
-                # Open the image from the response content
-                image = Image.open(BytesIO(image_data))
-                item['image'] = image
-            except aiohttp.ClientError as e:
-                print(f"Error fetching image: {data.image}")
-                print(f"Error details: {str(e)}")
-                traceback.print_exc()
-                continue
-            except UnidentifiedImageError as e:
-                print(f"Error opening image: {data.image}")
-                print(f"Error details: {str(e)}")
-                traceback.print_exc()
-                continue
-            except Exception as e:
-                print(f"Unexpected error processing image: {data.image}")
-                print(f"Error details: {str(e)}")
-                traceback.print_exc()
-                continue
-        
-        processed.append(item)
-    output = process_inputs(processed, model, args, embs_type)
+    processed = await prepare_entries(body.data)
+    sample = await asyncio.to_thread(build_sample, processed, model, args, encoders)
+    output = await batcher.submit(sample)
     print(output)
-    return {
-        "logits": output['logits'].cpu().numpy().tolist()[0],
-        "probas": output['probas'].cpu().numpy().tolist()[0]
-    }
+    return output
+
+@app.post("/check/bulk", response_model=Dict[int, ResponseBody])
+async def check_bulk(body: List[PatientTimeline]):
+    """
+    This endpoint receives the entries of many patients and returns the logits and probabilities
+    of the model keyed by patient ID. The texts and images of all patients are encoded together,
+    and the forward passes are batched.
+    """
+
+    timelines = await asyncio.gather(*[prepare_entries(patient.data) for patient in body])
+    samples = await asyncio.to_thread(build_samples, list(timelines), model, args, encoders)
+    outputs = await asyncio.gather(*[batcher.submit(sample) for sample in samples])
+    return {patient.patient_id: output for patient, output in zip(body, outputs)}
+
+@app.get("/encoders")
+async def get_encoders():
+    """
+    This endpoint reports the resident encoders with their load time and memory use.
+    """
+    return {"encoders": encoders.stats()}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,3 @@
+from .encoders import EncoderRegistry
+from .batching import MicroBatcher
+from .embedding_cache import EmbeddingCache
@@ -0,0 +1,87 @@
+import asyncio
+
+
+class MicroBatcher(object):
+    """
+    Gathers concurrently submitted samples for up to `max_wait_ms` (or until
+    `max_batch_size` samples are queued) and runs them through `run_batch` in
+    a single call. `run_batch` receives a list of samples and must return one
+    output per sample, in the same order.
+    """
+
+    def __init__(self, run_batch, max_batch_size=32, max_wait_ms=5):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self.worker = None
+        # Samples taken off the queue and not answered yet
+        self.batch = []
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker is None:
+            return
+
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+
+        # Fail whatever is still waiting, in flight or queued, so no caller hangs forever
+        pending = self.batch
+        self.batch = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher stopped"))
+
+    async def submit(self, sample):
+        """
+        :param sample: A single model input sample
+        :return: The output of `run_batch` for this sample
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sample, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        self.batch = batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            samples = [sample for sample, _ in batch]
+
+            try:
+                # The forward pass is blocking, keep it off the event loop
+                outputs = await loop.run_in_executor(None, self.run_batch, samples)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
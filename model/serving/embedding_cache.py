@@ -0,0 +1,184 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Bytes of the SHA-256 key stored next to each vector
+KEY_BYTES = 32
+
+
+class EmbeddingCache(object):
+    """
+    Content-addressed store of float32 embeddings for one encoder.
+
+    Vectors live in a memory-mapped file of `capacity` rows, next to a second one
+    holding the key of each row, and a SQLite index maps each key to its row. Keys
+    are kept in least-recently-used order, and once every row is taken the least
+    recently used key gives up its row.
+
+    The index is only written every `flush_every` writes, so after a crash it can
+    point a key at a row that was given to another key since. On load, entries
+    whose row holds another key are dropped and their rows reused.
+    """
+
+    def __init__(self, directory, name, dim, capacity, flush_every=1024):
+        os.makedirs(directory, exist_ok=True)
+        self.name = name
+        self.dim = dim
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self.keys_path = os.path.join(directory, f"{name}.keys")
+        self.index_path = os.path.join(directory, f"{name}.index.sqlite")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.unflushed = 0
+
+        self.db = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (dim INTEGER, capacity INTEGER)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER NOT NULL, used INTEGER NOT NULL)"
+        )
+        meta = self.db.execute("SELECT dim, capacity FROM meta").fetchone()
+        # A resized cache starts over
+        reuse = (
+            meta == (dim, capacity)
+            and os.path.exists(self.vectors_path)
+            and os.path.exists(self.keys_path)
+        )
+
+        # key -> row, oldest first
+        self.index = OrderedDict()
+        # key -> (row, last used) to write to the index, or None to delete
+        self.dirty = {}
+        self.clock = 0
+        if reuse:
+            for key, row, used in self.db.execute("SELECT key, row, used FROM entries ORDER BY used"):
+                self.index[key] = row
+                self.clock = used
+        else:
+            with self.db:
+                self.db.execute("DELETE FROM entries")
+                self.db.execute("DELETE FROM meta")
+                self.db.execute("INSERT INTO meta VALUES (?, ?)", (dim, capacity))
+
+        mode = "r+" if reuse else "w+"
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dim))
+        self.row_keys = np.memmap(self.keys_path, dtype=np.uint8, mode=mode, shape=(capacity, KEY_BYTES))
+        stale = [key for key, row in self.index.items() if self.row_keys[row].tobytes() != bytes.fromhex(key)]
+        if stale:
+            for key in stale:
+                del self.index[key]
+            with self.db:
+                self.db.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key in stale])
+        self.stale = len(stale)
+        used = set(self.index.values())
+        self.free_rows = [row for row in range(capacity - 1, -1, -1) if row not in used]
+
+    @staticmethod
+    def entry_bytes(dim):
+        """
+        :param dim: int - The embedding dimension
+        :return: int - The disk space taken by one entry
+        """
+        return dim * 4 + KEY_BYTES
+
+    @staticmethod
+    def key(payload, encoder_name):
+        """
+        :param payload: bytes - The raw text or image bytes
+        :param encoder_name: str - The model name of the encoder
+        :return: str - The content address of the embedding
+        """
+        digest = hashlib.sha256()
+        digest.update(encoder_name.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(payload)
+        return digest.hexdigest()
+
+    def _touch(self, key, row):
+        self.clock += 1
+        self.dirty[key] = (row, self.clock)
+
+    def get_many(self, keys):
+        """
+        :param keys: List[str] - The keys to look up
+        :return: Dict[str, np.ndarray] - A copy of every cached vector found
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                row = self.index.get(key)
+                if row is None:
+                    self.misses += 1
+                    continue
+                self.index.move_to_end(key)
+                self._touch(key, row)
+                found[key] = np.array(self.vectors[row])
+                self.hits += 1
+        return found
+
+    def put_many(self, vectors):
+        """
+        :param vectors: Dict[str, np.ndarray] - The vectors to store, keyed by content address
+        """
+        with self.lock:
+            for key, vector in vectors.items():
+                row = self.index.get(key)
+                if row is None:
+                    if self.free_rows:
+                        row = self.free_rows.pop()
+                    else:
+                        evicted, row = self.index.popitem(last=False)
+                        self.dirty[evicted] = None
+                        self.evictions += 1
+                    self.index[key] = row
+                else:
+                    self.index.move_to_end(key)
+                # Clear the row's key first, so a crash halfway leaves a row no key matches
+                self.row_keys[row] = 0
+                self.vectors[row] = vector
+                self.row_keys[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                self._touch(key, row)
+                self.unflushed += 1
+
+            if self.unflushed >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.vectors.flush()
+        self.row_keys.flush()
+        # Only the keys that changed since the last flush are written
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM entries WHERE key = ?",
+                [(key,) for key, entry in self.dirty.items() if entry is None],
+            )
+            self.db.executemany(
+                "INSERT INTO entries (key, row, used) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET row = excluded.row, used = excluded.used",
+                [(key, row, used) for key, entry in self.dirty.items() if entry is not None for row, used in [entry]],
+            )
+        self.dirty.clear()
+        self.unflushed = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.index),
+                "capacity": self.capacity,
+                "size_bytes": self.capacity * self.entry_bytes(self.dim),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
@@ -0,0 +1,198 @@
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from sentence_transformers import SentenceTransformer
+
+from .embedding_cache import EmbeddingCache
+
+
+class Encoder(object):
+    """
+    A text or image encoder that is loaded once and kept resident for the
+    lifetime of the process.
+    """
+
+    def __init__(self, name, config, device):
+        self.name = name
+        self.config = config
+        self.device = device
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.cache = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def encode(self, items):
+        raise NotImplementedError
+
+    def warmup(self):
+        raise NotImplementedError
+
+    def modules(self):
+        raise NotImplementedError
+
+    def encode_cached(self, items, payloads):
+        """
+        Encode items, only running the encoder on those whose payload is not cached yet
+        :param items: List - The texts or images to encode
+        :param payloads: List[bytes] - The raw bytes each item was built from
+        :return: torch.Tensor - (len(items), embedding_dim) embeddings on the encoder device
+        """
+        if self.cache is None:
+            return self.encode(items)
+
+        keys = [EmbeddingCache.key(payload, self.config["model_name"]) for payload in payloads]
+        vectors = self.cache.get_many(keys)
+
+        # Encode each missing payload once, even if it shows up several times
+        missing = {}
+        for item, key in zip(items, keys):
+            if key not in vectors and key not in missing:
+                missing[key] = item
+
+        if len(missing) > 0:
+            encoded = self.encode(list(missing.values())).float().cpu().numpy()
+            new_vectors = dict(zip(missing.keys(), encoded))
+            self.cache.put_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return torch.from_numpy(np.stack([vectors[key] for key in keys])).to(self.device)
+
+    def memory_bytes(self):
+        total = 0
+        for module in self.modules():
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                total += tensor.numel() * tensor.element_size()
+        return total
+
+
+class TextEncoder(Encoder):
+    def load(self):
+        self.model = SentenceTransformer(self.config["model_name"]).to(self.device)
+        self.model.eval()
+
+    def encode(self, texts, batch_size=64):
+        """
+        :param texts: List[str] - The texts to encode
+        :param batch_size: int - How many texts go through the encoder at once
+        :return: torch.Tensor - (len(texts), embedding_dim) embeddings on the encoder device
+        """
+        return self.model.encode(texts, batch_size=batch_size, convert_to_tensor=True, device=str(self.device))
+
+    def warmup(self):
+        return self.encode(["warmup"])
+
+    def modules(self):
+        return [self.model]
+
+
+class ImageEncoder(Encoder):
+    def load(self):
+        self.processor = self.config["input_representation"].from_pretrained(self.config["model_name"])
+        self.model = self.config["model_class"].from_pretrained(self.config["model_name"]).to(self.device)
+        self.model.eval()
+
+    def encode(self, images, batch_size=32):
+        """
+        :param images: List[PIL.Image] - The images to encode
+        :param batch_size: int - How many images go through the encoder at once
+        :return: torch.Tensor - (len(images), embedding_dim) embeddings on the encoder device
+        """
+        embeddings = []
+        for start in range(0, len(images), batch_size):
+            inputs = self.processor(images=images[start:start + batch_size], return_tensors="pt").to(self.device)
+            with torch.no_grad():
+                outputs = self.model(**inputs)
+            embeddings.append(outputs.last_hidden_state.mean(dim=1))
+        return torch.cat(embeddings, dim=0)
+
+    def warmup(self):
+        return self.encode([Image.new("RGB", (224, 224))])
+
+    def modules(self):
+        return [self.model]
+
+
+ENCODER_CLASSES = {
+    "text": {
+        "roberta": TextEncoder,
+        "emoberta": TextEncoder,
+    },
+    "image": {
+        "clip": ImageEncoder,
+    },
+}
+
+
+class EncoderRegistry(object):
+    """
+    Resident encoders keyed by modality and embedding type (the entries of `embs_type`).
+    Each encoder is loaded and warmed up once, then shared by every request.
+    When `cache_directory` is set, each encoder gets an EmbeddingCache so unchanged
+    entries are not encoded again. One encoder is loaded per modality, and
+    `cache_max_bytes` is split evenly between them.
+    """
+
+    def __init__(self, embs_type, device, cache_directory=None, cache_max_bytes=0):
+        self.embs_type = embs_type
+        self.device = device
+        self.cache_directory = cache_directory
+        self.cache_max_bytes = cache_max_bytes
+        self.encoders = {}
+
+    def load(self, modality, embeddings_type):
+        key = (modality, embeddings_type)
+        if key in self.encoders:
+            return self.encoders[key]
+
+        if embeddings_type not in ENCODER_CLASSES.get(modality, {}):
+            raise ValueError(f"Unsupported {modality} embedding type: {embeddings_type}")
+
+        encoder_class = ENCODER_CLASSES[modality][embeddings_type]
+        encoder = encoder_class(embeddings_type, self.embs_type[modality][embeddings_type], self.device)
+
+        start = time.perf_counter()
+        encoder.load()
+        encoder.load_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        embeddings = encoder.warmup()
+        encoder.warmup_seconds = time.perf_counter() - start
+
+        dim = embeddings.shape[-1]
+        capacity = self.cache_max_bytes // len(self.embs_type) // EmbeddingCache.entry_bytes(dim)
+        if self.cache_directory is not None and capacity > 0:
+            encoder.cache = EmbeddingCache(self.cache_directory, f"{modality}-{embeddings_type}", dim, capacity)
+
+        print(f"::: Loaded {modality} encoder {embeddings_type} in {encoder.load_seconds:.2f}s")
+        self.encoders[key] = encoder
+        return encoder
+
+    def get(self, modality, embeddings_type):
+        key = (modality, embeddings_type)
+        if key not in self.encoders:
+            raise KeyError(f"{modality} encoder {embeddings_type} has not been loaded")
+        return self.encoders[key]
+
+    def flush(self):
+        for encoder in self.encoders.values():
+            if encoder.cache is not None:
+                encoder.cache.flush()
+
+    def stats(self):
+        return [
+            {
+                "modality": modality,
+                "embeddings_type": embeddings_type,
+                "model_name": encoder.config["model_name"],
+                "device": str(self.device),
+                "load_seconds": encoder.load_seconds,
+                "warmup_seconds": encoder.warmup_seconds,
+                "memory_bytes": encoder.memory_bytes(),
+                "cache": encoder.cache.stats() if encoder.cache is not None else None,
+            }
+            for (modality, embeddings_type), encoder in self.encoders.items()
+        ]